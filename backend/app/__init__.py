@@ -19,11 +19,17 @@ def create_app():
     from app.routes.experimentos_routes import experimentos_bp
     app.register_blueprint(experimentos_bp, url_prefix="/api/experimentos")
 
+    from app.routes.busqueda_routes import busqueda_bp
+    app.register_blueprint(busqueda_bp, url_prefix="/api/busquedas")
+
     from app.routes.dashboard_routes import dashboard_bp
     app.register_blueprint(dashboard_bp, url_prefix="/api")
 
     from app.routes.prediccion_routes import prediccion_bp
     app.register_blueprint(prediccion_bp, url_prefix='/api')
+
+    from app.routes.metricas_routes import metricas_bp
+    app.register_blueprint(metricas_bp, url_prefix="/api")
     
 
     return app
\ No newline at end of file
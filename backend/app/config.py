@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -8,3 +9,74 @@ class Config:
     SUPABASE_KEY = os.getenv("SUPABASE_KEY")
     PORT = int(os.getenv("PORT", 5000))
     DEBUG = os.getenv("DEBUG", "False").lower() == "true"
+
+    # Caché local de datasets (compartida por todos los workers de gunicorn)
+    DATASET_CACHE_DIR = os.getenv("DATASET_CACHE_DIR", os.path.join(tempfile.gettempdir(), "datasets_cache"))
+    DATASET_CACHE_MAX_MB = int(os.getenv("DATASET_CACHE_MAX_MB", 2048))
+    # Filas por bloque en la lectura por chunks de datasets grandes
+    DATASET_CHUNK_FILAS = int(os.getenv("DATASET_CHUNK_FILAS", 100000))
+    # Cada cuántas filas se anota un offset en el índice de filas del CSV (vista previa por rangos)
+    VISTA_PREVIA_PASO_INDICE = int(os.getenv("VISTA_PREVIA_PASO_INDICE", 1000))
+    # Reducir tipos (int8/16/32, category) al cargar DataFrames completos
+    DATASET_COMPACTAR = os.getenv("DATASET_COMPACTAR", "False").lower() == "true"
+    # Hilos del pool que calcula en paralelo los análisis de un lote (/analisis-lote)
+    ANALISIS_LOTE_HILOS = int(os.getenv("ANALISIS_LOTE_HILOS", 4))
+    # Tablas de scores de inversión guardadas en memoria por worker (una por dataset y versión)
+    SCORES_CACHE_ENTRADAS = int(os.getenv("SCORES_CACHE_ENTRADAS", 8))
+
+    # Error relativo máximo de los sketches de cuantiles (boxplot/segmentación con ?aproximado=true)
+    CUANTILES_ALFA = float(os.getenv("CUANTILES_ALFA", 0.01))
+    # Hilos que resumen chunks en paralelo al acumular los momentos (correlación/sensibilidad)
+    MOMENTOS_HILOS = int(os.getenv("MOMENTOS_HILOS", 4))
+    # Procesos del pool compartido para trabajo de CPU (barrido de k, búsquedas...)
+    PROCESOS_MAX = int(os.getenv("PROCESOS_MAX", os.cpu_count() or 2))
+    # Por encima de estas filas el clustering usa MiniBatchKMeans en vez de KMeans completo
+    CLUSTERING_UMBRAL_FILAS = int(os.getenv("CLUSTERING_UMBRAL_FILAS", 50000))
+    CLUSTERING_LOTE = int(os.getenv("CLUSTERING_LOTE", 4096))
+    # Filas de la muestra con la que se calcula el coeficiente de silueta
+    CLUSTERING_MUESTRA_SILUETA = int(os.getenv("CLUSTERING_MUESTRA_SILUETA", 10000))
+    # Modelos de clustering (y sus etiquetas) guardados en memoria por worker
+    CLUSTERING_CACHE_ENTRADAS = int(os.getenv("CLUSTERING_CACHE_ENTRADAS", 8))
+    # Modelos de anomalías (IsolationForest): filas máximas del ajuste, núcleos y modelos en memoria por worker
+    ANOMALIAS_MUESTRA_AJUSTE = int(os.getenv("ANOMALIAS_MUESTRA_AJUSTE", 100000))
+    ANOMALIAS_N_JOBS = int(os.getenv("ANOMALIAS_N_JOBS", -1))
+    ANOMALIAS_CACHE_ENTRADAS = int(os.getenv("ANOMALIAS_CACHE_ENTRADAS", 8))
+    # Propiedades máximas por petición de /anomalias-precios/puntuar
+    ANOMALIAS_MAX_LOTE = int(os.getenv("ANOMALIAS_MAX_LOTE", 10000))
+    # Puntos máximos de los gráficos de dispersión/3D/burbujas y resultados reducidos guardados en memoria por worker
+    GRAFICOS_MAX_PUNTOS = int(os.getenv("GRAFICOS_MAX_PUNTOS", 5000))
+    GRAFICOS_CACHE_ENTRADAS = int(os.getenv("GRAFICOS_CACHE_ENTRADAS", 16))
+    # Modelos de experimentos cargados en memoria por worker (predicción y sensibilidad por modelo)
+    MODELOS_CACHE_ENTRADAS = int(os.getenv("MODELOS_CACHE_ENTRADAS", 8))
+    # Sensibilidad por modelo: filas de fondo, puntos por curva y filas por predicción antes de repartir en procesos
+    SENSIBILIDAD_MUESTRA_FONDO = int(os.getenv("SENSIBILIDAD_MUESTRA_FONDO", 500))
+    SENSIBILIDAD_PUNTOS = int(os.getenv("SENSIBILIDAD_PUNTOS", 20))
+    SENSIBILIDAD_FILAS_POR_BLOQUE = int(os.getenv("SENSIBILIDAD_FILAS_POR_BLOQUE", 200000))
+    # Cola de entrenamientos: procesos por worker, segundos entre volcados de progreso y duración máxima de cada stream SSE
+    ENTRENAMIENTO_PROCESOS = int(os.getenv("ENTRENAMIENTO_PROCESOS", 2))
+    ENTRENAMIENTO_INTERVALO_PROGRESO = float(os.getenv("ENTRENAMIENTO_INTERVALO_PROGRESO", 1.0))
+    ENTRENAMIENTO_SSE_MAX_SEGUNDOS = int(os.getenv("ENTRENAMIENTO_SSE_MAX_SEGUNDOS", 300))
+    # Red neuronal: cada cuántas épocas se evalúa, paciencia de la parada temprana (0 = desactivada, salvo que el experimento la pida),
+    # fracción de las filas de entrenamiento que se aparta para elegir su mejor época (el test solo informa)
+    # y filas de entrenamiento con las que se calculan las métricas de entrenamiento de cada época
+    ENTRENAMIENTO_INTERVALO_EVALUACION = int(os.getenv("ENTRENAMIENTO_INTERVALO_EVALUACION", 1))
+    ENTRENAMIENTO_PACIENCIA = int(os.getenv("ENTRENAMIENTO_PACIENCIA", 0))
+    ENTRENAMIENTO_FRACCION_PARADA = float(os.getenv("ENTRENAMIENTO_FRACCION_PARADA", 0.1))
+    ENTRENAMIENTO_MUESTRA_EVALUACION = int(os.getenv("ENTRENAMIENTO_MUESTRA_EVALUACION", 20000))
+    # Búsqueda de hiperparámetros: procesos por búsqueda (por defecto y máximo), pruebas máximas, factor de successive
+    # halving, épocas de la primera ronda y candidatas evaluadas con el proceso gaussiano en la estrategia bayesiana
+    BUSQUEDA_CONCURRENCIA = int(os.getenv("BUSQUEDA_CONCURRENCIA", 2))
+    BUSQUEDA_MAX_CONCURRENCIA = int(os.getenv("BUSQUEDA_MAX_CONCURRENCIA", 4))
+    BUSQUEDA_MAX_PRUEBAS = int(os.getenv("BUSQUEDA_MAX_PRUEBAS", 64))
+    BUSQUEDA_REDUCCION = int(os.getenv("BUSQUEDA_REDUCCION", 3))
+    BUSQUEDA_EPOCAS_MINIMAS = int(os.getenv("BUSQUEDA_EPOCAS_MINIMAS", 5))
+    BUSQUEDA_CANDIDATOS_BAYESIANA = int(os.getenv("BUSQUEDA_CANDIDATOS_BAYESIANA", 500))
+    # Validación cruzada ('validacion': 'kfold'): pliegues por defecto y máximos, y procesos que los entrenan en paralelo
+    VALIDACION_PLIEGUES = int(os.getenv("VALIDACION_PLIEGUES", 5))
+    VALIDACION_MAX_PLIEGUES = int(os.getenv("VALIDACION_MAX_PLIEGUES", 20))
+    VALIDACION_PROCESOS = int(os.getenv("VALIDACION_PROCESOS", 2))
+
+    # Sesión HTTP compartida para descargas de datasets y artefactos
+    HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", 10))
+    HTTP_POOL_CONEXIONES = int(os.getenv("HTTP_POOL_CONEXIONES", 10))
+    HTTP_REINTENTOS = int(os.getenv("HTTP_REINTENTOS", 3))
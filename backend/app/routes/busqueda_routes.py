@@ -0,0 +1,49 @@
+# En app/routes/busqueda_routes.py
+
+from flask import Blueprint, request, jsonify
+from app.services.busqueda_hiperparametros_service import encolar_busqueda, estado_busqueda
+from app.services.cola_entrenamientos_service import cancelar_entrenamiento
+
+busqueda_bp = Blueprint("busqueda_bp", __name__)
+
+@busqueda_bp.route("", methods=["POST"])
+def iniciar_busqueda_route():
+    """
+    Recibe la configuración base de entrenamiento más la clave "busqueda" (estrategia, espacio, pruebas,
+    concurrencia...), encola la búsqueda y devuelve al momento su ID (estado 'en_cola').
+    """
+    try:
+        configuracion = request.get_json()
+        if not configuracion:
+            return jsonify({"error": "No se recibió ninguna configuración"}), 400
+        return jsonify(encolar_busqueda(configuracion)), 202
+    except ValueError as ve:
+        print(f"🔥 Error de validación de la búsqueda: {ve}")
+        return jsonify({"error": str(ve)}), 400
+    except Exception as e:
+        print(f"🚨 ERROR en iniciar_busqueda_route: {e}")
+        return jsonify({"error": "Ocurrió un error interno en el servidor"}), 500
+
+@busqueda_bp.route("/<busqueda_id>", methods=["GET"])
+def estado_busqueda_route(busqueda_id):
+    """Estado de la búsqueda y clasificación de sus pruebas (experimentos hijos)."""
+    try:
+        return jsonify(estado_busqueda(busqueda_id)), 200
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        print(f"🚨 ERROR en estado_busqueda_route: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@busqueda_bp.route("/<busqueda_id>/cancelar", methods=["POST"])
+def cancelar_busqueda_route(busqueda_id):
+    """Cancela la búsqueda; sus pruebas en curso se detienen en su próximo control de progreso."""
+    try:
+        return jsonify(cancelar_entrenamiento(busqueda_id)), 200
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        print(f"🚨 ERROR en cancelar_busqueda_route: {e}")
+        return jsonify({"error": str(e)}), 500
@@ -1,5 +1,11 @@
 from flask import Blueprint, request, jsonify, send_file
 from app.services.limpieza_service import limpiar_dataset
+from app.services.perfil_service import obtener_perfil
+from app.services.cuantiles_service import generar_boxplot_aproximado, generar_segmentacion_mercado_aproximada
+from app.services.muestreo_service import validar_reduccion
+from app.services.momentos_service import calcular_correlacion_momentos, generar_analisis_sensibilidad_momentos
+from app.services.sensibilidad_service import generar_sensibilidad_modelo
+from app.services.cubo_service import generar_mapa_calor_cubo, generar_serie_temporal_cubo, generar_segmentacion_mercado_cubo
 from app.services.datasets_service import ( 
     obtener_lista_datasets, 
     subir_dataset_csv_metadata,
@@ -8,23 +14,24 @@ from app.services.datasets_service import (
 )
 from app.services.analisis_service import (
     obtener_dataframe_crudo,
-    obtener_vista_previa_paginada,
-    estadisticas_dataset,
-    obtener_columnas,
-    distribucion_clases,
+    columnas_requeridas,
+    compactar_dataframe,
+    obtener_vista_previa_por_rango,
     generar_histograma,
     generar_boxplot,
-    generar_serie_temporal,
-    generar_mapa_calor,
     generar_datos_3d,
     generar_analisis_radar,
     generar_sankey_flujo,
     generar_grafico_burbujas,
-    generar_analisis_sensibilidad,
     generar_clustering,
-    generar_segmentacion_mercado,
+    generar_barrido_clustering,
     detectar_anomalias_precios,
-    calcular_score_inversion
+    puntuar_anomalias_nuevas,
+    calcular_score_inversion,
+    generar_lote_analisis,
+    generar_grafico_cacheado,
+    LectorPorChunks,
+    generar_histograma_por_chunks
 )
 
 dataset_bp = Blueprint("dataset_bp", __name__)
@@ -103,8 +110,8 @@ def vista_previa(dataset_id):
     """Sirve la vista previa paginada y maneja la conversión de nulos a '[NULL]'."""
     try:
         pagina = int(request.args.get('pagina', 1))
-        df = obtener_dataframe_crudo(dataset_id)
-        datos_paginados = obtener_vista_previa_paginada(df, pagina)
+        # Solo se leen las filas de la página (caché mapeada o rango de bytes del CSV)
+        datos_paginados = obtener_vista_previa_por_rango(dataset_id, pagina)
         return jsonify(datos_paginados), 200
     except Exception as e:
         # Devuelve la estructura de datos esperada para evitar errores de renderizado en el frontend
@@ -115,8 +122,8 @@ def vista_previa(dataset_id):
 def info_columnas(dataset_id):
     """Devuelve la información detallada de las columnas (ColumnaStat[])."""
     try:
-        df = obtener_dataframe_crudo(dataset_id)
-        info = obtener_columnas(df)
+        # Perfil guardado del dataset (calculado al registrarlo)
+        info = obtener_perfil(dataset_id)["columnas"]
         return jsonify(info), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -126,19 +133,40 @@ def info_columnas(dataset_id):
 def estadisticas(dataset_id):
     """Devuelve el resumen estadístico del dataset (EstadisticasDatos)."""
     try:
-        df = obtener_dataframe_crudo(dataset_id)
-        stats = estadisticas_dataset(df)
+        # Perfil guardado del dataset (calculado al registrarlo)
+        stats = obtener_perfil(dataset_id)["estadisticas"]
         return jsonify(stats), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@dataset_bp.route("/datasets/<dataset_id>/correlacion", methods=["GET"])
+def correlacion(dataset_id):
+    """Devuelve la matriz de correlación de las columnas numéricas ({variables, matriz})."""
+    try:
+        # Momentos guardados del dataset (acumulados al registrarlo; no se vuelve a recorrer)
+        return jsonify(calcular_correlacion_momentos(dataset_id)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@dataset_bp.route("/datasets/<dataset_id>/compactacion", methods=["GET"])
+def compactacion(dataset_id):
+    """Informa cuánta memoria ahorraría compactar los tipos del dataset (bytes antes/después por columna)."""
+    try:
+        df = obtener_dataframe_crudo(dataset_id, compactar=False)
+        _, reporte = compactar_dataframe(df, flotantes=request.args.get('flotantes', 'false').lower() == 'true')
+        return jsonify(reporte), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @dataset_bp.route("/datasets/<dataset_id>/distribucion-clases", methods=["GET"])
 def distribucion(dataset_id):
     """Devuelve la distribución de clases (DistribucionClases[])."""
     try:
-        df = obtener_dataframe_crudo(dataset_id)
-        dist = distribucion_clases(df)
+        # Perfil guardado del dataset (calculado al registrarlo)
+        dist = obtener_perfil(dataset_id)["distribucion_clases"]
         return jsonify(dist), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -150,8 +178,8 @@ def distribucion(dataset_id):
 def histograma_precio(dataset_id):
     """Devuelve datos JSON para el Histograma."""
     try:
-        df = obtener_dataframe_crudo(dataset_id)
-        data = generar_histograma(df)
+        with LectorPorChunks(dataset_id, columnas=columnas_requeridas(generar_histograma)) as lector:
+            data = generar_histograma_por_chunks(lector)
         return jsonify(data), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -159,9 +187,14 @@ def histograma_precio(dataset_id):
 
 @dataset_bp.route("/datasets/<dataset_id>/boxplot-zonas", methods=["GET"])
 def boxplot_zonas(dataset_id):
-    """Devuelve datos JSON para el Boxplot."""
+    """
+    Devuelve datos JSON para el Boxplot. Con ?aproximado=true sale de los sketches de cuantiles
+    guardados con el dataset (sin leer filas; error relativo <= CUANTILES_ALFA en q1/mediana/q3).
+    """
     try:
-        df = obtener_dataframe_crudo(dataset_id)
+        if request.args.get('aproximado', 'false').lower() == 'true':
+            return jsonify(generar_boxplot_aproximado(dataset_id)), 200
+        df = obtener_dataframe_crudo(dataset_id, columnas=columnas_requeridas(generar_boxplot))
         data = generar_boxplot(df)
         return jsonify(data), 200
     except Exception as e:
@@ -170,10 +203,9 @@ def boxplot_zonas(dataset_id):
 
 @dataset_bp.route("/datasets/<dataset_id>/serie-temporal", methods=["GET"])
 def serie_temporal(dataset_id):
-    """Devuelve datos JSON para la Serie Temporal."""
+    """Devuelve datos JSON para la Serie Temporal (precio medio por año, desde el cubo de agregados)."""
     try:
-        df = obtener_dataframe_crudo(dataset_id)
-        data = generar_serie_temporal(df)
+        data = generar_serie_temporal_cubo(dataset_id)
         return jsonify(data), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -181,10 +213,9 @@ def serie_temporal(dataset_id):
 
 @dataset_bp.route("/datasets/<dataset_id>/mapa-calor", methods=["GET"])
 def mapa_calor(dataset_id):
-    """Devuelve datos JSON para el Mapa de Calor (Precio por Zona)."""
+    """Devuelve datos JSON para el Mapa de Calor (Precio por Zona, desde el cubo de agregados)."""
     try:
-        df = obtener_dataframe_crudo(dataset_id)
-        data = generar_mapa_calor(df)
+        data = generar_mapa_calor_cubo(dataset_id)
         return jsonify(data), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -194,9 +225,12 @@ def mapa_calor(dataset_id):
 def datos_3d(dataset_id):
     """Devuelve datos JSON para el gráfico de Dispersión 3D/2D."""
     try:
-        df = obtener_dataframe_crudo(dataset_id)
-        data = generar_datos_3d(df)
+        # Query opcional: modo (muestra | rejilla) y puntos (tope de puntos devueltos)
+        modo, puntos = validar_reduccion(request.args.get('modo'), request.args.get('puntos', type=int), estratificable=False)
+        data = generar_grafico_cacheado(dataset_id, generar_datos_3d, False, modo=modo, puntos=puntos)
         return jsonify(data), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -228,18 +262,34 @@ def sankey_flujo_route(dataset_id):
 def grafico_burbujas_route(dataset_id):
     """Devuelve datos para el gráfico de Burbujas."""
     try:
-        data = generar_grafico_burbujas(dataset_id)
+        # Query opcional: modo (muestra | rejilla | estratificado), puntos y densidad (tamaño por densidad)
+        modo, puntos = validar_reduccion(request.args.get('modo'), request.args.get('puntos', type=int))
+        densidad = request.args.get('densidad', 'false').lower() == 'true'
+        data = generar_grafico_cacheado(dataset_id, generar_grafico_burbujas, True, modo=modo, puntos=puntos, densidad=densidad)
         return jsonify(data), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"🚨 ERROR en grafico_burbujas_route: {e}")
         return jsonify({"error": str(e)}), 500
 
 @dataset_bp.route("/datasets/<dataset_id>/analisis-sensibilidad", methods=["GET"])
 def analisis_sensibilidad_route(dataset_id):
-    """Devuelve datos para el análisis de Sensibilidad."""
+    """
+    Devuelve datos para el análisis de Sensibilidad. Con ?experimento=<id> usa el modelo entrenado:
+    curvas de dependencia parcial (metodo=pd) o una variable cada vez (metodo=oat), con ?puntos y ?muestra opcionales.
+    """
     try:
-        data = generar_analisis_sensibilidad(dataset_id)
+        experimento_id = request.args.get('experimento')
+        if experimento_id:
+            data = generar_sensibilidad_modelo(dataset_id, experimento_id, metodo=request.args.get('metodo', 'pd'),
+                                               puntos=request.args.get('puntos', type=int), muestra=request.args.get('muestra', type=int))
+            return jsonify(data), 200
+        # Momentos guardados del dataset (acumulados al registrarlo; no se vuelve a recorrer)
+        data = generar_analisis_sensibilidad_momentos(dataset_id)
         return jsonify(data), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"🚨 ERROR en analisis_sensibilidad_route: {e}")
         return jsonify({"error": str(e)}), 500
@@ -248,21 +298,56 @@ def analisis_sensibilidad_route(dataset_id):
 def clustering_route(dataset_id):
     """Devuelve resultados del análisis de Clustering."""
     try:
-        data = generar_clustering(dataset_id)
+        data = generar_clustering(dataset_id, n_clusters=request.args.get('n_clusters', 4, type=int))
         return jsonify(data), 200
     except Exception as e:
         print(f"🚨 ERROR en clustering_route: {e}")
         return jsonify({"error": str(e)}), 500
+
+@dataset_bp.route("/datasets/<dataset_id>/clustering/barrido", methods=["GET"])
+def clustering_barrido_route(dataset_id):
+    """Curvas de codo y silueta para elegir k. Query opcional: k_min (2), k_max (10)."""
+    try:
+        data = generar_barrido_clustering(dataset_id, k_min=request.args.get('k_min', 2, type=int), k_max=request.args.get('k_max', 10, type=int))
+        return jsonify(data), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"🚨 ERROR en clustering_barrido_route: {e}")
+        return jsonify({"error": str(e)}), 500
     
+@dataset_bp.route("/datasets/<dataset_id>/analisis-lote", methods=["POST"])
+def analisis_lote_route(dataset_id):
+    """
+    Calcula varios análisis con una sola carga del dataset. Body: { analisis: [nombre | {nombre, parametros, alias}] }
+    con los nombres de las rutas individuales (p. ej. "histograma-precio", "clustering"). Devuelve los
+    resultados por análisis (o por alias, para repetir uno con otros parámetros) junto con sus tiempos.
+    """
+    try:
+        data = request.json or {}
+        resultado = generar_lote_analisis(dataset_id, data.get("analisis", []))
+        return jsonify(resultado), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"🚨 ERROR en analisis_lote_route: {e}")
+        return jsonify({"error": str(e)}), 500
+
 # =========================================================================
 # 4. NUEVO: RUTAS DE ANÁLISIS DE MERCADO
 # =========================================================================
 
 @dataset_bp.route("/datasets/<dataset_id>/segmentacion-mercado", methods=["GET"])
 def segmentacion_mercado_route(dataset_id):
-    """Devuelve datos de segmentación del mercado (ej. por precio)."""
+    """
+    Devuelve datos de segmentación del mercado (ej. por precio), respondida desde el cubo de agregados.
+    Con ?aproximado=true los cortes salen del sketch de cuantiles y los segmentos se agregan por chunks.
+    """
     try:
-        data = generar_segmentacion_mercado(dataset_id)
+        if request.args.get('aproximado', 'false').lower() == 'true':
+            data = generar_segmentacion_mercado_aproximada(dataset_id)
+        else:
+            data = generar_segmentacion_mercado_cubo(dataset_id)
         return jsonify(data), 200
     except Exception as e:
         print(f"🚨 ERROR en segmentacion_mercado_route: {e}")
@@ -280,12 +365,36 @@ def anomalias_precios_route(dataset_id):
         # Devolver estructura vacía esperada
         return jsonify({"gangas": [], "sobrevaloradas": [], "resumen": {}}), 500
 
+@dataset_bp.route("/datasets/<dataset_id>/anomalias-precios/puntuar", methods=["POST"])
+def puntuar_anomalias_route(dataset_id):
+    """
+    Puntúa propiedades nuevas con el modelo de anomalías guardado del dataset (sin reajustarlo).
+    Body: {"propiedades": [{"precio": ..., "area_m2": ..., ...}, ...]}
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        resultado = puntuar_anomalias_nuevas(dataset_id, data.get("propiedades"))
+        return jsonify(resultado), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"🚨 ERROR en puntuar_anomalias_route: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @dataset_bp.route("/datasets/<dataset_id>/score-inversion", methods=["GET"])
 def score_inversion_route(dataset_id):
-    """Calcula y devuelve un score de potencial de inversión para las propiedades."""
+    """
+    Calcula y devuelve un score de potencial de inversión para las propiedades.
+    Query opcional: limit, offset (página del ranking), min_score y potencial (p. ej. "Excelente,Muy Bueno").
+    """
     try:
-        data = calcular_score_inversion(dataset_id)
+        limit = request.args.get('limit', type=int)
+        offset = request.args.get('offset', 0, type=int)
+        min_score = request.args.get('min_score', type=float)
+        data = calcular_score_inversion(dataset_id, limit=limit, offset=offset, min_score=min_score, potencial=request.args.get('potencial'))
         return jsonify(data), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"🚨 ERROR en score_inversion_route: {e}")
         # Devolver estructura vacía esperada
@@ -1,28 +1,81 @@
 # En app/routes/entrenamiento_routes.py
 
-from flask import Blueprint, request, jsonify
-from app.services.entrenamiento_service import iniciar_nuevo_entrenamiento
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from app.services.cola_entrenamientos_service import (
+    encolar_entrenamiento,
+    estado_entrenamiento,
+    eventos_entrenamiento,
+    cancelar_entrenamiento,
+    metricas_cola
+)
 
 entrenamiento_bp = Blueprint("entrenamiento_bp", __name__)
 
 @entrenamiento_bp.route("", methods=["POST"])
 def iniciar_entrenamiento_route():
     """
-    Recibe la configuración del frontend, la pasa al servicio de entrenamiento
-    y devuelve el nuevo experimento creado.
+    Recibe la configuración del frontend, encola el entrenamiento y devuelve al momento
+    el ID del experimento (estado 'en_cola'). El progreso se sigue con /<id>/estado o /<id>/eventos.
     """
     try:
         configuracion = request.get_json()
         if not configuracion:
             return jsonify({"error": "No se recibió ninguna configuración"}), 400
 
-        nuevo_experimento = iniciar_nuevo_entrenamiento(configuracion)
+        trabajo = encolar_entrenamiento(configuracion)
         
-        return jsonify(nuevo_experimento), 201
+        return jsonify(trabajo), 202
 
     except ValueError as ve: # ✅ Captura errores de validación específicos
         print(f"🔥 Error de validación del usuario: {ve}")
         return jsonify({"error": str(ve)}), 400 # Devuelve un error 400 claro
     except Exception as e:
         print(f"🚨 ERROR en la ruta de entrenamiento: {e}")
-        return jsonify({"error": "Ocurrió un error interno en el servidor"}), 500
\ No newline at end of file
+        return jsonify({"error": "Ocurrió un error interno en el servidor"}), 500
+
+# Esta ruta estática debe ir ANTES de las rutas dinámicas "<experimento_id>"
+@entrenamiento_bp.route("/cola", methods=["GET"])
+def cola_entrenamientos_route():
+    """Profundidad de la cola: trabajos de este worker y experimentos activos en total."""
+    try:
+        return jsonify(metricas_cola()), 200
+    except Exception as e:
+        print(f"🚨 ERROR en cola_entrenamientos_route: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@entrenamiento_bp.route("/<experimento_id>/estado", methods=["GET"])
+def estado_entrenamiento_route(experimento_id):
+    """Estado del entrenamiento y métricas por época completadas (para sondeo)."""
+    try:
+        return jsonify(estado_entrenamiento(experimento_id)), 200
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        print(f"🚨 ERROR en estado_entrenamiento_route: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@entrenamiento_bp.route("/<experimento_id>/eventos", methods=["GET"])
+def eventos_entrenamiento_route(experimento_id):
+    """Server-Sent Events con cada época nueva ('progreso') y el estado final ('fin')."""
+    try:
+        estado_entrenamiento(experimento_id) # 404 antes de abrir el stream
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    # El navegador envía Last-Event-ID al reconectar: se continúa desde esa época
+    desde = request.headers.get("Last-Event-ID", type=int)
+    if desde is None: desde = request.args.get("desde", 0, type=int)
+    return Response(stream_with_context(eventos_entrenamiento(experimento_id, desde=desde)), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@entrenamiento_bp.route("/<experimento_id>/cancelar", methods=["POST"])
+def cancelar_entrenamiento_route(experimento_id):
+    """Cancela un entrenamiento en cola o en curso."""
+    try:
+        return jsonify(cancelar_entrenamiento(experimento_id)), 200
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        print(f"🚨 ERROR en cancelar_entrenamiento_route: {e}")
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,45 @@
+from flask import Blueprint, jsonify
+from app.services.cache_service import dataset_cache, caches_en_memoria
+from app.services import http_service
+from app.services.singleflight_service import cargas_datasets
+
+metricas_bp = Blueprint("metricas_bp", __name__)
+
+@metricas_bp.route("/metricas/cache", methods=["GET"])
+def metricas_cache():
+    """Devuelve los contadores de la caché local de datasets (hits, misses, evicciones...)."""
+    try:
+        return jsonify(dataset_cache.estadisticas()), 200
+    except Exception as e:
+        print(f"🚨 ERROR en metricas_cache: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@metricas_bp.route("/metricas/cache-memoria", methods=["GET"])
+def metricas_cache_memoria():
+    """Devuelve los contadores de las cachés en memoria del worker (scores, modelos...)."""
+    try:
+        return jsonify({nombre: cache.estadisticas() for nombre, cache in caches_en_memoria.items()}), 200
+    except Exception as e:
+        print(f"🚨 ERROR en metricas_cache_memoria: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@metricas_bp.route("/metricas/http", methods=["GET"])
+def metricas_http():
+    """Devuelve, por host, peticiones, respuestas 304, bytes ahorrados y conexiones reutilizadas."""
+    try:
+        return jsonify(http_service.estadisticas()), 200
+    except Exception as e:
+        print(f"🚨 ERROR en metricas_http: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@metricas_bp.route("/metricas/cargas", methods=["GET"])
+def metricas_cargas():
+    """Devuelve cuántas cargas de datasets se ejecutaron y cuántas peticiones esperaron a una ya en curso."""
+    try:
+        return jsonify(cargas_datasets.estadisticas()), 200
+    except Exception as e:
+        print(f"🚨 ERROR en metricas_cargas: {e}")
+        return jsonify({"error": str(e)}), 500
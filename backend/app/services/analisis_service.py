@@ -1,14 +1,25 @@
 import pandas as pd
 import io
+import os
+import time
+import inspect
 import requests
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from app.config import Config
 from app.services.supabase_service import supabase
-# Importar KMeans para clustering
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
-from sklearn.impute import SimpleImputer # Para manejar nulos
-# Importar IsolationForest para detección de anomalías
-from sklearn.ensemble import IsolationForest
+from app.services.cache_service import dataset_cache, CacheEnMemoria
+from app.services import http_service
+from app.services.lectura_service import abrir_fuente_dataset, volcar_a_disco, LectorPorChunks, promover_tipo, leer_filas_csv, obtener_indice_filas
+from app.services.singleflight_service import cargas_datasets
+# Clustering (KMeans/MiniBatchKMeans con modelos cacheados)
+from app.services.clustering_service import columnas_clustering, matriz_clustering, obtener_modelo_clustering, barrido_k, modelos_clustering
+# Reducción de puntos para los gráficos de dispersión (muestra, rejilla, estratificado)
+from app.services.muestreo_service import reducir_puntos, escalar_tamanos
+# Detección de anomalías (IsolationForest persistido por versión del dataset)
+from app.services.anomalias_service import obtener_modelo_anomalias, puntuar_con_modelo
+# Cubo de agregados zona × año × segmento de precio (radar y sankey)
+from app.services.cubo_service import obtener_cubo, radar_desde_cubo, sankey_desde_cubo
 
 # Constante para representar nulos en la vista previa
 NULL_STRING = "[NULL]"
@@ -16,32 +27,120 @@ NULL_STRING = "[NULL]"
 # =============================================================================
 # 1️⃣ Obtener DataFrame "Crudo"
 # =============================================================================
-def obtener_dataframe_crudo(dataset_id: str) -> pd.DataFrame:
+def _proyectar_columnas(df: pd.DataFrame, columnas: list = None) -> pd.DataFrame:
+    """ Se queda solo con las columnas pedidas que existan (las ausentes se ignoran). """
+    if columnas is None: return df
+    return df[[c for c in columnas if c in df.columns]]
+
+def usa_columnas(*parametros):
     """
-    Descarga el archivo CSV desde Supabase y lo carga en un DataFrame de Pandas,
-    manteniendo los datos en su estado original (con valores nulos).
+    Declara qué columnas lee una función de análisis: `parametros` son los nombres de sus
+    parámetros que contienen nombres de columna (un str o una lista). Con esa declaración,
+    columnas_requeridas() resuelve la lista a cargar y obtener_dataframe_crudo lee solo esas columnas.
+    Las funciones sin declaración usan todas las columnas (p. ej. las que recorren todas las numéricas).
+    """
+    def decorador(funcion):
+        funcion.parametros_columnas = parametros
+        return funcion
+    return decorador
+
+def columnas_requeridas(funcion, **kwargs) -> list:
+    """ Columnas que leerá `funcion` con los argumentos dados (o sus valores por defecto); None = todas. """
+    parametros = getattr(funcion, "parametros_columnas", None)
+    if parametros is None: return None
+    argumentos = inspect.signature(funcion).bind_partial(**kwargs)
+    argumentos.apply_defaults()
+    columnas = []
+    for parametro in parametros:
+        valor = argumentos.arguments.get(parametro)
+        for c in ([valor] if isinstance(valor, str) else list(valor or [])):
+            if c not in columnas: columnas.append(c)
+    return columnas
+
+def compactar_dataframe(df: pd.DataFrame, max_ratio_categorias: float = 0.5, flotantes: bool = False) -> tuple:
+    """
+    Reduce la memoria de un DataFrame sin cambiar sus valores:
+    - Enteros al tipo con signo más pequeño que los contiene (int8/16/32).
+    - Textos con pocos valores distintos (únicos/filas <= max_ratio_categorias) a 'category'.
+    - Con `flotantes=True`, float64 a float32 solo si la conversión es exacta para toda la columna
+      (por defecto no: pandas acumula medias y sumas de float32 en float32).
+    Devuelve (df_compacto, reporte) con los bytes antes/después y las columnas convertidas.
+    """
+    bytes_antes = int(df.memory_usage(deep=True).sum())
+    df = df.copy()
+    convertidas = {}
+    for c in df.columns:
+        serie = df[c]
+        tipo_original = str(serie.dtype)
+        if pd.api.types.is_bool_dtype(serie):
+            continue
+        if pd.api.types.is_integer_dtype(serie):
+            df[c] = pd.to_numeric(serie, downcast='integer')
+        elif flotantes and serie.dtype == np.float64:
+            convertida = serie.astype(np.float32)
+            exacta = (convertida.astype(np.float64) == serie) | serie.isna()
+            if exacta.all(): df[c] = convertida
+        elif pd.api.types.is_object_dtype(serie) or isinstance(serie.dtype, pd.StringDtype):
+            no_nulos = serie.dropna()
+            # Solo columnas de texto puro: las mixtas (números y textos) se dejan como están
+            if no_nulos.empty or (pd.api.types.is_object_dtype(serie) and not no_nulos.map(type).eq(str).all()): continue
+            if no_nulos.nunique() <= max_ratio_categorias * len(serie):
+                df[c] = serie.astype('category')
+        if str(df[c].dtype) != tipo_original:
+            convertidas[c] = {"antes": tipo_original, "despues": str(df[c].dtype)}
+
+    bytes_despues = int(df.memory_usage(deep=True).sum())
+    reporte = {
+        "bytes_antes": bytes_antes,
+        "bytes_despues": bytes_despues,
+        "bytes_ahorrados": bytes_antes - bytes_despues,
+        "columnas_convertidas": convertidas
+    }
+    return df, reporte
+
+def _aplicar_compactacion(df: pd.DataFrame, dataset_id: str, compactar: bool) -> pd.DataFrame:
+    if not compactar or df.empty: return df
+    df_compacto, reporte = compactar_dataframe(df)
+    print(f"🗜️ Dataset {dataset_id} compactado: {reporte['bytes_antes'] / 1e6:.1f} MB -> {reporte['bytes_despues'] / 1e6:.1f} MB "
+          f"({reporte['bytes_ahorrados'] / 1e6:.1f} MB ahorrados, {len(reporte['columnas_convertidas'])} columnas convertidas)")
+    return df_compacto
+
+def _cargar_dataset_en_cache(dataset_id: str) -> dict:
     """
+    Deja la versión vigente del dataset en la caché local (descargándola y parseándola solo si hace falta).
+    Devuelve {"version", "descargado", "df"}; "df" solo viene relleno si no se pudo escribir en la caché.
+    """
+    archivo_url = None
+    ruta_tmp = None
     try:
-        dataset_res = supabase.table("datasets").select("archivo_url").eq("id", dataset_id).single().execute()
-        if not dataset_res.data:
-            raise ValueError(f"❌ Dataset con ID '{dataset_id}' no encontrado.")
-
-        archivo_url = dataset_res.data.get("archivo_url")
-        if not archivo_url:
-            raise ValueError("❌ El registro del dataset no tiene una URL de archivo.")
-
-        resp = requests.get(archivo_url)
-        resp.raise_for_status() # Lanza error si la descarga falla
-
-        # Usar io.BytesIO para leer el contenido binario directamente
-        df = pd.read_csv(io.BytesIO(resp.content))
+        # 1. Preferir la copia columnar (Parquet) y revalidar la copia local con un GET condicional
+        fuente = abrir_fuente_dataset(dataset_id)
+        archivo_url, version = fuente["url"], fuente["version"]
+
+        # 2. Si el Storage respondió 304 (o la versión ya estaba guardada) no hay nada que descargar
+        if fuente["respuesta"] is None:
+            if dataset_cache.existe(dataset_id, version):
+                return {"version": version, "descargado": False, "df": None}
+            fuente["respuesta"] = http_service.get(archivo_url, stream=True) # Evictada entre medias
+
+        # Descarga por streaming a disco: el cuerpo nunca se mantiene entero en memoria
+        ruta_tmp, sha256 = volcar_a_disco(fuente["respuesta"])
+        if fuente["es_parquet"]:
+            df = pd.read_parquet(ruta_tmp)
+        else:
+            df = pd.read_csv(ruta_tmp)
 
         if df.empty:
             print(f"⚠️ Advertencia: El dataset {dataset_id} está vacío o no se pudo leer correctamente.")
             # Considerar devolver un DataFrame vacío si es preferible a un error
             # return pd.DataFrame()
 
-        return df
+        # 3. Sin validadores HTTP, la versión es el hash del contenido descargado
+        if not version:
+            version = f"sha256:{sha256}"
+        dataset_cache.guardar(dataset_id, version, df, validadores=fuente["validadores"])
+        guardado = dataset_cache.existe(dataset_id, version)
+        return {"version": version, "descargado": True, "df": None if guardado else df}
 
     except requests.exceptions.RequestException as req_err:
         print(f"🚨 [ERROR] de red al descargar {archivo_url}: {req_err}")
@@ -49,8 +148,45 @@ def obtener_dataframe_crudo(dataset_id: str) -> pd.DataFrame:
     except pd.errors.EmptyDataError:
         print(f"🚨 [ERROR] El archivo CSV {archivo_url} está vacío.")
         raise ValueError(f"El archivo CSV para el dataset {dataset_id} está vacío.") from pd.errors.EmptyDataError
+    finally:
+        if ruta_tmp and os.path.exists(ruta_tmp): os.remove(ruta_tmp)
+
+def obtener_dataframe_crudo(dataset_id: str, columnas: list = None, compactar: bool = None) -> pd.DataFrame:
+    """
+    Descarga el archivo CSV desde Supabase y lo carga en un DataFrame de Pandas,
+    manteniendo los datos en su estado original (con valores nulos).
+    Si existe la copia Parquet generada al registrar el dataset se usa en lugar del CSV,
+    y las cargas repetidas se sirven desde la caché local (ver cache_service).
+    Las peticiones concurrentes del mismo dataset comparten una única descarga (ver singleflight_service).
+    Con `columnas` solo se devuelven (y, desde la caché, solo se leen) esas columnas.
+    Con `compactar` (por defecto Config.DATASET_COMPACTAR) se reduce la memoria del resultado
+    con compactar_dataframe; la caché siempre guarda los tipos originales.
+    Sin compactar, las columnas numéricas son vistas de solo lectura del archivo mapeado de la caché
+    (compartido entre workers): para modificarlas hay que reasignarlas o copiar el DataFrame.
+    """
+    return obtener_dataframe_versionado(dataset_id, columnas=columnas, compactar=compactar)[0]
+
+def obtener_dataframe_versionado(dataset_id: str, columnas: list = None, compactar: bool = None) -> tuple:
+    """ Igual que obtener_dataframe_crudo pero devuelve (df, version) para cachear resultados derivados por versión. """
+    if compactar is None: compactar = Config.DATASET_COMPACTAR
+    try:
+        for _ in range(2):
+            carga = cargas_datasets.ejecutar(dataset_id, lambda: _cargar_dataset_en_cache(dataset_id))
+            if carga["df"] is not None:
+                # La caché no se pudo escribir: cada llamador recibe su propia copia del resultado compartido
+                return _aplicar_compactacion(_proyectar_columnas(carga["df"], columnas).copy(), dataset_id, compactar), carga["version"]
+
+            # Servir la vista mapeada (compartida con los demás workers) sin copia privada
+            if carga["descargado"]:
+                df = dataset_cache.mapear(dataset_id, carga["version"], columnas=columnas)
+            else:
+                df = dataset_cache.obtener(dataset_id, carga["version"], columnas=columnas)
+            if df is not None:
+                return _aplicar_compactacion(df, dataset_id, compactar), carga["version"]
+            # Evictada entre la carga y la lectura: repetir una vez
+        raise RuntimeError(f"El dataset {dataset_id} se evictó de la caché antes de poder leerlo.")
     except Exception as e:
-        print(f"🚨 [ERROR] inesperado en obtener_dataframe_crudo para {dataset_id}: {e}")
+        print(f"🚨 [ERROR] inesperado en obtener_dataframe_versionado para {dataset_id}: {e}")
         raise # Re-lanzar para que la ruta lo maneje
 
 # =============================================================================
@@ -97,24 +233,67 @@ def obtener_columnas(df: pd.DataFrame) -> list:
         print(f"🚨 [ERROR] en obtener_columnas: {e}")
         raise RuntimeError("No se pudo obtener la información de las columnas.") from e
 
+def _paginar(total_filas: int, pagina: int, filas_por_pagina: int) -> tuple:
+    """ (pagina_actual, total_paginas, inicio) acotando la página pedida al rango válido. """
+    total_paginas = max(1, (total_filas + filas_por_pagina - 1) // filas_por_pagina)
+    pagina_actual = max(1, min(pagina, total_paginas))
+    return pagina_actual, total_paginas, (pagina_actual - 1) * filas_por_pagina
+
+def _registros_pagina(df_pagina: pd.DataFrame) -> list:
+    # CORRECCIÓN: Manejar Infinito también
+    df_temp = df_pagina.replace([np.inf, -np.inf], np.nan)
+    df_pagina_str = df_temp.astype(object).fillna(NULL_STRING)
+    return df_pagina_str.to_dict(orient='records')
+
 def obtener_vista_previa_paginada(df: pd.DataFrame, pagina: int = 1, filas_por_pagina: int = 20) -> dict:
     """ Obtiene una porción paginada y reemplaza NaN/NaT con NULL_STRING. """
     try:
         total_filas = len(df)
-        total_paginas = max(1, (total_filas + filas_por_pagina - 1) // filas_por_pagina)
-        pagina_actual = max(1, min(pagina, total_paginas))
-        inicio = (pagina_actual - 1) * filas_por_pagina
-        fin = inicio + filas_por_pagina
-        df_pagina = df.iloc[inicio:fin]
-        # CORRECCIÓN: Manejar Infinito también
-        df_temp = df_pagina.replace([np.inf, -np.inf], np.nan)
-        df_pagina_str = df_temp.astype(object).fillna(NULL_STRING)
-        datos = df_pagina_str.to_dict(orient='records')
+        pagina_actual, total_paginas, inicio = _paginar(total_filas, pagina, filas_por_pagina)
+        df_pagina = df.iloc[inicio:inicio + filas_por_pagina]
+        datos = _registros_pagina(df_pagina)
         return {"datos": datos, "pagina_actual": pagina_actual, "total_paginas": total_paginas, "total_filas": total_filas}
     except Exception as e:
         print(f"🚨 [ERROR] en obtener_vista_previa_paginada: {e}")
         return {"datos": [], "pagina_actual": 1, "total_paginas": 1, "total_filas": 0, "error": str(e)}
 
+def obtener_vista_previa_por_rango(dataset_id: str, pagina: int = 1, filas_por_pagina: int = 20) -> dict:
+    """
+    Igual que obtener_vista_previa_paginada pero sin cargar el dataset completo:
+    1. Si la caché local tiene la versión vigente, corta las filas del archivo mapeado.
+    2. Si no, usa el índice de offsets del CSV y pide solo ese tramo con HTTP Range.
+    3. Si el Storage no admite rangos, recurre a la carga completa.
+    """
+    try:
+        # 1. Caché local (revalidada con un GET condicional, sin cuerpo si no cambió)
+        conocidos = dataset_cache.validadores(dataset_id)
+        if conocidos and dataset_cache.existe(dataset_id, conocidos.get("version")):
+            fuente = abrir_fuente_dataset(dataset_id)
+            if fuente["respuesta"] is not None: fuente["respuesta"].close()
+            tabla = dataset_cache.tabla(dataset_id, fuente["version"]) if fuente["respuesta"] is None else None
+            if tabla is not None:
+                pagina_actual, total_paginas, inicio = _paginar(tabla.num_rows, pagina, filas_por_pagina)
+                df_pagina = tabla.slice(inicio, filas_por_pagina).to_pandas()
+                return {"datos": _registros_pagina(df_pagina), "pagina_actual": pagina_actual, "total_paginas": total_paginas, "total_filas": tabla.num_rows}
+
+        # 2. Rango de bytes del CSV a partir del índice de filas
+        dataset_res = supabase.table("datasets").select("archivo_url").eq("id", dataset_id).single().execute()
+        if not dataset_res.data: raise ValueError(f"❌ Dataset con ID '{dataset_id}' no encontrado.")
+        archivo_url = dataset_res.data["archivo_url"]
+        indice = obtener_indice_filas(archivo_url)
+        pagina_actual, total_paginas, inicio = _paginar(indice["total_filas"], pagina, filas_por_pagina)
+        df_pagina, total_filas = leer_filas_csv(archivo_url, inicio, filas_por_pagina, indice=indice)
+        if df_pagina is not None:
+            if total_filas != indice["total_filas"]: # El índice se reconstruyó: recalcular la paginación
+                pagina_actual, total_paginas, _ = _paginar(total_filas, pagina, filas_por_pagina)
+            return {"datos": _registros_pagina(df_pagina), "pagina_actual": pagina_actual, "total_paginas": total_paginas, "total_filas": total_filas}
+
+        # 3. Sin soporte de rangos: carga completa
+        return obtener_vista_previa_paginada(obtener_dataframe_crudo(dataset_id), pagina, filas_por_pagina)
+    except Exception as e:
+        print(f"🚨 [ERROR] en obtener_vista_previa_por_rango: {e}")
+        return {"datos": [], "pagina_actual": 1, "total_paginas": 1, "total_filas": 0, "error": str(e)}
+
 def calcular_correlacion(df: pd.DataFrame) -> dict:
     """ Calcula la matriz de correlación para columnas numéricas. """
     try:
@@ -146,6 +325,7 @@ def distribucion_clases(df: pd.DataFrame, columna_clase: str = None) -> list:
 # =============================================================================
 # 3️⃣ Funciones de Visualización (Exploratorio Básico)
 # =============================================================================
+@usa_columnas('columna')
 def generar_histograma(df: pd.DataFrame, columna: str = 'precio', bins: int = 10) -> list:
     try:
         if columna not in df.columns or not pd.api.types.is_numeric_dtype(df[columna]):
@@ -163,6 +343,7 @@ def generar_histograma(df: pd.DataFrame, columna: str = 'precio', bins: int = 10
         print(f"Error en generar_histograma: {e}")
         return []
 
+@usa_columnas('col_grupo', 'col_valor')
 def generar_boxplot(df: pd.DataFrame, col_grupo: str = 'zona', col_valor: str = 'precio') -> list:
     """ Genera datos JSON para boxplots (usando cuantiles) agrupados por `col_grupo`. """
     print(f"-> generando_boxplot (grupo='{col_grupo}', valor='{col_valor}')") # Log para depuración
@@ -187,7 +368,7 @@ def generar_boxplot(df: pd.DataFrame, col_grupo: str = 'zona', col_valor: str =
             return [] # Devolver vacío si no hay datos limpios
 
         # Calcular cuantiles por grupo
-        grouped = df_clean.groupby(col_grupo)[col_valor]
+        grouped = df_clean.groupby(col_grupo, observed=True)[col_valor]
         # Verificar si hay grupos resultantes
         if grouped.ngroups == 0:
              print("   ⚠️ No se formaron grupos válidos (quizás col_grupo era todo NaN?).")
@@ -217,6 +398,7 @@ def generar_boxplot(df: pd.DataFrame, col_grupo: str = 'zona', col_valor: str =
         return [] # Devolver vacío en cualquier error inesperado
 
 
+@usa_columnas('col_fecha', 'col_valor')
 def generar_serie_temporal(df: pd.DataFrame, col_fecha: str = 'fecha', col_valor: str = 'precio') -> list:
     try:
         if col_fecha not in df.columns or col_valor not in df.columns: raise ValueError(f"Columnas '{col_fecha}' o '{col_valor}' no encontradas.")
@@ -235,6 +417,7 @@ def generar_serie_temporal(df: pd.DataFrame, col_fecha: str = 'fecha', col_valor
         print(f"Error en generar_serie_temporal: {e}")
         return []
 
+@usa_columnas('col_grupo', 'col_valor')
 def generar_mapa_calor(df: pd.DataFrame, col_grupo: str = 'zona', col_valor: str = 'precio') -> list:
     try:
         if col_grupo not in df.columns or col_valor not in df.columns: raise ValueError(f"Columnas '{col_grupo}' o '{col_valor}' no encontradas.")
@@ -242,14 +425,35 @@ def generar_mapa_calor(df: pd.DataFrame, col_grupo: str = 'zona', col_valor: str
         # CORRECCIÓN: Filtrar NaN/Inf antes de agrupar
         df_clean = df[[col_grupo, col_valor]].replace([np.inf, -np.inf], np.nan).dropna()
         if df_clean.empty: return []
-        mapa = df_clean.groupby(col_grupo)[col_valor].mean().round(2)
+        mapa = df_clean.groupby(col_grupo, observed=True)[col_valor].mean().round(2)
         data = mapa.reset_index().rename(columns={col_valor: 'precio_promedio', col_grupo: 'zona'}).to_dict('records')
         return data
     except Exception as e:
         print(f"Error en generar_mapa_calor: {e}")
         return []
 
-def generar_datos_3d(df: pd.DataFrame, col_x: str = 'area_m2', col_y: str = 'precio', col_z: str = 'habitaciones') -> list:
+# Puntos ya reducidos por (dataset, versión, gráfico, parámetros): la muestra no se recalcula en cada petición
+graficos_cache = CacheEnMemoria("graficos_reducidos", Config.GRAFICOS_CACHE_ENTRADAS)
+
+def generar_grafico_cacheado(dataset_id: str, funcion, recibe_dataset: bool, **kwargs) -> list:
+    """
+    Carga las columnas que declara `funcion`, la ejecuta y guarda el resultado por versión del dataset.
+    `recibe_dataset` indica la firma, como en ANALISIS_LOTE: funcion(dataset_id, df=df) o funcion(df).
+    """
+    df, version = obtener_dataframe_versionado(dataset_id, columnas=columnas_requeridas(funcion, **kwargs))
+    clave = (dataset_id, version, funcion.__name__, tuple(sorted(kwargs.items())))
+    resultado = graficos_cache.obtener(clave) if version else None
+    if resultado is None:
+        resultado = funcion(dataset_id, df=df, **kwargs) if recibe_dataset else funcion(df, **kwargs)
+        if version: graficos_cache.guardar(clave, resultado)
+    return resultado
+
+@usa_columnas('col_x', 'col_y', 'col_z')
+def generar_datos_3d(df: pd.DataFrame, col_x: str = 'area_m2', col_y: str = 'precio', col_z: str = 'habitaciones', modo: str = 'muestra', puntos: int = None) -> list:
+    """
+    Puntos para la dispersión 3D/2D (a lo sumo `puntos`, 500 por defecto). modo="muestra" es una muestra uniforme;
+    modo="rejilla" deja un punto por celda de una rejilla 3D y añade "densidad" (filas que representa cada punto).
+    """
     try:
         cols = [col_x, col_y, col_z]
         if not all(c in df.columns for c in cols): raise ValueError(f"Faltan columnas: {cols}")
@@ -257,7 +461,9 @@ def generar_datos_3d(df: pd.DataFrame, col_x: str = 'area_m2', col_y: str = 'pre
         # CORRECCIÓN: Filtrar NaN/Inf antes de samplear
         df_clean = df[cols].replace([np.inf, -np.inf], np.nan).dropna()
         if df_clean.empty: return []
-        sample_df = df_clean.sample(n=min(len(df_clean), 500), random_state=42)
+        posiciones, densidad = reducir_puntos(df_clean.to_numpy(dtype=np.float64), modo, puntos or 500)
+        sample_df = df_clean.iloc[posiciones]
+        if modo != 'muestra': sample_df = sample_df.assign(densidad=np.rint(densidad).astype(np.int64))
         data = sample_df.rename(columns={col_x: 'area_m2', col_y: 'precio', col_z: 'habitaciones'}).to_dict('records')
         return data
     except Exception as e:
@@ -267,50 +473,52 @@ def generar_datos_3d(df: pd.DataFrame, col_x: str = 'area_m2', col_y: str = 'pre
 # =============================================================================
 # 4️⃣ Funciones de Análisis Avanzado
 # =============================================================================
-def generar_analisis_radar(dataset_id: str) -> list:
+# Radar y sankey salen del cubo guardado del dataset (no leen filas): declaran cero columnas y el
+# frame que reciben en /analisis-lote no se usa.
+@usa_columnas()
+def generar_analisis_radar(dataset_id: str, df: pd.DataFrame = None, max_zonas: int = 4) -> list:
+    """ Compara las zonas con más propiedades (precio/m², tamaño, habitaciones, baños, antigüedad) en escala 0-100. """
     print(f"-> generando_analisis_radar para dataset {dataset_id}")
     try:
-        # Placeholder
-        return [
-            {"casa": "Casa A (Ejemplo)", "metricas": [{"metrica": "Precio/m²", "valor": np.random.randint(70, 95)}, {"metrica": "Tamaño", "valor": np.random.randint(50, 70)}, {"metrica": "Habitaciones", "valor": np.random.randint(40, 60)}, {"metrica": "Antigüedad", "valor": np.random.randint(60, 80)}, {"metrica": "Calidad", "valor": np.random.randint(65, 90)}]},
-            {"casa": "Casa B (Ejemplo)", "metricas": [{"metrica": "Precio/m²", "valor": np.random.randint(60, 80)}, {"metrica": "Tamaño", "valor": np.random.randint(70, 90)}, {"metrica": "Habitaciones", "valor": np.random.randint(65, 85)}, {"metrica": "Antigüedad", "valor": np.random.randint(30, 50)}, {"metrica": "Calidad", "valor": np.random.randint(75, 95)}]},
-             {"casa": "Casa C (Ejemplo)", "metricas": [{"metrica": "Precio/m²", "valor": np.random.randint(30, 50)}, {"metrica": "Tamaño", "valor": np.random.randint(60, 80)}, {"metrica": "Habitaciones", "valor": np.random.randint(55, 75)}, {"metrica": "Antigüedad", "valor": np.random.randint(10, 30)}, {"metrica": "Calidad", "valor": np.random.randint(50, 70)}]},
-        ]
+        return radar_desde_cubo(obtener_cubo(dataset_id), max_zonas=max_zonas)
     except Exception as e:
         print(f"🚨 ERROR en generar_analisis_radar: {e}")
         return []
 
-def generar_sankey_flujo(dataset_id: str) -> dict:
+@usa_columnas()
+def generar_sankey_flujo(dataset_id: str, df: pd.DataFrame = None, max_zonas: int = 6) -> dict:
+    """ Flujo de propiedades de cada zona a su segmento de precio (Bajo/Medio/Alto). """
     print(f"-> generando_sankey_flujo para dataset {dataset_id}")
     try:
-        # Placeholder
-        return {
-            "nodes": [{"id": 0, "name": "Zona Centro"}, {"id": 1, "name": "Zona Residencial"}, {"id": 2, "name": "Zona Periférica"}, {"id": 3, "name": "Precio Bajo"}, {"id": 4, "name": "Precio Medio"}, {"id": 5, "name": "Precio Alto"}],
-            "links": [{"source": 0, "target": 4, "value": np.random.randint(20, 40)}, {"source": 0, "target": 5, "value": np.random.randint(40, 60)}, {"source": 1, "target": 4, "value": np.random.randint(50, 70)}, {"source": 1, "target": 5, "value": np.random.randint(30, 50)}, {"source": 2, "target": 3, "value": np.random.randint(60, 80)}, {"source": 2, "target": 4, "value": np.random.randint(20, 30)}]
-        }
+        return sankey_desde_cubo(obtener_cubo(dataset_id), max_zonas=max_zonas)
     except Exception as e:
         print(f"🚨 ERROR en generar_sankey_flujo: {e}")
         return {"nodes": [], "links": []}
 
-def generar_grafico_burbujas(dataset_id: str) -> list:
+@usa_columnas('col_x', 'col_y', 'col_size', 'col_cat')
+def generar_grafico_burbujas(dataset_id: str, col_x: str = 'area_m2', col_y: str = 'precio', col_size: str = 'habitaciones', col_cat: str = 'zona',
+                             modo: str = 'muestra', puntos: int = None, densidad: bool = False, df: pd.DataFrame = None) -> list:
+    """
+    Burbujas (a lo sumo `puntos`, 200 por defecto) elegidas con muestreo uniforme, por rejilla x/y o estratificado por zona.
+    Con densidad=True el tamaño refleja cuántas filas representa cada burbuja en lugar de `col_size`.
+    """
     print(f"-> generando_grafico_burbujas para dataset {dataset_id}")
     try:
-        df = obtener_dataframe_crudo(dataset_id)
+        if df is None: df = obtener_dataframe_crudo(dataset_id, columnas=columnas_requeridas(generar_grafico_burbujas, col_x=col_x, col_y=col_y, col_size=col_size, col_cat=col_cat))
         if df.empty: return []
-        col_x, col_y, col_size, col_cat = 'area_m2', 'precio', 'habitaciones', 'zona'
         required_cols = [col_x, col_y, col_size, col_cat]
         if not all(c in df.columns for c in required_cols):
              print(f"⚠️ Advertencia: Faltan columnas {required_cols} para burbujas.")
              return [{"x": 100, "y": 150000, "z": 300, "zona": "Ejemplo"}]
-        # CORRECCIÓN: Convertir a numérico ANTES de dropna
-        for col in [col_x, col_y, col_size]:
-             df[col] = pd.to_numeric(df[col], errors='coerce')
-        df.dropna(subset=required_cols, inplace=True) # Ahora dropea si la conversión falló
+        # CORRECCIÓN: Convertir a numérico ANTES de dropna (sobre un DataFrame nuevo: `df` puede ser compartido)
+        df = df.assign(**{col: pd.to_numeric(df[col], errors='coerce') for col in [col_x, col_y, col_size]})
+        df = df.dropna(subset=required_cols) # Ahora dropea si la conversión falló
         if df.empty: return []
-        sample_df = df.sample(n=min(len(df), 200), random_state=42)
+        posiciones, pesos = reducir_puntos(df[[col_x, col_y]].to_numpy(dtype=np.float64), modo, puntos or 200, estratos=df[col_cat])
+        sample_df = df.iloc[posiciones].copy()
         # CORRECCIÓN: Manejar caso donde col_cat ya es numérico para cat_code
         if pd.api.types.is_categorical_dtype(sample_df[col_cat]) or pd.api.types.is_object_dtype(sample_df[col_cat]):
-             sample_df['cat_code'] = pd.Categorical(sample_df[col_cat]).codes
+             sample_df['cat_code'] = pd.Categorical(sample_df[col_cat].astype(object)).codes # Códigos según las zonas de la muestra
         elif pd.api.types.is_numeric_dtype(sample_df[col_cat]):
              sample_df['cat_code'] = sample_df[col_cat] # Usar el valor numérico existente
         else:
@@ -318,22 +526,22 @@ def generar_grafico_burbujas(dataset_id: str) -> list:
         col_code = 'cat_code'
 
         data_raw = sample_df[[col_x, col_y, col_size, col_cat, col_code]].rename(columns={col_x: 'x', col_y: 'y', col_size: 'size_value', col_cat: 'zona', col_code: 'z_code'}).to_dict('records')
-        sizes = [d['size_value'] for d in data_raw if pd.notna(d['size_value'])]
-        min_s, max_s = min(sizes) if sizes else 1, max(sizes) if sizes else 1
-        range_s = max_s - min_s
+        # Tamaño por `col_size` o, con densidad, por las filas que representa cada burbuja (escala logarítmica)
+        tamanos = escalar_tamanos(np.log1p(pesos) if densidad else [d['size_value'] for d in data_raw])
         data_final = []
-        for d in data_raw:
-             scaled_z = 100 + ((d['size_value'] - min_s) / range_s) * 900 if pd.notna(d['size_value']) and range_s > 0 else 100
-             data_final.append({'x': d['x'], 'y': d['y'], 'z': int(scaled_z), 'zona': d['zona'], 'codigo_zona': d['z_code']})
+        for d, z, peso in zip(data_raw, tamanos, pesos.tolist()):
+             punto = {'x': d['x'], 'y': d['y'], 'z': z, 'zona': d['zona'], 'codigo_zona': d['z_code']}
+             if modo != 'muestra' or densidad: punto['densidad'] = int(round(peso))
+             data_final.append(punto)
         return data_final
     except Exception as e:
         print(f"🚨 ERROR en generar_grafico_burbujas: {e}")
         return []
 
-def generar_analisis_sensibilidad(dataset_id: str) -> list:
+def generar_analisis_sensibilidad(dataset_id: str, df: pd.DataFrame = None) -> list:
     print(f"-> generando_analisis_sensibilidad para dataset {dataset_id}")
     try:
-        df = obtener_dataframe_crudo(dataset_id)
+        if df is None: df = obtener_dataframe_crudo(dataset_id)
         if df.empty: return []
         target_col = 'precio'
         if target_col not in df.columns or not pd.api.types.is_numeric_dtype(df[target_col]): raise ValueError(f"Columna '{target_col}' inválida.")
@@ -364,53 +572,36 @@ def generar_analisis_sensibilidad(dataset_id: str) -> list:
         print(f"🚨 ERROR en generar_analisis_sensibilidad: {e}")
         return []
 
-def generar_clustering(dataset_id: str, n_clusters: int = 4) -> dict:
+def generar_clustering(dataset_id: str, n_clusters: int = 4, df: pd.DataFrame = None) -> dict:
     print(f"-> generando_clustering (K={n_clusters}) para dataset {dataset_id}")
     COLORES_CLUSTER = ['#0ea5e9', '#8b5cf6', '#ec4899', '#f59e0b', '#10b981', '#ef4444']
     try:
-        df = obtener_dataframe_crudo(dataset_id)
+        version = None
+        if df is None: df, version = obtener_dataframe_versionado(dataset_id)
         if df.empty: return {"clusters": [], "centroides": [], "columnas": []}
-        numeric_cols = df.select_dtypes(include=np.number).columns.tolist()
-        cols_to_exclude = [col for col in numeric_cols if 'id' in col.lower() or df[col].nunique() < 2 or df[col].std(skipna=True) < 1e-9] # skipna=True en std
-        cols_for_clustering = [col for col in numeric_cols if col not in cols_to_exclude]
+        cols_for_clustering = columnas_clustering(df)
         if len(cols_for_clustering) < 2: raise ValueError("Se necesitan >= 2 vars numéricas válidas.")
         print(f"   Columnas usadas: {cols_for_clustering}")
-        X = df[cols_for_clustering].copy() # Usar copia para evitar SettingWithCopyWarning
-        # CORRECCIÓN: Imputar ANTES de escalar
-        imputer = SimpleImputer(strategy='mean'); X_imputed = imputer.fit_transform(X)
-        # Convertir de nuevo a DataFrame para escalar (preserva nombres de columna)
-        X_imputed_df = pd.DataFrame(X_imputed, columns=cols_for_clustering)
-
-        scaler = StandardScaler(); X_scaled = scaler.fit_transform(X_imputed_df)
-        actual_n_clusters = min(n_clusters, len(X_scaled))
-        if actual_n_clusters < 2: raise ValueError("No hay suficientes muestras.")
-        if actual_n_clusters != n_clusters: print(f"⚠️ n_clusters reducido a {actual_n_clusters}")
-        kmeans = KMeans(n_clusters=actual_n_clusters, random_state=42, n_init=10); cluster_labels = kmeans.fit_predict(X_scaled)
-        # CORRECCIÓN: Añadir labels al DataFrame ORIGINAL (df) usando el índice si es posible,
-        # o crear uno nuevo si los índices se pierden. Asumimos que el índice se mantuvo.
-        if len(cluster_labels) == len(df):
-             df['cluster'] = cluster_labels
-        else:
-             print("⚠️ Error de alineación de índices en clustering. Los resultados pueden ser imprecisos.")
-             # Crear df temporal solo con los datos clusterizados si hay error de índice
-             df_clustered = X_imputed_df.copy()
-             df_clustered['cluster'] = cluster_labels
-             df = df_clustered # Sobrescribir df para el análisis de clusters
+        # Modelo y etiquetas cacheados por (dataset, versión, k, columnas) cuando el frame se carga aquí
+        clave = (dataset_id, version, n_clusters, tuple(cols_for_clustering)) if version else None
+        ajuste = obtener_modelo_clustering(df, cols_for_clustering, n_clusters, clave=clave)
+        kmeans, scaler = ajuste["modelo"], ajuste["scaler"]
+        actual_n_clusters = kmeans.n_clusters
+        print(f"   Modelo: {ajuste['metodo']}")
 
         clusters_info = []
         cols_to_describe = cols_for_clustering[:min(5, len(cols_for_clustering))]
+        # Un único groupby sobre las columnas descritas (sin copiar el frame completo por cluster)
+        conteos = np.bincount(ajuste["etiquetas"], minlength=actual_n_clusters)
+        resumen = df[cols_to_describe].groupby(ajuste["etiquetas"]).agg(['mean', 'min', 'max'])
         for i in range(actual_n_clusters):
-            cluster_df = df[df['cluster'] == i]; count = len(cluster_df)
+            count = int(conteos[i])
             if count == 0: continue
             caracteristicas = {}
             for col in cols_to_describe:
-                 # CORRECCIÓN: Asegurar que la columna existe en cluster_df antes de agg
-                 if col in cluster_df.columns:
-                      stats = cluster_df[col].agg(['mean', 'min', 'max']).fillna(0)
-                      # CORRECCIÓN: Asegurar que stats son finitos antes de formatear
-                      caracteristicas[col] = {"promedio": f"{stats['mean']:.2f}" if np.isfinite(stats['mean']) else "N/A", "min": f"{stats['min']:.2f}" if np.isfinite(stats['min']) else "N/A", "max": f"{stats['max']:.2f}" if np.isfinite(stats['max']) else "N/A"}
-                 else:
-                      caracteristicas[col] = {"promedio": "N/A", "min": "N/A", "max": "N/A"}
+                 stats = resumen.loc[i, col].fillna(0)
+                 # CORRECCIÓN: Asegurar que stats son finitos antes de formatear
+                 caracteristicas[col] = {"promedio": f"{stats['mean']:.2f}" if np.isfinite(stats['mean']) else "N/A", "min": f"{stats['min']:.2f}" if np.isfinite(stats['min']) else "N/A", "max": f"{stats['max']:.2f}" if np.isfinite(stats['max']) else "N/A"}
 
             clusters_info.append({"id": i, "nombre": f"Grupo {i+1}", "cantidad": count, "caracteristicas": caracteristicas, "color": COLORES_CLUSTER[i % len(COLORES_CLUSTER)]})
         # CORRECCIÓN: Asegurar que kmeans tenga centroides antes de desescalar
@@ -433,14 +624,51 @@ def generar_clustering(dataset_id: str, n_clusters: int = 4) -> dict:
         print(f"🚨 ERROR en generar_clustering: {e}")
         return {"clusters": [], "centroides": [], "columnas": []}
 
+def generar_barrido_clustering(dataset_id: str, k_min: int = 2, k_max: int = 10, df: pd.DataFrame = None) -> dict:
+    """
+    Curvas del codo (inercia) y de silueta para k en [k_min, k_max]. Cada k se ajusta en un proceso del pool
+    y la silueta se calcula sobre una muestra de Config.CLUSTERING_MUESTRA_SILUETA filas.
+    """
+    print(f"-> generando_barrido_clustering (k={k_min}..{k_max}) para dataset {dataset_id}")
+    if k_min < 2 or k_max < k_min: raise ValueError("Se necesita 2 <= k_min <= k_max.")
+    if k_max - k_min >= 20: raise ValueError("El barrido admite como máximo 20 valores de k.")
+    version = None
+    if df is None: df, version = obtener_dataframe_versionado(dataset_id)
+    cols_for_clustering = columnas_clustering(df)
+    if len(cols_for_clustering) < 2: raise ValueError("Se necesitan >= 2 vars numéricas válidas.")
+    k_max = min(k_max, len(df))
+    if k_max < k_min: raise ValueError("No hay suficientes muestras.")
+
+    clave = (dataset_id, version, "barrido", k_min, k_max, tuple(cols_for_clustering)) if version else None
+    if clave is not None:
+        guardado = modelos_clustering.obtener(clave)
+        if guardado is not None: return guardado
+
+    inicio = time.perf_counter()
+    X_scaled, _ = matriz_clustering(df, cols_for_clustering)
+    resultados = barrido_k(X_scaled, k_min, k_max)
+    con_silueta = [r for r in resultados if r["silueta"] is not None]
+    resultado = {
+        "columnas": cols_for_clustering,
+        "filas": int(len(X_scaled)),
+        "metodo": "MiniBatchKMeans" if len(X_scaled) > Config.CLUSTERING_UMBRAL_FILAS else "KMeans",
+        "muestra_silueta": int(min(Config.CLUSTERING_MUESTRA_SILUETA, len(X_scaled))),
+        "resultados": resultados,
+        "k_sugerido": max(con_silueta, key=lambda r: r["silueta"])["k"] if con_silueta else None,
+        "tiempo": round(time.perf_counter() - inicio, 3)
+    }
+    if clave is not None: modelos_clustering.guardar(clave, resultado)
+    return resultado
+
 # =============================================================================
 # 5️⃣ Funciones de Análisis de Mercado (CORREGIDAS en respuesta anterior)
 # =============================================================================
-def generar_segmentacion_mercado(dataset_id: str, col_precio: str = 'precio', col_area: str = 'area_m2') -> dict:
+@usa_columnas('col_precio', 'col_area')
+def generar_segmentacion_mercado(dataset_id: str, col_precio: str = 'precio', col_area: str = 'area_m2', df: pd.DataFrame = None) -> dict:
     # ... (código existente robustecido) ...
     print(f"-> generando_segmentacion_mercado para dataset {dataset_id}")
     try:
-        df = obtener_dataframe_crudo(dataset_id)
+        if df is None: df = obtener_dataframe_crudo(dataset_id, columnas=columnas_requeridas(generar_segmentacion_mercado, col_precio=col_precio, col_area=col_area))
         if df.empty or col_precio not in df.columns or not pd.api.types.is_numeric_dtype(df[col_precio]):
             raise ValueError(f"Dataset vacío o columna '{col_precio}' inválida.")
         # CORRECCIÓN: Limpiar precio antes de cuantiles
@@ -474,62 +702,32 @@ def generar_segmentacion_mercado(dataset_id: str, col_precio: str = 'precio', co
         return {"distribucion": [], "estadisticas": {}}
 
 
-def detectar_anomalias_precios(dataset_id: str, cols_features: list = ['area_m2', 'habitaciones', 'banos', 'ano_construccion'], col_precio: str = 'precio', contamination: float = 0.05) -> dict:
+def _columnas_anomalias(df: pd.DataFrame, cols_features: list, col_precio: str) -> list:
+    """ Features numéricas presentes más el precio (que es obligatorio). """
+    cols_para_anomalia = [col for col in cols_features if col in df.columns and pd.api.types.is_numeric_dtype(df[col])]
+    if col_precio not in df.columns or not pd.api.types.is_numeric_dtype(df[col_precio]): raise ValueError(f"Columna '{col_precio}' inválida.")
+    cols_para_anomalia.append(col_precio)
+    if len(cols_para_anomalia) < 2: raise ValueError("Se necesitan >= 1 feature + precio para anomalías.")
+    return cols_para_anomalia
+
+@usa_columnas('cols_features', 'col_precio')
+def detectar_anomalias_precios(dataset_id: str, cols_features: list = ['area_m2', 'habitaciones', 'banos', 'ano_construccion'], col_precio: str = 'precio', contamination: float = 0.05, df: pd.DataFrame = None) -> dict:
     """ Detecta anomalías (outliers) usando Isolation Forest. """
     print(f"-> detectando_anomalias_precios para dataset {dataset_id}")
     default_return = {"gangas": [], "sobrevaloradas": [], "resumen": {}}
     try:
-        df = obtener_dataframe_crudo(dataset_id)
+        version = None
+        if df is None: df, version = obtener_dataframe_versionado(dataset_id, columnas=columnas_requeridas(detectar_anomalias_precios, cols_features=cols_features, col_precio=col_precio))
         if df.empty: return default_return
-        cols_para_anomalia = [col for col in cols_features if col in df.columns and pd.api.types.is_numeric_dtype(df[col])]
-        if col_precio not in df.columns or not pd.api.types.is_numeric_dtype(df[col_precio]): raise ValueError(f"Columna '{col_precio}' inválida.")
-        cols_para_anomalia.append(col_precio)
-        if len(cols_para_anomalia) < 2: raise ValueError("Se necesitan >= 1 feature + precio para anomalías.")
-
-        X = df[cols_para_anomalia].copy()
-        original_indices = X.index # Guardar índice ANTES de dropna/imputar
-
-        # CORRECCIÓN: Convertir a numérico y reemplazar Inf ANTES de imputar
-        for col in cols_para_anomalia:
-             X[col] = pd.to_numeric(X[col], errors='coerce')
-        X.replace([np.inf, -np.inf], np.nan, inplace=True)
-
-        # Imputar NaN
-        imputer = SimpleImputer(strategy='mean'); X_imputed = imputer.fit_transform(X)
-        # Asegurar que no queden NaN después de imputar (si toda una columna era NaN)
-        if np.isnan(X_imputed).any():
-            print("⚠️ Advertencia: NaN detectados después de imputación. Reemplazando con 0.")
-            X_imputed = np.nan_to_num(X_imputed, nan=0.0)
-
-        X_imputed_df = pd.DataFrame(X_imputed, columns=cols_para_anomalia, index=original_indices)
-
-        iso_forest = IsolationForest(contamination=contamination, random_state=42)
-        # CORRECCIÓN: Asegurar que no haya NaN/Inf antes de fit_predict
-        if X_imputed_df.isnull().values.any() or np.isinf(X_imputed_df.values).any():
-             raise ValueError("Datos inválidos (NaN/Inf) antes de IsolationForest.")
-
-        anomalia_pred = iso_forest.fit_predict(X_imputed_df)
-        scores_anomalia = iso_forest.decision_function(X_imputed_df)
-
-        # Usar el DataFrame original alineado con los resultados
-        df_anomalias = df.loc[original_indices].copy()
-        df_anomalias['es_anomalia'] = anomalia_pred; df_anomalias['score_anomalia'] = scores_anomalia
+        cols_para_anomalia = _columnas_anomalias(df, cols_features, col_precio)
 
-        # Calcular Z-score y desviación % (con manejo robusto)
-        precio_col_clean = df_anomalias[col_precio].replace([np.inf, -np.inf], np.nan).dropna()
-        precio_medio = precio_col_clean.mean()
-        precio_std = precio_col_clean.std()
-        if pd.isna(precio_medio) or pd.isna(precio_std) or precio_std == 0:
-             precio_medio = 0; precio_std = 1 # Valores por defecto si no se pueden calcular
-             df_anomalias['precio_zscore'] = 0
-             df_anomalias['desviacion_media_pct'] = 0
-        else:
-             df_anomalias['precio_zscore'] = (df_anomalias[col_precio] - precio_medio) / precio_std
-             df_anomalias['desviacion_media_pct'] = round(((df_anomalias[col_precio] - precio_medio) / (precio_medio if precio_medio != 0 else 1)) * 100, 1)
-             # Rellenar NaN que puedan quedar si el precio original era NaN
-             df_anomalias['precio_zscore'].fillna(0, inplace=True)
-             df_anomalias['desviacion_media_pct'].fillna(0, inplace=True)
+        # Imputer + IsolationForest guardados por versión del dataset: solo se ajustan la primera vez
+        modelo = obtener_modelo_anomalias(dataset_id, version, df, cols_para_anomalia, col_precio, contamination)
+        anomalia_pred, scores_anomalia, precio_zscore, desviacion_pct = puntuar_con_modelo(modelo, df)
 
+        df_anomalias = df.copy()
+        df_anomalias['es_anomalia'] = anomalia_pred; df_anomalias['score_anomalia'] = scores_anomalia
+        df_anomalias['precio_zscore'] = precio_zscore; df_anomalias['desviacion_media_pct'] = desviacion_pct
 
         anomalias_df = df_anomalias[df_anomalias['es_anomalia'] == -1].copy()
         gangas_df = anomalias_df[anomalias_df['precio_zscore'] < -0.5]
@@ -569,138 +767,443 @@ def detectar_anomalias_precios(dataset_id: str, cols_features: list = ['area_m2'
         print(f"🚨 ERROR en detectar_anomalias_precios: {e}")
         return default_return
 
-
-def calcular_score_inversion(dataset_id: str, col_precio: str = 'precio', col_area: str = 'area_m2', col_ano: str = 'ano_construccion', col_zona: str = 'zona') -> dict:
-    """ Calcula un score de inversión simple para cada propiedad. """
+def puntuar_anomalias_nuevas(dataset_id: str, propiedades: list, cols_features: list = ['area_m2', 'habitaciones', 'banos', 'ano_construccion'], col_precio: str = 'precio', contamination: float = 0.05) -> dict:
+    """
+    Puntúa un lote de propiedades nuevas (lista de dicts con las mismas columnas del dataset) con el modelo
+    guardado para la versión vigente del dataset, sin reajustarlo. Las features ausentes se imputan con la media.
+    """
+    print(f"-> puntuando {len(propiedades) if isinstance(propiedades, list) else 0} propiedades nuevas contra dataset {dataset_id}")
+    if not isinstance(propiedades, list) or not propiedades or not all(isinstance(p, dict) for p in propiedades):
+        raise ValueError("Se espera 'propiedades': una lista no vacía de objetos.")
+    if len(propiedades) > Config.ANOMALIAS_MAX_LOTE: raise ValueError(f"Como máximo {Config.ANOMALIAS_MAX_LOTE} propiedades por lote.")
+
+    columnas = columnas_requeridas(detectar_anomalias_precios, cols_features=cols_features, col_precio=col_precio)
+    df, version = obtener_dataframe_versionado(dataset_id, columnas=columnas)
+    if df.empty: raise ValueError("El dataset está vacío.")
+    modelo = obtener_modelo_anomalias(dataset_id, version, df, _columnas_anomalias(df, cols_features, col_precio), col_precio, contamination)
+
+    nuevas = pd.DataFrame(propiedades)
+    prediccion, scores, zscore, desviacion = puntuar_con_modelo(modelo, nuevas)
+    resultados = []
+    for i, (pred, score, z, desv) in enumerate(zip(prediccion.tolist(), scores.tolist(), zscore.tolist(), desviacion.tolist())):
+        tipo = 'Normal'
+        if pred == -1: tipo = 'Ganga' if z < -0.5 else ('Sobrevalorada' if z > 0.5 else 'Anomalía')
+        resultados.append({"indice": i, "es_anomalia": pred == -1, "tipo": tipo, "score": round(score, 4),
+                           "precio_zscore": round(z, 3) if np.isfinite(z) else 0, "desviacion_media": abs(desv) if np.isfinite(desv) else 0})
+    return {
+        "resultados": resultados,
+        "total_anomalias": sum(r["es_anomalia"] for r in resultados),
+        "modelo": {"version": version, "columnas": modelo["columnas"], "contamination": modelo["contamination"],
+                   "filas_dataset": modelo["filas"], "filas_ajuste": modelo["filas_ajuste"], "fecha_generacion": modelo["fecha_generacion"]}
+    }
+
+
+# --- Motor vectorizado del score de inversión ---
+# Calcula los scores columna a columna y arma los registros a partir de arrays, sin iterrows.
+# Reproduce exactamente la salida de la versión fila a fila (mismos valores, tipos y orden).
+POTENCIALES_SCORE = [(80, 'Excelente'), (65, 'Muy Bueno'), (50, 'Bueno'), (35, 'Regular')]
+NOMBRES_POTENCIAL = [nombre for _, nombre in POTENCIALES_SCORE] + ['Bajo']
+
+# Tablas de scores ya calculadas, por (dataset, versión, columnas): las páginas siguientes solo cortan
+scores_cache = CacheEnMemoria("scores_inversion", Config.SCORES_CACHE_ENTRADAS)
+
+def _score_precio(serie: pd.Series) -> pd.Series:
+    """ Precio bajo = mejor: z-score acotado a [-2, 2] y llevado a 0-100. """
+    serie = serie.replace([np.inf, -np.inf], np.nan).dropna()
+    if serie.empty or serie.nunique() < 2: return pd.Series([50] * len(serie), index=serie.index)
+    mean, std = serie.mean(), serie.std()
+    if std > 0 and pd.notna(std):
+        z = (serie - mean) / std; z_clamped = z.clip(-2, 2)
+        score = ((-z_clamped + 2) / 4) * 100
+        return score.fillna(50)
+    else: return pd.Series([50] * len(serie), index=serie.index)
+
+def _score_minmax(serie: pd.Series, invertir: bool = False) -> pd.Series:
+    """ Escala min-max a 0-100 (invertida: valor bajo = mejor, p. ej. ID de zona). """
+    serie = serie.replace([np.inf, -np.inf], np.nan).dropna()
+    if serie.empty or serie.nunique() < 2: return pd.Series([50] * len(serie), index=serie.index)
+    min_val, max_val = serie.min(), serie.max()
+    if max_val > min_val and pd.notna(min_val) and pd.notna(max_val):
+        score = ((serie - min_val) / (max_val - min_val)) * 100
+        if invertir: score = (1 - (serie - min_val) / (max_val - min_val)) * 100
+        return score.fillna(50)
+    else: return pd.Series([50] * len(serie), index=serie.index)
+
+def _score_columna(df: pd.DataFrame, columna: str, funcion, nombre: str) -> pd.Series:
+    if columna in df.columns and pd.api.types.is_numeric_dtype(df[columna]):
+        return funcion(df[columna]).reindex(df.index).fillna(50) # Reindexar y rellenar NaNs
+    print(f"⚠️ Columna '{columna}' no válida para {nombre}.")
+    return pd.Series([50.0] * len(df), index=df.index)
+
+def _valor_json(val, default=None, round_digits=None, convert_int=False):
+    """ Valor de una celda tal como sale en el JSON (NaN/Inf -> default; números -> float/int redondeado). """
+    if pd.isna(val) or (isinstance(val, float) and not np.isfinite(val)): return default
+    try:
+        num_val = float(val)
+        if round_digits is not None: num_val = round(num_val, round_digits)
+        if convert_int: return int(num_val)
+    except (ValueError, TypeError): return val if val is not None else default
+    return None if not np.isfinite(num_val) else num_val
+
+def _columna_json(df: pd.DataFrame, columna: str, default, round_digits: int = None, convert_int: bool = False) -> list:
+    """ _valor_json aplicado a toda una columna; las numéricas se resuelven con máscaras sobre el array. """
+    if columna not in df.columns: return [default] * len(df)
+    serie = df[columna]
+    if not pd.api.types.is_numeric_dtype(serie):
+        return [_valor_json(v, default, round_digits, convert_int) for v in serie.to_numpy(dtype=object).tolist()]
+    valores = serie.to_numpy(dtype=np.float64, na_value=np.nan)
+    finitos = np.isfinite(valores)
+    if convert_int: convertir = int
+    elif round_digits is not None: convertir = lambda v: round(v, round_digits) # round() de Python, no np.round
+    else: convertir = float
+    return [convertir(v) if ok else default for v, ok in zip(valores.tolist(), finitos.tolist())]
+
+def _columna_cruda_json(df: pd.DataFrame, columna: str) -> list:
+    """
+    Valores sin convertir (p. ej. la zona, que puede ser texto). Se toman con el tipo común de la fila,
+    como los daba iterrows: si todas las columnas son numéricas la zona sale como float.
+    """
+    if columna not in df.columns: return [None] * len(df)
+    valores = df[columna].to_numpy(dtype=df.iloc[:0].to_numpy().dtype)
+    if valores.dtype.kind == 'f':
+        return [v if ok else None for v, ok in zip(valores.tolist(), np.isfinite(valores).tolist())]
+    nulos = pd.isna(valores)
+    return [None if nulo or (isinstance(v, float) and not np.isfinite(v)) else v for v, nulo in zip(valores.tolist(), nulos.tolist())]
+
+def calcular_tabla_scores(df: pd.DataFrame, col_precio: str = 'precio', col_area: str = 'area_m2', col_ano: str = 'ano_construccion', col_zona: str = 'zona') -> dict:
+    """
+    Scores de todas las propiedades como arrays: {"score_inversion" (int), "potencial" (código 0-4 de NOMBRES_POTENCIAL),
+    "clave" (orden total: mayor score primero y, a igual score, la fila anterior), "orden" (se calcula al pedirlo),
+    "score_promedio", "distribucion"} más el DataFrame de las columnas de salida (para armar los registros pedidos).
+    """
+    score_p = _score_columna(df, col_precio, _score_precio, 'score_precio')
+    score_a = _score_columna(df, col_ano, _score_minmax, 'score_antiguedad')
+    score_z = _score_columna(df, col_zona, lambda s: _score_minmax(s, invertir=True), 'score_zona')
+
+    # Score Combinado (Ponderado)
+    score_inversion_float = (0.5 * score_p + 0.3 * score_a + 0.2 * score_z)
+    score_inversion = score_inversion_float.fillna(50).round().astype(int).clip(0, 100)
+    scores = score_inversion.to_numpy()
+
+    # Potencial por tramos de score (como código int8; el nombre se pone al armar los registros)
+    potencial = np.select([scores >= umbral for umbral, _ in POTENCIALES_SCORE], list(range(len(POTENCIALES_SCORE))), default=len(POTENCIALES_SCORE)).astype(np.int8)
+    conteos = np.bincount(potencial, minlength=len(NOMBRES_POTENCIAL)).tolist()
+
+    score_promedio_calc = score_inversion.mean() # Ya maneja NaN internamente
+    return {
+        "df": df,
+        "columnas": {"precio": col_precio, "area_m2": col_area, "zona": col_zona, "ano_construccion": col_ano},
+        "score_inversion": scores,
+        "potencial": potencial,
+        "clave": (100 - scores.astype(np.int64)) * len(scores) + np.arange(len(scores), dtype=np.int64),
+        "orden": None,
+        "score_promedio": round(score_promedio_calc, 1) if pd.notna(score_promedio_calc) else 0.0,
+        "distribucion": {"excelente": conteos[0], "muy_bueno": conteos[1], "bueno": conteos[2], "regular": conteos[3], "bajo": conteos[4]}
+    }
+
+def _orden_scores(tabla: dict) -> np.ndarray:
+    """ Todas las filas de mayor a menor score; se ordena una sola vez por tabla (las páginas siguientes solo cortan). """
+    if tabla["orden"] is None:
+        tabla["orden"] = np.argsort(tabla["clave"]) # Claves únicas: el orden no depende de la estabilidad
+    return tabla["orden"]
+
+def seleccionar_scores(tabla: dict, limit: int = None, offset: int = 0, min_score: float = None, potenciales: list = None) -> tuple:
+    """
+    Posiciones de las filas pedidas (filtradas y en orden de score) y el total que pasa los filtros.
+    Con `limit` y sin el orden completo calculado, solo se seleccionan las offset+limit mejores
+    con np.argpartition (O(n)) en lugar de ordenar todo el dataset.
+    """
+    mascara = None
+    if min_score is not None:
+        mascara = tabla["score_inversion"] >= min_score
+    if potenciales:
+        en_potencial = np.isin(tabla["potencial"], [NOMBRES_POTENCIAL.index(p) for p in potenciales])
+        mascara = en_potencial if mascara is None else mascara & en_potencial
+
+    if limit is None or tabla["orden"] is not None:
+        orden = _orden_scores(tabla)
+        if mascara is not None: orden = orden[mascara[orden]]
+        return orden[offset:None if limit is None else offset + limit], len(orden)
+
+    candidatas = np.arange(len(tabla["clave"])) if mascara is None else np.flatnonzero(mascara)
+    total, k = len(candidatas), offset + limit
+    if k == 0 or offset >= total: return candidatas[:0], total
+    if k < total:
+        candidatas = candidatas[np.argpartition(tabla["clave"][candidatas], k - 1)[:k]]
+    candidatas = candidatas[np.argsort(tabla["clave"][candidatas])]
+    return candidatas[offset:k], total
+
+def registros_score(tabla: dict, posiciones) -> list:
+    """ Arma los registros de salida de las filas `posiciones` (en ese orden); solo se convierten esas filas. """
+    posiciones = np.asarray(posiciones, dtype=np.int64)
+    df, columnas = tabla["df"].iloc[posiciones], tabla["columnas"]
+    indice = np.asarray(df.index).astype(np.int64).tolist()
+    precio = _columna_json(df, columnas["precio"], default=0.0, round_digits=2)
+    area = _columna_json(df, columnas["area_m2"], default=0.0, round_digits=2)
+    zona = _columna_cruda_json(df, columnas["zona"])
+    ano = _columna_json(df, columnas["ano_construccion"], default=0, convert_int=True)
+    return [
+        {"indice": indice[i], "precio": precio[i], "score_inversion": score, "potencial": NOMBRES_POTENCIAL[codigo],
+         "area_m2": area[i], "zona": zona[i], "ano_construccion": ano[i]}
+        for i, (score, codigo) in enumerate(zip(tabla["score_inversion"][posiciones].tolist(), tabla["potencial"][posiciones].tolist()))
+    ]
+
+def normalizar_potenciales(potencial) -> list:
+    """ Acepta 'Excelente', 'muy_bueno', 'Muy Bueno'... (str separado por comas o lista) y devuelve los nombres canónicos. """
+    if not potencial: return None
+    valores = potencial.split(',') if isinstance(potencial, str) else list(potencial)
+    canonicos = {nombre.lower(): nombre for nombre in NOMBRES_POTENCIAL}
+    nombres = []
+    for valor in valores:
+        nombre = canonicos.get(str(valor).strip().replace('_', ' ').lower())
+        if nombre is None: raise ValueError(f"Potencial '{valor}' no válido. Opciones: {NOMBRES_POTENCIAL}")
+        nombres.append(nombre)
+    return nombres
+
+@usa_columnas('col_precio', 'col_area', 'col_ano', 'col_zona')
+def calcular_score_inversion(dataset_id: str, col_precio: str = 'precio', col_area: str = 'area_m2', col_ano: str = 'ano_construccion', col_zona: str = 'zona',
+                             limit: int = None, offset: int = 0, min_score: float = None, potencial=None, df: pd.DataFrame = None) -> dict:
+    """
+    Calcula un score de inversión simple para cada propiedad.
+    Con `limit`/`offset` devuelve solo esa página del ranking y con `min_score`/`potencial` filtra las propiedades;
+    "paginacion" informa cuántas pasan los filtros. La tabla de scores se guarda por versión del dataset.
+    """
     print(f"-> calculando_score_inversion para dataset {dataset_id}")
     default_stats = {"propiedades": [], "estadisticas": {"score_promedio": 0.0, "total_propiedades": 0, "distribucion": {"excelente": 0, "muy_bueno": 0, "bueno": 0, "regular": 0, "bajo": 0}}}
+    potenciales = normalizar_potenciales(potencial)
+    if (limit is not None and limit < 0) or offset < 0: raise ValueError("limit y offset deben ser >= 0.")
+    paginado = limit is not None or offset > 0 or min_score is not None or potenciales is not None
     try:
-        df = obtener_dataframe_crudo(dataset_id)
+        tabla = None
+        if df is None:
+            columnas = columnas_requeridas(calcular_score_inversion, col_precio=col_precio, col_area=col_area, col_ano=col_ano, col_zona=col_zona)
+            df, version = obtener_dataframe_versionado(dataset_id, columnas=columnas)
+            clave = (dataset_id, version, col_precio, col_area, col_ano, col_zona)
+            tabla = scores_cache.obtener(clave)
+            if tabla is None and not df.empty:
+                tabla = calcular_tabla_scores(df, col_precio, col_area, col_ano, col_zona)
+                scores_cache.guardar(clave, tabla)
         if df.empty:
              print("   Dataset vacío, no se puede calcular score.")
              return default_stats
-        df_scores = df.copy()
-
-        # --- Funciones de cálculo de score (robustecidas) ---
-        def score_precio_func(serie):
-            serie = serie.replace([np.inf, -np.inf], np.nan).dropna() # Limpiar serie
-            if serie.empty or serie.nunique() < 2: return pd.Series([50] * len(serie), index=serie.index) # Usar longitud original o la limpia? Usar limpia por ahora.
-            mean, std = serie.mean(), serie.std()
-            if std > 0 and pd.notna(std):
-                z = (serie - mean) / std; z_clamped = z.clip(-2, 2)
-                score = ((-z_clamped + 2) / 4) * 100
-                return score.fillna(50)
-            else: return pd.Series([50] * len(serie), index=serie.index)
-
-        def score_antiguedad_func(serie):
-            serie = serie.replace([np.inf, -np.inf], np.nan).dropna()
-            if serie.empty or serie.nunique() < 2: return pd.Series([50] * len(serie), index=serie.index)
-            min_val, max_val = serie.min(), serie.max()
-            if max_val > min_val and pd.notna(min_val) and pd.notna(max_val):
-                 score = ((serie - min_val) / (max_val - min_val)) * 100
-                 return score.fillna(50)
-            else: return pd.Series([50] * len(serie), index=serie.index)
-
-        def score_zona_func(serie): # Asume zona numérica, ID bajo = mejor
-             serie = serie.replace([np.inf, -np.inf], np.nan).dropna()
-             if serie.empty or serie.nunique() < 2: return pd.Series([50] * len(serie), index=serie.index)
-             min_val, max_val = serie.min(), serie.max()
-             if max_val > min_val and pd.notna(min_val) and pd.notna(max_val):
-                  score = (1 - (serie - min_val) / (max_val - min_val)) * 100
-                  return score.fillna(50)
-             else: return pd.Series([50] * len(serie), index=serie.index)
-
-        # --- Calcular scores individuales ---
-        score_p = pd.Series([50.0] * len(df_scores), index=df_scores.index) # Inicializar con defecto
-        if col_precio in df_scores.columns and pd.api.types.is_numeric_dtype(df_scores[col_precio]):
-             score_p_calc = score_precio_func(df_scores[col_precio])
-             score_p = score_p_calc.reindex(df_scores.index).fillna(50) # Reindexar y rellenar NaNs
-        else: print(f"⚠️ Columna '{col_precio}' no válida para score_precio.")
-
-        score_a = pd.Series([50.0] * len(df_scores), index=df_scores.index)
-        if col_ano in df_scores.columns and pd.api.types.is_numeric_dtype(df_scores[col_ano]):
-             score_a_calc = score_antiguedad_func(df_scores[col_ano])
-             score_a = score_a_calc.reindex(df_scores.index).fillna(50)
-        else: print(f"⚠️ Columna '{col_ano}' no válida para score_antiguedad.")
-
-        score_z = pd.Series([50.0] * len(df_scores), index=df_scores.index)
-        if col_zona in df_scores.columns and pd.api.types.is_numeric_dtype(df_scores[col_zona]):
-             score_z_calc = score_zona_func(df_scores[col_zona])
-             score_z = score_z_calc.reindex(df_scores.index).fillna(50)
-        else: print(f"⚠️ Columna '{col_zona}' no válida para score_zona.")
-
-        df_scores['score_precio'] = score_p
-        df_scores['score_antiguedad'] = score_a
-        df_scores['score_zona'] = score_z
-
-        # Score Combinado (Ponderado)
-        df_scores['score_inversion_float'] = (0.5 * df_scores['score_precio'] + 0.3 * df_scores['score_antiguedad'] + 0.2 * df_scores['score_zona'])
-        df_scores['score_inversion'] = df_scores['score_inversion_float'].fillna(50).round().astype(int).clip(0, 100)
-
-        # Asignar Potencial
-        def asignar_potencial(score):
-            if pd.isna(score): return 'Bajo'
-            score = int(score) # Asegurar que sea int
-            if score >= 80: return 'Excelente';
-            if score >= 65: return 'Muy Bueno';
-            if score >= 50: return 'Bueno';
-            if score >= 35: return 'Regular';
-            return 'Bajo'
-        df_scores['potencial'] = df_scores['score_inversion'].apply(asignar_potencial)
-
-        # Formatear Salida
-        propiedades = []
-        def safe_get(row_dict, key, default=None, round_digits=None, convert_int=False):
-            val = row_dict.get(key)
-            if pd.isna(val) or (isinstance(val, float) and not np.isfinite(val)): return default # Chequear NaN y Inf
-            try:
-                num_val = float(val)
-                if round_digits is not None: num_val = round(num_val, round_digits)
-                if convert_int: return int(num_val)
-                return num_val
-            except (ValueError, TypeError): return val if val is not None else default
-
-        for index, row in df.iterrows(): # Iterar sobre df ORIGINAL para tener todas las filas
-             score_row = df_scores.loc[index] if index in df_scores.index else None
-             if score_row is None or pd.isna(score_row.get('score_inversion')): continue # Saltar si no hay score o es NaN
-
-             prop = {
-                 "indice": int(index),
-                 "precio": safe_get(row, col_precio, default=0.0, round_digits=2),
-                 "score_inversion": int(score_row['score_inversion']),
-                 "potencial": score_row.get('potencial', 'Bajo')
-             }
-             prop['area_m2'] = safe_get(row, col_area, default=0.0, round_digits=2)
-             # CORRECCIÓN: Devolver zona original (puede ser str), manejar NaN
-             zona_val = row.get(col_zona)
-             prop['zona'] = zona_val if pd.notna(zona_val) else None
-             prop['ano_construccion'] = safe_get(row, col_ano, default=0, convert_int=True)
-
-             # Limpiar diccionario final de NaNs flotantes (opcional, pero buena práctica)
-             prop_clean = {}
-             for k, v in prop.items():
-                  if isinstance(v, float) and (pd.isna(v) or not np.isfinite(v)):
-                       prop_clean[k] = None # O 0 según prefieras
-                  else:
-                       prop_clean[k] = v
-             propiedades.append(prop_clean)
-
-
-        propiedades.sort(key=lambda x: x.get('score_inversion', 0), reverse=True)
-
-        # Estadísticas
-        score_promedio_calc = df_scores['score_inversion'].mean() # Ya maneja NaN internamente
-        score_promedio_final = round(score_promedio_calc, 1) if pd.notna(score_promedio_calc) else 0.0
-        distribucion_potencial = df_scores['potencial'].value_counts().to_dict()
-        estadisticas = {
-            "score_promedio": score_promedio_final, "total_propiedades": len(propiedades), # Usar len(propiedades) filtradas
-            "distribucion": {"excelente": distribucion_potencial.get('Excelente', 0), "muy_bueno": distribucion_potencial.get('Muy Bueno', 0), "bueno": distribucion_potencial.get('Bueno', 0), "regular": distribucion_potencial.get('Regular', 0), "bajo": distribucion_potencial.get('Bajo', 0)}
-        }
+        if tabla is None: tabla = calcular_tabla_scores(df, col_precio, col_area, col_ano, col_zona)
 
+        posiciones, total_filtradas = seleccionar_scores(tabla, limit, offset, min_score, potenciales)
+        propiedades = registros_score(tabla, posiciones)
         if not propiedades: print("⚠️ La lista final de propiedades para score de inversión está vacía.")
 
-        return {"propiedades": propiedades, "estadisticas": estadisticas}
+        estadisticas = {"score_promedio": tabla["score_promedio"], "total_propiedades": len(tabla["score_inversion"]), "distribucion": tabla["distribucion"]}
+        resultado = {"propiedades": propiedades, "estadisticas": estadisticas}
+        if paginado:
+            resultado["paginacion"] = {"total_filtradas": int(total_filtradas), "offset": offset, "limit": limit}
+        return resultado
     except Exception as e:
         print(f"🚨 ERROR en calcular_score_inversion: {e}")
         return default_stats
 
+# =============================================================================
+# 6️⃣ Versiones por Chunks (datasets más grandes que la RAM del worker)
+# =============================================================================
+# Cada función recibe un LectorPorChunks y devuelve exactamente la misma estructura
+# que su versión sobre el DataFrame completo, sin llegar a construirlo nunca.
+
+def _combinar_momentos(acumulado: dict, valores: np.ndarray):
+    """ Actualiza (n, media, m2, min, max) con un bloque de valores usando la fórmula de Chan et al. """
+    n_b = len(valores)
+    if n_b == 0: return
+    with np.errstate(invalid='ignore'): # Columnas con ±inf dan media/m2 NaN, como en pandas
+        media_b = valores.mean()
+        m2_b = ((valores - media_b) ** 2).sum()
+        n_a = acumulado["n"]
+        n = n_a + n_b
+        delta = media_b - acumulado["media"]
+        acumulado["media"] = acumulado["media"] + delta * n_b / n if n_a else media_b
+        acumulado["m2"] = acumulado["m2"] + m2_b + delta ** 2 * n_a * n_b / n if n_a else m2_b
+    acumulado["n"] = n
+    acumulado["min"] = min(acumulado["min"], valores.min())
+    acumulado["max"] = max(acumulado["max"], valores.max())
+
+def estadisticas_dataset_por_chunks(lector: LectorPorChunks) -> dict:
+    """ Igual que estadisticas_dataset. Los duplicados se detectan con un hash de 8 bytes por fila. """
+    try:
+        total_filas, total_columnas, total_nulos = 0, 0, 0
+        hashes = []
+        for chunk in lector.iterar():
+            total_filas += len(chunk)
+            total_columnas = chunk.shape[1]
+            total_nulos += int(chunk.isnull().sum().sum())
+            # Normalizar numéricos a float64 para que 3 (int) y 3.0 (float) hasheen igual entre chunks
+            normalizado = chunk.apply(lambda s: s.astype('float64') if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s) else s)
+            hashes.append(pd.util.hash_pandas_object(normalizado, index=False).to_numpy())
+        if total_filas == 0 or total_columnas == 0: return {"total_filas": 0, "total_columnas": 0, "total_nulos": 0, "total_duplicados": 0, "porcentaje_nulos": 0.0}
+        total_duplicados = total_filas - len(np.unique(np.concatenate(hashes)))
+        denominador = total_filas * total_columnas
+        porcentaje_nulos = (total_nulos / denominador * 100) if denominador > 0 else 0.0
+        return {"total_filas": total_filas, "total_columnas": total_columnas, "total_nulos": total_nulos, "total_duplicados": int(total_duplicados), "porcentaje_nulos": round(porcentaje_nulos, 2)}
+    except Exception as e:
+        print(f"🚨 [ERROR] en estadisticas_dataset_por_chunks: {e}")
+        raise RuntimeError("No se pudieron calcular las estadísticas del dataset.") from e
+
+def obtener_columnas_por_chunks(lector: LectorPorChunks) -> list:
+    """ Igual que obtener_columnas, acumulando nulos, únicos y momentos columna a columna. """
+    try:
+        total_filas = 0
+        acumulados = {} # Conserva el orden de aparición de las columnas
+        for chunk in lector.iterar():
+            total_filas += len(chunk)
+            for c in chunk.columns:
+                serie = chunk[c]
+                a = acumulados.setdefault(c, {"tipo": None, "nulos": 0, "unicos": set(), "n": 0, "media": 0.0, "m2": 0.0, "min": np.inf, "max": -np.inf})
+                a["tipo"] = promover_tipo(a["tipo"], serie.dtype)
+                no_nulos = serie.dropna()
+                a["nulos"] += len(serie) - len(no_nulos)
+                a["unicos"].update(pd.unique(no_nulos))
+                if pd.api.types.is_numeric_dtype(serie):
+                    _combinar_momentos(a, no_nulos.to_numpy(dtype='float64'))
+        info_columnas = []
+        if total_filas == 0: return info_columnas
+        for c, a in acumulados.items():
+            col_info = {"nombre": c, "tipo": str(a["tipo"]), "valores_nulos": int(a["nulos"]), "valores_unicos": len(a["unicos"])}
+            if pd.api.types.is_numeric_dtype(a["tipo"]) and a["n"] > 0:
+                col_std = np.sqrt(a["m2"] / (a["n"] - 1)) if a["n"] > 1 else np.nan
+                col_info["min"] = float(a["min"]) if np.isfinite(a["min"]) else None
+                col_info["max"] = float(a["max"]) if np.isfinite(a["max"]) else None
+                col_info["promedio"] = float(a["media"]) if np.isfinite(a["media"]) else None
+                col_info["desviacion"] = float(col_std) if pd.notna(col_std) and np.isfinite(col_std) else None
+            info_columnas.append(col_info)
+        return info_columnas
+    except Exception as e:
+        print(f"🚨 [ERROR] en obtener_columnas_por_chunks: {e}")
+        raise RuntimeError("No se pudo obtener la información de las columnas.") from e
+
+def generar_histograma_por_chunks(lector: LectorPorChunks, columna: str = 'precio', bins: int = 10) -> list:
+    """ Igual que generar_histograma, en dos pasadas: rango (min/max) y luego conteos por bin. """
+    try:
+        tipo, minimo, maximo = None, np.inf, -np.inf
+        for chunk in lector.iterar():
+            if columna not in chunk.columns: raise ValueError(f"Columna '{columna}' no es numérica o no existe.")
+            tipo = promover_tipo(tipo, chunk[columna].dtype)
+            if not pd.api.types.is_numeric_dtype(tipo): raise ValueError(f"Columna '{columna}' no es numérica o no existe.")
+            valores = chunk[columna].replace([np.inf, -np.inf], np.nan).dropna()
+            if not valores.empty:
+                minimo, maximo = min(minimo, valores.min()), max(maximo, valores.max())
+        if tipo is None: raise ValueError(f"Columna '{columna}' no es numérica o no existe.")
+        if not np.isfinite(minimo): return []
+        counts = np.zeros(bins, dtype=np.int64); bin_edges = None
+        for chunk in lector.iterar():
+            valores = chunk[columna].replace([np.inf, -np.inf], np.nan).dropna()
+            c, bin_edges = np.histogram(valores, bins=bins, range=(minimo, maximo))
+            counts += c
+        data = []
+        for i in range(len(counts)):
+             rango = f"{bin_edges[i]:.0f}-{bin_edges[i+1]:.0f}"
+             data.append({"rango": rango, "frecuencia": int(counts[i])})
+        return data
+    except Exception as e:
+        print(f"Error en generar_histograma_por_chunks: {e}")
+        return []
+
+# =============================================================================
+# 7️⃣ Lote de Análisis (una sola carga para varios gráficos)
+# =============================================================================
+# Nombre (el mismo que la ruta individual) -> (función, recibe dataset_id, usa la matriz numérica compartida)
+ANALISIS_LOTE = {
+    "histograma-precio": (generar_histograma, False, False),
+    "boxplot-zonas": (generar_boxplot, False, False),
+    "serie-temporal": (generar_serie_temporal, False, False),
+    "mapa-calor": (generar_mapa_calor, False, False),
+    "datos-3d": (generar_datos_3d, False, False),
+    "analisis-radar": (generar_analisis_radar, True, False),
+    "sankey-flujo": (generar_sankey_flujo, True, False),
+    "grafico-burbujas": (generar_grafico_burbujas, True, False),
+    "analisis-sensibilidad": (generar_analisis_sensibilidad, True, True),
+    "clustering": (generar_clustering, True, True),
+    "segmentacion-mercado": (generar_segmentacion_mercado, True, False),
+    "anomalias-precios": (detectar_anomalias_precios, True, False),
+    "score-inversion": (calcular_score_inversion, True, False),
+}
+
+def _matriz_numerica(df: pd.DataFrame) -> pd.DataFrame:
+    """ Columnas numéricas con ±inf como NaN: la limpieza común de sensibilidad y clustering, hecha una vez. """
+    return df.select_dtypes(include=np.number).replace([np.inf, -np.inf], np.nan)
+
+def _normalizar_pedido_lote(analisis: list) -> list:
+    """
+    Acepta nombres sueltos o {"nombre": ..., "parametros": {...}, "alias": ...} y devuelve [(clave, nombre, parametros)].
+    La clave (el alias o, si no hay, el nombre) indexa los resultados, así que no puede repetirse: para pedir
+    el mismo análisis con distintos parámetros cada uno lleva su alias.
+    """
+    pedido, claves = [], set()
+    for item in analisis or []:
+        nombre, parametros = (item, {}) if isinstance(item, str) else (item.get("nombre"), item.get("parametros") or {})
+        clave = nombre if isinstance(item, str) else (item.get("alias") or nombre)
+        if nombre not in ANALISIS_LOTE:
+            raise ValueError(f"Análisis '{nombre}' no soportado. Opciones: {list(ANALISIS_LOTE)}")
+        if "df" in parametros or "dataset_id" in parametros:
+            raise ValueError(f"Parámetro no permitido en '{nombre}'.")
+        if clave in claves:
+            raise ValueError(f"Análisis '{clave}' repetido en el lote. Usa \"alias\" para pedirlo con otros parámetros.")
+        claves.add(clave)
+        pedido.append((clave, nombre, parametros))
+    if not pedido: raise ValueError("No se indicó ningún análisis.")
+    return pedido
+
+def generar_lote_analisis(dataset_id: str, analisis: list, max_hilos: int = None) -> dict:
+    """
+    Calcula varios análisis del mismo dataset con una sola carga: se leen una vez las columnas
+    que piden entre todos (o todas si alguno las necesita), la matriz numérica limpia se comparte
+    entre los que la usan y los análisis, que son independientes, corren en un pool de hilos.
+    Devuelve {"resultados", "tiempos" (segundos por análisis), "errores", "tiempo_carga", "tiempo_total"},
+    indexados por el alias de cada análisis (o su nombre).
+    """
+    inicio_total = time.perf_counter()
+    pedido = _normalizar_pedido_lote(analisis)
+    max_hilos = max_hilos or Config.ANALISIS_LOTE_HILOS
+    print(f"-> generando_lote_analisis ({len(pedido)} análisis) para dataset {dataset_id}")
+
+    # 1. Una sola carga con la unión de las columnas declaradas (None si alguno necesita todas)
+    columnas = []
+    for _, nombre, parametros in pedido:
+        funcion, _, usa_matriz = ANALISIS_LOTE[nombre]
+        requeridas = None if usa_matriz else columnas_requeridas(funcion, **parametros)
+        if requeridas is None:
+            columnas = None
+            break
+        columnas += [c for c in requeridas if c not in columnas]
+    inicio = time.perf_counter()
+    df = obtener_dataframe_crudo(dataset_id, columnas=columnas)
+    matriz = _matriz_numerica(df) if any(ANALISIS_LOTE[n][2] for _, n, _ in pedido) else None
+    tiempo_carga = time.perf_counter() - inicio
+
+    # 2. Cada análisis recibe solo sus columnas (o la matriz numérica compartida)
+    def ejecutar(nombre, parametros):
+        funcion, recibe_dataset, usa_matriz = ANALISIS_LOTE[nombre]
+        inicio = time.perf_counter()
+        datos = matriz if usa_matriz else _proyectar_columnas(df, columnas_requeridas(funcion, **parametros))
+        if recibe_dataset:
+            resultado = funcion(dataset_id, df=datos, **parametros)
+        else:
+            resultado = funcion(datos, **parametros)
+        return resultado, time.perf_counter() - inicio
+
+    resultados, tiempos, errores = {}, {}, {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_hilos, len(pedido))), thread_name_prefix="analisis-lote") as pool:
+        futuros = {pool.submit(ejecutar, nombre, parametros): clave for clave, nombre, parametros in pedido}
+        for futuro, clave in futuros.items():
+            try:
+                resultados[clave], segundos = futuro.result()
+                tiempos[clave] = round(segundos, 4)
+            except Exception as e:
+                print(f"🚨 ERROR en el análisis '{clave}' del lote: {e}")
+                resultados[clave] = None
+                errores[clave] = str(e)
+
+    return {
+        "resultados": resultados,
+        "tiempos": tiempos,
+        "errores": errores,
+        "tiempo_carga": round(tiempo_carga, 4),
+        "tiempo_total": round(time.perf_counter() - inicio_total, 4),
+        "filas": len(df),
+        "columnas_leidas": list(df.columns)
+    }
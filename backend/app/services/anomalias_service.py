@@ -0,0 +1,167 @@
+import io
+import os
+import shutil
+import hashlib
+import joblib
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from sklearn.impute import SimpleImputer
+from sklearn.ensemble import IsolationForest
+from app.config import Config
+from app.services.supabase_service import supabase
+from app.services.cache_service import CacheEnMemoria
+
+# Modelos ya cargados en este worker, por (dataset, versión, columnas, contamination)
+modelos_anomalias = CacheEnMemoria("modelos_anomalias", Config.ANOMALIAS_CACHE_ENTRADAS)
+
+# =============================================================================
+# 1️⃣ Ajuste del Modelo de Anomalías (imputer + IsolationForest)
+# =============================================================================
+def preparar_matriz_anomalias(df: pd.DataFrame, columnas: list) -> pd.DataFrame:
+    """ Columnas del modelo como numéricas, con ±inf como NaN (el imputer las rellena con la media). """
+    X = df.reindex(columns=columnas).copy()
+    # CORRECCIÓN: Convertir a numérico y reemplazar Inf ANTES de imputar
+    for col in columnas:
+         X[col] = pd.to_numeric(X[col], errors='coerce')
+    return X.replace([np.inf, -np.inf], np.nan)
+
+def imputar_anomalias(imputer: SimpleImputer, X: pd.DataFrame, columnas: list) -> pd.DataFrame:
+    X_imputed = imputer.transform(X)
+    # Asegurar que no queden NaN después de imputar (si toda una columna era NaN)
+    if np.isnan(X_imputed).any():
+        print("⚠️ Advertencia: NaN detectados después de imputación. Reemplazando con 0.")
+        X_imputed = np.nan_to_num(X_imputed, nan=0.0)
+    return pd.DataFrame(X_imputed, columns=columnas, index=X.index)
+
+def ajustar_modelo_anomalias(df: pd.DataFrame, columnas: list, col_precio: str, contamination: float) -> dict:
+    """
+    Ajusta el imputer (medias de todo el dataset) y el IsolationForest. Cada árbol ya usa una submuestra
+    de 256 filas; lo que crece con el dataset es puntuar todas las filas para fijar el umbral de
+    `contamination`, así que por encima de Config.ANOMALIAS_MUESTRA_AJUSTE filas el bosque se ajusta sobre
+    una muestra aleatoria. Los árboles se construyen en paralelo (Config.ANOMALIAS_N_JOBS).
+    """
+    X = preparar_matriz_anomalias(df, columnas)
+    imputer = SimpleImputer(strategy='mean').fit(X)
+    X_imputed_df = imputar_anomalias(imputer, X, columnas)
+    # CORRECCIÓN: Asegurar que no haya NaN/Inf antes de fit
+    if X_imputed_df.isnull().values.any() or np.isinf(X_imputed_df.values).any():
+         raise ValueError("Datos inválidos (NaN/Inf) antes de IsolationForest.")
+
+    X_ajuste = X_imputed_df
+    if len(X_ajuste) > Config.ANOMALIAS_MUESTRA_AJUSTE:
+        X_ajuste = X_ajuste.sample(n=Config.ANOMALIAS_MUESTRA_AJUSTE, random_state=42)
+    iso_forest = IsolationForest(contamination=contamination, random_state=42, n_jobs=Config.ANOMALIAS_N_JOBS)
+    iso_forest.fit(X_ajuste)
+
+    # Media y desviación del precio: clasifican las anomalías nuevas en gangas o sobrevaloradas
+    precio = pd.to_numeric(df[col_precio], errors='coerce').replace([np.inf, -np.inf], np.nan).dropna()
+    return {
+        "imputer": imputer, "forest": iso_forest, "columnas": columnas, "col_precio": col_precio,
+        "contamination": contamination, "precio_medio": precio.mean(), "precio_std": precio.std(),
+        "filas": int(len(X_imputed_df)), "filas_ajuste": int(len(X_ajuste)),
+        "fecha_generacion": datetime.utcnow().isoformat()
+    }
+
+# =============================================================================
+# 2️⃣ Persistencia por Versión del Dataset (memoria -> disco local -> Storage)
+# =============================================================================
+def _nombre_modelo(version: str, columnas: list, contamination: float) -> str:
+    # El nombre depende de la versión del dataset: un archivo con ese nombre nunca queda obsoleto
+    return hashlib.sha1(repr((version, tuple(columnas), float(contamination))).encode("utf-8")).hexdigest()[:16]
+
+def _bucket_artefactos():
+    # Import local: entrenamiento_service importa analisis_service, que importa este módulo
+    from app.services.entrenamiento_service import ARTEFACTOS_BUCKET_NAME
+    return ARTEFACTOS_BUCKET_NAME
+
+def _carpeta_storage_modelos(dataset_id: str) -> str:
+    return f"anomalias/{dataset_id}"
+
+def _ruta_storage_modelo(dataset_id: str, nombre: str) -> str:
+    return f"{_carpeta_storage_modelos(dataset_id)}/{nombre}.joblib"
+
+def _carpeta_local_modelos(dataset_id: str) -> str:
+    return os.path.join(Config.DATASET_CACHE_DIR, "modelos_anomalias", str(dataset_id))
+
+def _ruta_local_modelo(dataset_id: str, nombre: str) -> str:
+    return os.path.join(_carpeta_local_modelos(dataset_id), f"{nombre}.joblib")
+
+def _leer_modelo_guardado(dataset_id: str, nombre: str) -> dict:
+    """ Copia local si existe; si no, la del Storage (y se deja en disco para los demás workers). None si no hay. """
+    ruta_local = _ruta_local_modelo(dataset_id, nombre)
+    if not os.path.exists(ruta_local):
+        try:
+            contenido = supabase.storage.from_(_bucket_artefactos()).download(_ruta_storage_modelo(dataset_id, nombre))
+        except Exception:
+            return None
+        if not contenido: return None
+        os.makedirs(os.path.dirname(ruta_local), exist_ok=True)
+        ruta_tmp = f"{ruta_local}.{os.getpid()}.tmp"
+        with open(ruta_tmp, "wb") as f: f.write(contenido)
+        os.replace(ruta_tmp, ruta_local)
+    return joblib.load(ruta_local)
+
+def _guardar_modelo(modelo: dict, dataset_id: str, nombre: str):
+    buffer = io.BytesIO()
+    joblib.dump(modelo, buffer)
+    ruta_local = _ruta_local_modelo(dataset_id, nombre)
+    os.makedirs(os.path.dirname(ruta_local), exist_ok=True)
+    ruta_tmp = f"{ruta_local}.{os.getpid()}.tmp"
+    with open(ruta_tmp, "wb") as f: f.write(buffer.getvalue())
+    os.replace(ruta_tmp, ruta_local)
+    try:
+        path_in_storage = _ruta_storage_modelo(dataset_id, nombre)
+        supabase.storage.from_(_bucket_artefactos()).upload(path_in_storage, buffer.getvalue(), {"content-type": "application/octet-stream", "upsert": "true"})
+        print(f"-> Modelo de anomalías guardado en {_bucket_artefactos()}/{path_in_storage} ({buffer.tell() / 1e6:.2f} MB)")
+    except Exception as e:
+        print(f"⚠️ No se pudo subir el modelo de anomalías de {dataset_id}: {e}")
+
+def eliminar_modelos_anomalias(dataset_id: str):
+    """ Borra los modelos guardados de un dataset eliminado (todas sus versiones), del Storage y del disco local. """
+    try:
+        carpeta = _carpeta_storage_modelos(dataset_id)
+        archivos = supabase.storage.from_(_bucket_artefactos()).list(carpeta)
+        rutas = [f"{carpeta}/{archivo['name']}" for archivo in archivos or [] if archivo.get("name", "").endswith(".joblib")]
+        if rutas: supabase.storage.from_(_bucket_artefactos()).remove(rutas)
+    except Exception as e:
+        print(f"⚠️ No se pudieron eliminar del Storage los modelos de anomalías de {dataset_id}: {e}")
+    shutil.rmtree(_carpeta_local_modelos(dataset_id), ignore_errors=True)
+
+def obtener_modelo_anomalias(dataset_id: str, version: str, df: pd.DataFrame, columnas: list, col_precio: str, contamination: float) -> dict:
+    """
+    Devuelve el modelo de la versión `version` del dataset: de la memoria del worker, del disco local,
+    del Storage o, si no existe, ajustándolo sobre `df` y guardándolo.
+    Sin versión (p. ej. el frame compartido de /analisis-lote) se ajusta y no se guarda.
+    """
+    if version is None: return ajustar_modelo_anomalias(df, columnas, col_precio, contamination)
+    clave = (dataset_id, version, tuple(columnas), float(contamination))
+    modelo = modelos_anomalias.obtener(clave)
+    if modelo is not None: return modelo
+
+    nombre = _nombre_modelo(version, columnas, contamination)
+    modelo = _leer_modelo_guardado(dataset_id, nombre)
+    if modelo is None:
+        print(f"-> Ajustando modelo de anomalías para dataset {dataset_id} ({version})")
+        modelo = ajustar_modelo_anomalias(df, columnas, col_precio, contamination)
+        _guardar_modelo(modelo, dataset_id, nombre)
+    modelos_anomalias.guardar(clave, modelo)
+    return modelo
+
+# =============================================================================
+# 3️⃣ Puntuación con el Modelo Guardado
+# =============================================================================
+def puntuar_con_modelo(modelo: dict, df: pd.DataFrame) -> tuple:
+    """ Devuelve (predicción 1/-1, score de decision_function, z-score del precio, desviación % de la media) sin reajustar. """
+    X_imputed_df = imputar_anomalias(modelo["imputer"], preparar_matriz_anomalias(df, modelo["columnas"]), modelo["columnas"])
+    prediccion = modelo["forest"].predict(X_imputed_df)
+    scores = modelo["forest"].decision_function(X_imputed_df)
+
+    precio = pd.to_numeric(df[modelo["col_precio"]], errors='coerce') if modelo["col_precio"] in df.columns else pd.Series(np.nan, index=df.index)
+    precio_medio, precio_std = modelo["precio_medio"], modelo["precio_std"]
+    if pd.isna(precio_medio) or pd.isna(precio_std) or precio_std == 0:
+        zscore = pd.Series(0, index=df.index); desviacion = pd.Series(0, index=df.index)
+    else:
+        zscore = ((precio - precio_medio) / precio_std).fillna(0)
+        desviacion = round(((precio - precio_medio) / (precio_medio if precio_medio != 0 else 1)) * 100, 1).fillna(0)
+    return prediccion, scores, zscore, desviacion
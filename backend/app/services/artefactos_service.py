@@ -0,0 +1,85 @@
+import os
+import json
+import hashlib
+import requests
+from app.config import Config
+from app.services.supabase_service import supabase
+from app.services import http_service
+from app.services.singleflight_service import calculos_artefactos
+from app.services.datasets_service import PREFIJO_URL_STORAGE, ruta_derivada
+
+# =============================================================================
+# 1️⃣ Artefactos Derivados de un Dataset (perfil, sketches, momentos...)
+# =============================================================================
+# Resúmenes JSON que se calculan por chunks al registrar (o limpiar) un dataset y se guardan en el Storage
+# junto al CSV ('archivo.csv' -> 'archivo.<tipo>.json'). Cada worker los lee de una copia local revalidada
+# con un GET condicional, así no se recalculan ni se descargan en cada petición. Los datasets registrados
+# antes de existir un artefacto lo calculan la primera vez que se pide, una sola vez entre workers.
+
+def _ruta_local(archivo_url: str, carpeta: str) -> str:
+    nombre = hashlib.sha1(archivo_url.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(Config.DATASET_CACHE_DIR, carpeta, f"{nombre}.json")
+
+def guardar_artefacto(datos: dict, archivo_url: str, extension: str, descripcion: str) -> bool:
+    """ Sube el artefacto al Storage junto al CSV ('archivo.csv' -> 'archivo<extension>'). Devuelve False si no se pudo. """
+    try:
+        path_in_storage = ruta_derivada(archivo_url.split(PREFIJO_URL_STORAGE)[-1], extension)
+        supabase.storage.from_("datasets").upload(
+            path_in_storage, json.dumps(datos).encode("utf-8"),
+            {"content-type": "application/json", "upsert": "true"}
+        )
+        print(f"-> Artefacto guardado en {path_in_storage} ({descripcion})")
+        return True
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar {descripcion} de {archivo_url}: {e}")
+        return False
+
+def _leer_guardado(archivo_url: str, extension: str, ruta_local: str, ruta_sin_guardar: str) -> dict:
+    """
+    Artefacto guardado (revalidando la copia local). Si el Storage no lo tiene, el que se calculó en este
+    equipo sin poder subirlo (`ruta_sin_guardar`), o None si tampoco existe.
+    """
+    try:
+        http_service.descargar_con_revalidacion(ruta_derivada(archivo_url, extension), ruta_local)
+    except requests.exceptions.HTTPError:
+        ruta_local = ruta_sin_guardar
+        if not os.path.exists(ruta_local):
+            return None
+    with open(ruta_local) as f:
+        return json.load(f)
+
+def obtener_artefacto(dataset_id: str, extension: str, carpeta: str, calcular, descripcion: str) -> dict:
+    """
+    Devuelve el artefacto guardado del dataset (copia local en `carpeta`, revalidada con un GET condicional).
+    Si no existe (dataset registrado antes que el artefacto), lo calcula con calcular(dataset_id) y lo guarda:
+    las peticiones concurrentes, también de otros workers, esperan a un único cálculo (ver singleflight_service).
+    """
+    dataset_res = supabase.table("datasets").select("archivo_url").eq("id", dataset_id).single().execute()
+    if not dataset_res.data:
+        raise ValueError(f"❌ Dataset con ID '{dataset_id}' no encontrado.")
+    archivo_url = dataset_res.data["archivo_url"]
+
+    ruta_local = _ruta_local(archivo_url, carpeta)
+    # Con el ID en el nombre, un dataset que se vuelve a subir con la misma URL no hereda la copia anterior
+    ruta_sin_guardar = f"{ruta_local}.{dataset_id}.sin_guardar"
+    datos = _leer_guardado(archivo_url, extension, ruta_local, ruta_sin_guardar)
+    if datos is not None:
+        return datos
+
+    def calcular_y_guardar():
+        # Otro worker pudo guardarlo mientras se esperaba su lock: se vuelve a mirar antes de recorrer los datos
+        datos = _leer_guardado(archivo_url, extension, ruta_local, ruta_sin_guardar)
+        if datos is not None:
+            return datos
+        print(f"-> Dataset {dataset_id} sin artefacto guardado ({descripcion}): calculándolo por chunks")
+        datos = calcular(dataset_id)
+        if not guardar_artefacto(datos, archivo_url, extension, descripcion):
+            # Sin copia en el Storage se deja una local, para no recalcularlo en cada petición
+            os.makedirs(os.path.dirname(ruta_local), exist_ok=True)
+            with open(f"{ruta_local}.{os.getpid()}.tmp", "w") as f:
+                json.dump(datos, f)
+            os.replace(f"{ruta_local}.{os.getpid()}.tmp", ruta_sin_guardar)
+        return datos
+
+    clave = f"{hashlib.sha1(archivo_url.encode('utf-8')).hexdigest()[:16]}{extension}"
+    return calculos_artefactos.ejecutar(clave, calcular_y_guardar)
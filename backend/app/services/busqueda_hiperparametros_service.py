@@ -0,0 +1,391 @@
+import os
+import math
+import json
+import uuid
+import warnings
+import itertools
+import multiprocessing
+import joblib
+import numpy as np
+import torch
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from scipy.stats import norm
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import Matern
+from sklearn.metrics import precision_score, r2_score
+from app.config import Config
+from app.services.supabase_service import supabase
+from app.services.cache_service import CacheEnMemoria
+from app.services.entrenamiento_service import preparar_datos_entrenamiento, entrenar_modelo, iniciar_nuevo_entrenamiento, EntrenamientoCancelado
+from app.services.cola_entrenamientos_service import (
+    ReportadorProgreso, validar_configuracion, enviar_a_cola, _actualizar, _leer_experimento, TIPOS_MODELO
+)
+
+# =============================================================================
+# 1️⃣ Espacio de Búsqueda (rejilla, aleatoria, bayesiana)
+# =============================================================================
+# Una búsqueda es un experimento "padre" cuya configuración incluye la clave "busqueda":
+#   {"estrategia": "rejilla" | "aleatoria" | "bayesiana", "espacio": {...}, "pruebas": 20,
+#    "concurrencia": 2, "reduccion": 3, "epocas_minimas": 5, "semilla": 42}
+# En "espacio" cada parámetro es una lista de valores o, en aleatoria/bayesiana, un rango
+# {"min": 0.0001, "max": 0.01, "log": true, "entero": false}. Cada prueba se guarda como un
+# experimento hijo (configuracion.busqueda_id) y el padre guarda la clasificación en artefactos_info.
+ESTRATEGIAS_BUSQUEDA = ("rejilla", "aleatoria", "bayesiana")
+PARAMETROS_BUSQUEDA = ("tipo_modelo", "tasa_aprendizaje", "epocas", "tamano_lote", "paciencia")
+PARAMETROS_ENTEROS = ("epocas", "tamano_lote", "paciencia")
+
+def validar_busqueda(busqueda: dict) -> dict:
+    """ Normaliza la especificación de la búsqueda (lanza ValueError para que la ruta responda 400). """
+    if not isinstance(busqueda, dict): raise ValueError("Se requiere la clave 'busqueda' con la estrategia y el espacio.")
+    estrategia = (busqueda.get("estrategia") or "aleatoria").lower()
+    if estrategia not in ESTRATEGIAS_BUSQUEDA: raise ValueError(f"Estrategia '{estrategia}' no válida. Opciones: {list(ESTRATEGIAS_BUSQUEDA)}")
+    espacio = busqueda.get("espacio") or {}
+    if not espacio: raise ValueError("El espacio de búsqueda está vacío.")
+    for nombre, valores in espacio.items():
+        if nombre not in PARAMETROS_BUSQUEDA: raise ValueError(f"Parámetro '{nombre}' no admitido. Opciones: {list(PARAMETROS_BUSQUEDA)}")
+        if isinstance(valores, list):
+            if not valores: raise ValueError(f"La lista de valores de '{nombre}' está vacía.")
+            if nombre == "tipo_modelo" and any(v not in TIPOS_MODELO for v in valores): raise ValueError(f"'tipo_modelo' solo admite {list(TIPOS_MODELO)}.")
+        elif isinstance(valores, dict) and estrategia != "rejilla":
+            if nombre == "tipo_modelo": raise ValueError("'tipo_modelo' debe ser una lista de valores.")
+            minimo, maximo = float(valores.get("min", 0)), float(valores.get("max", 0))
+            if not minimo < maximo: raise ValueError(f"Rango inválido para '{nombre}': se requiere min < max.")
+            if valores.get("log") and minimo <= 0: raise ValueError(f"El rango logarítmico de '{nombre}' debe ser positivo.")
+        else:
+            raise ValueError(f"'{nombre}' debe ser una lista de valores" + ("" if estrategia == "rejilla" else " o un rango {min, max}") + ".")
+
+    concurrencia = int(busqueda.get("concurrencia") or Config.BUSQUEDA_CONCURRENCIA)
+    if not 1 <= concurrencia <= Config.BUSQUEDA_MAX_CONCURRENCIA: raise ValueError(f"'concurrencia' debe estar entre 1 y {Config.BUSQUEDA_MAX_CONCURRENCIA}.")
+    reduccion = int(busqueda.get("reduccion") or Config.BUSQUEDA_REDUCCION)
+    if reduccion < 2: raise ValueError("'reduccion' debe ser al menos 2.")
+    if estrategia == "rejilla":
+        pruebas = math.prod(len(v) for v in espacio.values())
+    else:
+        pruebas = int(busqueda.get("pruebas") or 10)
+    if not 1 <= pruebas <= Config.BUSQUEDA_MAX_PRUEBAS: raise ValueError(f"La búsqueda tendría {pruebas} pruebas; el máximo es {Config.BUSQUEDA_MAX_PRUEBAS}.")
+    return {
+        "estrategia": estrategia, "espacio": espacio, "pruebas": pruebas, "concurrencia": concurrencia, "reduccion": reduccion,
+        "epocas_minimas": max(1, int(busqueda.get("epocas_minimas") or Config.BUSQUEDA_EPOCAS_MINIMAS)),
+        "semilla": int(busqueda.get("semilla", 42))
+    }
+
+def _muestrear(espacio: dict, rng: np.random.Generator) -> dict:
+    parametros = {}
+    for nombre, valores in espacio.items():
+        if isinstance(valores, list):
+            parametros[nombre] = valores[int(rng.integers(len(valores)))]
+            continue
+        minimo, maximo = float(valores["min"]), float(valores["max"])
+        valor = math.exp(rng.uniform(math.log(minimo), math.log(maximo))) if valores.get("log") else rng.uniform(minimo, maximo)
+        parametros[nombre] = int(round(valor)) if valores.get("entero") or nombre in PARAMETROS_ENTEROS else float(valor)
+    return parametros
+
+def _codificar(espacio: dict, parametros: dict) -> list:
+    """ Vector en [0, 1] para el proceso gaussiano: rangos normalizados (en log si procede) y one-hot en las listas. """
+    vector = []
+    for nombre, valores in espacio.items():
+        valor = parametros[nombre]
+        if isinstance(valores, list):
+            vector.extend(1.0 if valor == opcion else 0.0 for opcion in valores)
+        elif valores.get("log"):
+            vector.append((math.log(valor) - math.log(valores["min"])) / (math.log(valores["max"]) - math.log(valores["min"])))
+        else:
+            vector.append((valor - valores["min"]) / (valores["max"] - valores["min"]))
+    return vector
+
+class GeneradorPruebas:
+    """
+    Propone los parámetros de la siguiente prueba. Rejilla: producto cartesiano; aleatoria: muestras con
+    semilla; bayesiana: las primeras al azar y después la de mayor mejora esperada (EI) según un proceso
+    gaussiano ajustado a las puntuaciones ya observadas, entre Config.BUSQUEDA_CANDIDATOS_BAYESIANA candidatas.
+    """
+    def __init__(self, especificacion: dict):
+        self.espacio = especificacion["espacio"]
+        self.estrategia = especificacion["estrategia"]
+        self.rng = np.random.default_rng(especificacion["semilla"])
+        self.iniciales = max(2, especificacion["concurrencia"])
+        self.observaciones = [] # (parámetros, puntuación)
+        self.propuestas = []
+        if self.estrategia == "rejilla":
+            nombres = list(self.espacio)
+            self._rejilla = iter([dict(zip(nombres, valores)) for valores in itertools.product(*self.espacio.values())])
+
+    def observar(self, parametros: dict, puntuacion: float):
+        if np.isfinite(puntuacion): self.observaciones.append((parametros, puntuacion))
+
+    def proponer(self) -> dict:
+        if self.estrategia == "rejilla":
+            parametros = next(self._rejilla)
+        elif self.estrategia == "aleatoria" or len(self.observaciones) < self.iniciales:
+            parametros = _muestrear(self.espacio, self.rng)
+        else:
+            parametros = self._proponer_bayesiana()
+        self.propuestas.append(parametros)
+        return parametros
+
+    def _proponer_bayesiana(self) -> dict:
+        X = np.array([_codificar(self.espacio, p) for p, _ in self.observaciones])
+        y = np.array([v for _, v in self.observaciones])
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore") # Con pocas observaciones el ajuste de la escala suele tocar los límites
+            gp = GaussianProcessRegressor(kernel=Matern(nu=2.5), alpha=1e-6, normalize_y=True, random_state=0).fit(X, y)
+        candidatas = [_muestrear(self.espacio, self.rng) for _ in range(Config.BUSQUEDA_CANDIDATOS_BAYESIANA)]
+        # Las ya propuestas (aún sin puntuación) no se repiten
+        ya_propuestas = {json.dumps(p, sort_keys=True) for p in self.propuestas}
+        candidatas = [c for c in candidatas if json.dumps(c, sort_keys=True) not in ya_propuestas] or candidatas
+        media, desviacion = gp.predict(np.array([_codificar(self.espacio, c) for c in candidatas]), return_std=True)
+        mejora = media - y.max() - 0.01 * abs(y.max())
+        z = np.divide(mejora, desviacion, out=np.zeros_like(mejora), where=desviacion > 0)
+        ei = np.where(desviacion > 0, mejora * norm.cdf(z) + desviacion * norm.pdf(z), 0.0)
+        return candidatas[int(np.argmax(ei))]
+
+# =============================================================================
+# 2️⃣ Pruebas en Procesos (datos preprocesados una vez, compartidos por archivo)
+# =============================================================================
+# Datos de la búsqueda abiertos por cada proceso (los arrays con memory-map)
+_datos_en_proceso = CacheEnMemoria("datos_busqueda_proceso", 2)
+
+def puntuar_prueba(datos: dict, entrenado: dict) -> float:
+    """ Precisión ponderada (clasificación) o R² (regresión) en validación; mayor es mejor. """
+    if datos["es_clasificacion"]:
+        return float(precision_score(datos["y_test"], entrenado["predicciones"], average='weighted', zero_division=0))
+    y_real = datos["y_test"].to_numpy().reshape(-1, 1)
+    if datos["scaler_y"] is not None: y_real = datos["scaler_y"].inverse_transform(y_real)
+    return float(r2_score(y_real.ravel(), entrenado["predicciones"]))
+
+def _ejecutar_prueba(ruta_datos: str, config_prueba: dict, busqueda_id: str, experimento_id: str, final: bool, hilos: int) -> dict:
+    """
+    Se ejecuta en un proceso del pool de la búsqueda. Las rondas intermedias solo entrenan y puntúan;
+    la ronda final guarda el experimento hijo completo (métricas, importancia y artefactos).
+    """
+    torch.set_num_threads(hilos)
+    datos = _datos_en_proceso.obtener(ruta_datos)
+    if datos is None:
+        datos = joblib.load(ruta_datos, mmap_mode='r')
+        _datos_en_proceso.guardar(ruta_datos, datos)
+    vigilante = ReportadorProgreso(busqueda_id, guardar_epocas=False) # Cancelar la búsqueda detiene sus pruebas
+    if final:
+        fila = iniciar_nuevo_entrenamiento(config_prueba, experimento_id=experimento_id, progreso=vigilante, datos=datos)
+        metricas = json.loads(fila.get("metricas") or "{}")
+        puntuacion = metricas.get("precision") if datos["es_clasificacion"] else metricas.get("r2_score")
+        return {"puntuacion": float(puntuacion) if puntuacion is not None else float("nan"), "epocas_entrenadas": metricas.get("epocas_entrenadas"), "estado": fila.get("estado")}
+    entrenado = entrenar_modelo(datos, config_prueba, progreso=vigilante)
+    return {"puntuacion": puntuar_prueba(datos, entrenado), "epocas_entrenadas": entrenado["epocas_entrenadas"]}
+
+# =============================================================================
+# 3️⃣ Successive Halving y Clasificación
+# =============================================================================
+def presupuesto_ronda(epocas: int, ronda: int, rondas: int, reduccion: int) -> int:
+    """ Épocas de una prueba en la ronda `ronda`: epocas / reduccion^(rondas-1-ronda), la última con todas. """
+    return max(1, math.ceil(epocas / reduccion ** (rondas - 1 - ronda)))
+
+def _epocas_maximas(config_base: dict, espacio: dict) -> int:
+    valores = espacio.get("epocas")
+    if isinstance(valores, list): return max(int(v) for v in valores)
+    if isinstance(valores, dict): return int(valores["max"])
+    return int(config_base.get("epocas", 100))
+
+def numero_rondas(epocas_maximas: int, epocas_minimas: int, reduccion: int, pruebas: int) -> int:
+    """ Rondas de successive halving: las que permitan el rango de épocas y el número de pruebas. """
+    por_epocas = 1 + int(math.floor(math.log(max(epocas_maximas / epocas_minimas, 1), reduccion) + 1e-9))
+    por_pruebas = 1 + int(math.floor(math.log(max(pruebas, 1), reduccion) + 1e-9))
+    return max(1, min(por_epocas, por_pruebas))
+
+class BusquedaHiperparametros:
+    """ Estado de una búsqueda en curso: pruebas (experimentos hijos), rondas y clasificación. """
+    def __init__(self, config: dict, busqueda_id: str):
+        self.config = config
+        self.busqueda_id = busqueda_id
+        self.especificacion = validar_busqueda(config.get("busqueda"))
+        # Las pruebas se puntúan con la división train/test compartida: sin validación cruzada por prueba
+        self.config_base = {k: v for k, v in config.items() if k not in ("busqueda", "nombre", "validacion", "pliegues", "ensamble_pliegues")}
+        self.pruebas = [] # {"experimento_id", "parametros", "config", "puntuacion", "ronda", "epocas_entrenadas", "estado"}
+        self.metrica = "puntuacion" # "precision" o "r2_score" en cuanto se conoce el tipo de problema
+        self.rondas = 0
+
+    def crear_prueba(self, parametros: dict) -> dict:
+        indice = len(self.pruebas) + 1
+        config_prueba = {**self.config_base, **parametros, "busqueda_id": self.busqueda_id, "nombre": f"{self.config.get('nombre', 'Busqueda')}_prueba_{indice}"}
+        prueba = {"experimento_id": str(uuid.uuid4()), "indice": indice, "parametros": parametros, "config": config_prueba,
+                  "puntuacion": None, "ronda": -1, "epocas_entrenadas": None, "estado": "en_cola"}
+        supabase.table("experimentos").insert({
+            'id': prueba["experimento_id"], 'nombre': config_prueba["nombre"], 'dataset_id': config_prueba.get('dataset_id'),
+            'configuracion': json.dumps(config_prueba), 'estado': 'en_cola', 'fecha_creacion': datetime.utcnow().isoformat(),
+            'columnas_entrada': json.dumps(config_prueba.get('columnas_entrada', [])), 'columna_objetivo': config_prueba.get('columna_objetivo'),
+            'metricas_por_epoca': json.dumps([]),
+        }).execute()
+        self.pruebas.append(prueba)
+        return prueba
+
+    def registrar(self, prueba: dict, ronda: int, resultado: dict = None, error: Exception = None):
+        prueba["ronda"] = ronda
+        if error is not None:
+            prueba.update(puntuacion=float("-inf"), estado="error")
+            _actualizar(prueba["experimento_id"], {"estado": "error", "metricas": json.dumps({"error": str(error) or type(error).__name__})})
+            return
+        prueba.update(puntuacion=resultado["puntuacion"], epocas_entrenadas=resultado.get("epocas_entrenadas"), estado=resultado.get("estado", "entrenando"))
+        if "estado" not in resultado: # Ronda intermedia: la fila guarda la puntuación parcial
+            _actualizar(prueba["experimento_id"], {"estado": "entrenando", "metricas": json.dumps({self.metrica: prueba["puntuacion"], "ronda": ronda, "epocas_entrenadas": prueba["epocas_entrenadas"]})})
+
+    def podar(self, pruebas: list, ronda: int):
+        for prueba in pruebas:
+            prueba["estado"] = "podado"
+            _actualizar(prueba["experimento_id"], {"estado": "podado", "metricas": json.dumps({self.metrica: prueba["puntuacion"], "ronda": ronda, "epocas_entrenadas": prueba["epocas_entrenadas"]})})
+
+    def clasificacion(self) -> list:
+        ordenadas = sorted(self.pruebas, key=lambda p: (p["ronda"], p["puntuacion"] if p["puntuacion"] is not None and np.isfinite(p["puntuacion"]) else float("-inf")), reverse=True)
+        return [{"posicion": i + 1, "experimento_id": p["experimento_id"], "parametros": p["parametros"], "puntuacion": p["puntuacion"] if p["puntuacion"] is not None and np.isfinite(p["puntuacion"]) else None,
+                 "ronda": p["ronda"], "epocas_entrenadas": p["epocas_entrenadas"], "estado": p["estado"]} for i, p in enumerate(ordenadas)]
+
+    def guardar_estado(self, estado: str):
+        """
+        Vuelca la clasificación en la fila de la búsqueda. Salvo al marcarla 'cancelado', la escritura no pisa
+        un 'cancelando' (las pruebas en curso lo vigilan para detenerse): en ese caso lanza EntrenamientoCancelado.
+        """
+        clasificacion = self.clasificacion()
+        mejor = next((p for p in clasificacion if p["estado"] in ("completado", "completado_sin_artefactos")), None)
+        info = {"tipo": "busqueda", "metrica": self.metrica, "estrategia": self.especificacion["estrategia"], "rondas": self.rondas,
+                "mejor_experimento_id": mejor["experimento_id"] if mejor else None, "clasificacion": clasificacion}
+        puntuaciones = [p["puntuacion"] for p in clasificacion if p["puntuacion"] is not None]
+        metricas = {"pruebas": len(self.pruebas), "podadas": sum(1 for p in self.pruebas if p["estado"] == "podado"),
+                    f"mejor_{self.metrica}": (mejor or {}).get("puntuacion") if mejor else (max(puntuaciones) if puntuaciones else None)}
+        cambios = {"estado": estado, "artefactos_info": json.dumps(info), "metricas": json.dumps(metricas)}
+        if estado == "cancelado":
+            _actualizar(self.busqueda_id, cambios)
+        elif not _actualizar(self.busqueda_id, cambios, salvo_estado="cancelando"):
+            raise EntrenamientoCancelado()
+
+def _comprobar_cancelacion(busqueda_id: str):
+    if _leer_experimento(busqueda_id)["estado"] == "cancelando": raise EntrenamientoCancelado()
+
+def ejecutar_busqueda(config: dict, busqueda_id: str) -> str:
+    """
+    Se ejecuta en un proceso del pool de entrenamientos. Prepara los datos una vez, los vuelca a disco y
+    reparte las pruebas en un pool propio de `concurrencia` procesos. Successive halving: todas las pruebas
+    empiezan con pocas épocas, pasa a la siguiente ronda el mejor 1/reduccion con reduccion veces más épocas, y
+    la última ronda entrena y guarda los experimentos completos. Un Random Forest no depende de las épocas:
+    se puntúa una vez y conserva su puntuación en las rondas siguientes.
+    """
+    busqueda = BusquedaHiperparametros(config, busqueda_id)
+    especificacion = busqueda.especificacion
+    ruta_datos = os.path.join(Config.DATASET_CACHE_DIR, "busquedas", f"{busqueda_id}.joblib")
+    try:
+        # Pudo cancelarse mientras esperaba en la cola: el paso a 'entrenando' no pisa un 'cancelando'
+        if not _actualizar(busqueda_id, {"estado": "entrenando"}, salvo_estado="cancelando"): raise EntrenamientoCancelado()
+        datos = preparar_datos_entrenamiento(busqueda.config_base)
+        busqueda.metrica = "precision" if datos["es_clasificacion"] else "r2_score"
+        os.makedirs(os.path.dirname(ruta_datos), exist_ok=True)
+        joblib.dump(datos, ruta_datos)
+        del datos
+
+        rondas = busqueda.rondas = numero_rondas(_epocas_maximas(busqueda.config_base, especificacion["espacio"]), especificacion["epocas_minimas"], especificacion["reduccion"], especificacion["pruebas"])
+        concurrencia = especificacion["concurrencia"]
+        hilos = max(1, (os.cpu_count() or 1) // concurrencia)
+        generador = GeneradorPruebas(especificacion)
+        print(f"-> Búsqueda {busqueda_id}: {especificacion['pruebas']} pruebas ({especificacion['estrategia']}), {rondas} rondas, {concurrencia} procesos")
+
+        def config_ronda(prueba: dict, ronda: int) -> dict:
+            epocas = int(prueba["config"].get("epocas", 100))
+            config_prueba = {**prueba["config"], "epocas": presupuesto_ronda(epocas, ronda, rondas, especificacion["reduccion"])}
+            if config_prueba.get("tipo_modelo") != "red_neuronal": config_prueba["n_jobs"] = hilos
+            return config_prueba
+
+        with ProcessPoolExecutor(max_workers=concurrencia, mp_context=multiprocessing.get_context("spawn")) as pool:
+            # Ronda 0: se proponen pruebas a medida que se libera un proceso (la bayesiana aprende de las ya puntuadas)
+            pendientes = {}
+            while len(busqueda.pruebas) < especificacion["pruebas"] or pendientes:
+                _comprobar_cancelacion(busqueda_id) # No se crean pruebas nuevas tras cancelar
+                while len(pendientes) < concurrencia and len(busqueda.pruebas) < especificacion["pruebas"]:
+                    prueba = busqueda.crear_prueba(generador.proponer())
+                    final = rondas == 1
+                    pendientes[pool.submit(_ejecutar_prueba, ruta_datos, config_ronda(prueba, 0), busqueda_id, prueba["experimento_id"], final, hilos)] = prueba
+                terminados, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+                for futuro in terminados:
+                    prueba = pendientes.pop(futuro)
+                    _registrar_futuro(busqueda, prueba, futuro, 0)
+                    generador.observar(prueba["parametros"], prueba["puntuacion"])
+                busqueda.guardar_estado("entrenando")
+
+            # Rondas siguientes: sobrevive el mejor 1/reduccion
+            vivas = [p for p in busqueda.pruebas if p["estado"] != "error"]
+            for ronda in range(1, rondas):
+                _comprobar_cancelacion(busqueda_id)
+                vivas.sort(key=lambda p: p["puntuacion"], reverse=True)
+                conservar = max(1, math.ceil(len(vivas) / especificacion["reduccion"]))
+                busqueda.podar(vivas[conservar:], ronda - 1)
+                vivas = vivas[:conservar]
+                final = ronda == rondas - 1
+                futuros = {}
+                for prueba in vivas:
+                    if not final and prueba["config"].get("tipo_modelo") != "red_neuronal":
+                        prueba["ronda"] = ronda # Sin épocas que aumentar: conserva su puntuación
+                        continue
+                    futuros[pool.submit(_ejecutar_prueba, ruta_datos, config_ronda(prueba, ronda), busqueda_id, prueba["experimento_id"], final, hilos)] = prueba
+                for futuro in futuros:
+                    _registrar_futuro(busqueda, futuros[futuro], futuro, ronda)
+                vivas = [p for p in vivas if p["estado"] != "error"]
+                busqueda.guardar_estado("entrenando")
+
+        busqueda.guardar_estado("completado")
+        print(f"🎉 Búsqueda {busqueda_id} completada.")
+        return "completado"
+
+    except EntrenamientoCancelado:
+        print(f"⚠️ Búsqueda {busqueda_id} cancelada.")
+        for prueba in busqueda.pruebas:
+            if prueba["estado"] in ("en_cola", "entrenando"):
+                prueba["estado"] = "cancelado"; _actualizar(prueba["experimento_id"], {"estado": "cancelado"})
+        busqueda.guardar_estado("cancelado")
+        return "cancelado"
+    except Exception as e:
+        print(f"🔥 Error en la búsqueda {busqueda_id}: {e}")
+        _actualizar(busqueda_id, {"estado": "error", "metricas": json.dumps({"error": str(e)})})
+        raise
+    finally:
+        if os.path.exists(ruta_datos): os.remove(ruta_datos)
+
+def _registrar_futuro(busqueda: BusquedaHiperparametros, prueba: dict, futuro, ronda: int):
+    """ Guarda el resultado de una prueba; si se canceló la búsqueda, propaga la cancelación. """
+    try:
+        busqueda.registrar(prueba, ronda, resultado=futuro.result())
+    except EntrenamientoCancelado:
+        raise
+    except Exception as e:
+        print(f"⚠️ La prueba {prueba['indice']} de la búsqueda {busqueda.busqueda_id} falló: {e}")
+        busqueda.registrar(prueba, ronda, error=e)
+
+# =============================================================================
+# 4️⃣ API de Búsquedas (encolar, estado)
+# =============================================================================
+def encolar_busqueda(config: dict) -> dict:
+    """ Valida la configuración base y la búsqueda, crea el experimento padre en 'en_cola' y la encola. """
+    especificacion = validar_busqueda(config.get("busqueda"))
+    tipos_modelo = especificacion["espacio"].get("tipo_modelo") or [config.get("tipo_modelo")]
+    validar_configuracion({**config, "tipo_modelo": tipos_modelo[0]})
+
+    busqueda_id = str(uuid.uuid4())
+    config = {**config, "nombre": config.get("nombre") or f"Busqueda_{datetime.now().strftime('%Y%m%d_%H%M%S')}"}
+    supabase.table("experimentos").insert({
+        'id': busqueda_id,
+        'nombre': config["nombre"],
+        'dataset_id': config.get('dataset_id'),
+        'configuracion': json.dumps(config),
+        'estado': 'en_cola',
+        'fecha_creacion': datetime.utcnow().isoformat(),
+        'columnas_entrada': json.dumps(config.get('columnas_entrada', [])),
+        'columna_objetivo': config.get('columna_objetivo'),
+        'metricas_por_epoca': json.dumps([]),
+    }).execute()
+    enviar_a_cola(busqueda_id, ejecutar_busqueda, config, busqueda_id)
+    return {"id": busqueda_id, "estado": "en_cola"}
+
+def estado_busqueda(busqueda_id: str) -> dict:
+    """ Estado de la búsqueda y clasificación de sus pruebas (mejor primero). """
+    datos = _leer_experimento(busqueda_id, "id, nombre, estado, configuracion, artefactos_info, metricas")
+    configuracion = json.loads(datos.get("configuracion") or "{}")
+    if "busqueda" not in configuracion: raise LookupError(f"El experimento '{busqueda_id}' no es una búsqueda de hiperparámetros.")
+    info = json.loads(datos.get("artefactos_info") or "{}")
+    return {"id": busqueda_id, "nombre": datos.get("nombre"), "estado": datos["estado"], "busqueda": configuracion["busqueda"],
+            "metrica": info.get("metrica"), "rondas": info.get("rondas"), "mejor_experimento_id": info.get("mejor_experimento_id"),
+            "metricas": json.loads(datos.get("metricas") or "null"), "clasificacion": info.get("clasificacion", [])}
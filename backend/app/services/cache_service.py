@@ -0,0 +1,309 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from app.config import Config
+
+# Extensión de los archivos de la caché (Arrow IPC / Feather v2)
+EXTENSION_CACHE = ".arrow"
+
+def escribir_ipc_mapeable(df: pd.DataFrame, ruta: str):
+    """
+    Escribe el DataFrame como Arrow IPC pensado para memory-map: sin compresión, en un solo
+    record batch y con los NaN de las columnas float como valores (no como nulos), de modo que
+    al leerlo las columnas numéricas se puedan envolver en pandas sin copiar ni rellenar.
+    """
+    df = df.reset_index(drop=True)
+    tabla = pa.Table.from_pandas(df, preserve_index=False)
+    for i, columna in enumerate(df.columns):
+        if pd.api.types.is_float_dtype(df[columna]) and isinstance(df[columna].dtype, np.dtype):
+            tabla = tabla.set_column(i, tabla.field(i), pa.array(df[columna].to_numpy(), from_pandas=False))
+    tabla = tabla.combine_chunks()
+    with pa.OSFile(ruta, "wb") as destino:
+        with pa.ipc.new_file(destino, tabla.schema) as escritor:
+            escritor.write_table(tabla, max_chunksize=max(tabla.num_rows, 1))
+
+# =============================================================================
+# 1️⃣ Caché LRU en disco para DataFrames de datasets
+# =============================================================================
+class DatasetCache:
+    """
+    Caché en disco, acotada por tamaño y con política LRU, que guarda los datasets
+    ya parseados en formato Arrow IPC. Cada entrada se identifica por el ID del
+    dataset y su versión (ETag del Storage o hash del contenido), de modo que una
+    nueva versión del archivo nunca devuelve datos viejos.
+
+    El directorio se comparte entre los workers de gunicorn: el orden LRU se
+    guarda en la fecha de modificación de cada archivo, así cualquier proceso
+    puede evictar de forma consistente.
+
+    Los archivos se leen con memory-map y sin copia: las columnas numéricas de los
+    DataFrames devueltos apuntan a las páginas del archivo (solo lectura), que el
+    sistema operativo comparte entre todos los workers. Así un dataset caliente
+    ocupa RAM una sola vez, no una vez por worker.
+    """
+    def __init__(self, directorio: str, max_bytes: int):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._contadores = {"hits": 0, "misses": 0, "evicciones": 0, "escrituras": 0, "invalidaciones": 0}
+        self._tablas_mapeadas = {} # ruta -> pa.Table respaldada por el memory-map (por proceso)
+        os.makedirs(self.directorio, exist_ok=True)
+
+    # --- Utilidades internas ---
+    @staticmethod
+    def _prefijo(dataset_id: str) -> str:
+        # Evita que un ID con caracteres raros escape del directorio de la caché
+        return re.sub(r"[^A-Za-z0-9_-]", "_", str(dataset_id))
+
+    def _ruta(self, dataset_id: str, version: str) -> str:
+        version_hash = hashlib.sha1(str(version).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.directorio, f"{self._prefijo(dataset_id)}__{version_hash}{EXTENSION_CACHE}")
+
+    def _ruta_validadores(self, dataset_id: str) -> str:
+        return os.path.join(self.directorio, f"{self._prefijo(dataset_id)}.meta.json")
+
+    def _contar(self, contador: str, cantidad: int = 1):
+        with self._lock:
+            self._contadores[contador] += cantidad
+
+    def _entradas(self) -> list:
+        """ Lista (ruta, tamaño, mtime) de todas las entradas presentes en disco. """
+        entradas = []
+        try:
+            nombres = os.listdir(self.directorio)
+        except FileNotFoundError:
+            return entradas
+        for nombre in nombres:
+            if not nombre.endswith(EXTENSION_CACHE): continue
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                st = os.stat(ruta)
+            except FileNotFoundError:
+                continue # Otro worker la eliminó mientras listábamos
+            entradas.append((ruta, st.st_size, st.st_mtime))
+        return entradas
+
+    def _evictar(self):
+        """ Elimina las entradas menos usadas hasta quedar por debajo de max_bytes. """
+        self._soltar_mapeos()
+        entradas = self._entradas()
+        total = sum(tamano for _, tamano, _ in entradas)
+        if total <= self.max_bytes: return
+        for ruta, tamano, _ in sorted(entradas, key=lambda e: e[2]):
+            if total <= self.max_bytes: break
+            try:
+                os.remove(ruta)
+                total -= tamano
+                self._contar("evicciones")
+                print(f"🧹 Caché: evictada {os.path.basename(ruta)} ({tamano / 1e6:.1f} MB)")
+            except FileNotFoundError:
+                pass
+
+    def _tabla_mapeada(self, ruta: str) -> pa.Table:
+        """ Devuelve la tabla mapeada de `ruta`, abriendo el memory-map solo la primera vez en este proceso. """
+        with self._lock:
+            tabla = self._tablas_mapeadas.get(ruta)
+        if tabla is not None and os.path.exists(ruta): return tabla
+        # Un archivo de una versión nunca cambia (escritura atómica), así que el mapeo se puede reutilizar
+        tabla = pa.ipc.open_file(pa.memory_map(ruta, "r")).read_all()
+        with self._lock:
+            self._tablas_mapeadas[ruta] = tabla
+        return tabla
+
+    def _soltar_mapeos(self):
+        """ Suelta los mapeos de archivos que ya no existen (evictados o invalidados por cualquier worker). """
+        with self._lock:
+            for ruta in [r for r in self._tablas_mapeadas if not os.path.exists(r)]:
+                del self._tablas_mapeadas[ruta]
+
+    def _leer(self, ruta: str, columnas: list = None) -> pd.DataFrame:
+        tabla = self._tabla_mapeada(ruta)
+        if columnas is not None:
+            tabla = tabla.select([c for c in columnas if c in tabla.schema.names])
+        # split_blocks evita consolidar columnas en un bloque nuevo: las numéricas quedan sin copiar
+        return tabla.to_pandas(split_blocks=True)
+
+    # --- API pública ---
+    def obtener(self, dataset_id: str, version: str, columnas: list = None):
+        """
+        Devuelve el DataFrame cacheado para (dataset_id, version) o None si no existe.
+        Si se indican `columnas`, solo se leen esas columnas del archivo (las que no existan se ignoran).
+        Las columnas numéricas son vistas de solo lectura sobre el archivo mapeado: para modificarlas
+        hay que reasignarlas (df[c] = ...) o trabajar sobre una copia.
+        """
+        ruta = self._ruta(dataset_id, version)
+        try:
+            df = self._leer(ruta, columnas)
+        except (FileNotFoundError, OSError, pa.ArrowInvalid):
+            self._contar("misses")
+            return None
+        try:
+            os.utime(ruta, None) # Marcar como usada recientemente (LRU)
+        except FileNotFoundError:
+            pass
+        self._contar("hits")
+        return df
+
+    def mapear(self, dataset_id: str, version: str, columnas: list = None):
+        """ Como obtener() pero sin tocar contadores ni el orden LRU (para quien acaba de guardar la entrada). """
+        try:
+            return self._leer(self._ruta(dataset_id, version), columnas)
+        except (FileNotFoundError, OSError, pa.ArrowInvalid):
+            return None
+
+    def tabla(self, dataset_id: str, version: str):
+        """
+        Devuelve la pa.Table mapeada de (dataset_id, version), o None si no está en la caché.
+        Permite leer un tramo de filas (tabla.slice) sin convertir el resto del dataset.
+        """
+        ruta = self._ruta(dataset_id, version)
+        try:
+            tabla = self._tabla_mapeada(ruta)
+            os.utime(ruta, None) # Marcar como usada recientemente (LRU)
+        except (FileNotFoundError, OSError, pa.ArrowInvalid):
+            self._contar("misses")
+            return None
+        self._contar("hits")
+        return tabla
+
+    def existe(self, dataset_id: str, version: str) -> bool:
+        """ Indica si (dataset_id, version) está en disco, sin tocar contadores ni el orden LRU. """
+        return os.path.exists(self._ruta(dataset_id, version))
+
+    def validadores(self, dataset_id: str):
+        """ Validadores HTTP (url, version, etag, last_modified...) de la última versión guardada, o None. """
+        try:
+            with open(self._ruta_validadores(dataset_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def ruta_vigente(self, dataset_id: str, version: str):
+        """ Devuelve la ruta del archivo Arrow IPC de (dataset_id, version) si está en la caché, o None. """
+        ruta = self._ruta(dataset_id, version)
+        try:
+            os.utime(ruta, None) # Marcar como usada recientemente (LRU)
+        except FileNotFoundError:
+            self._contar("misses")
+            return None
+        self._contar("hits")
+        return ruta
+
+    def guardar(self, dataset_id: str, version: str, df: pd.DataFrame, validadores: dict = None):
+        """
+        Guarda el DataFrame parseado. Con `validadores` (ETag/Last-Modified del Storage) la próxima
+        carga puede revalidar con un GET condicional. Los fallos se registran pero no interrumpen la carga.
+        """
+        ruta = self._ruta(dataset_id, version)
+        ruta_tmp = f"{ruta}.{os.getpid()}.tmp"
+        try:
+            # Escritura atómica: otros workers nunca ven un archivo a medio escribir
+            escribir_ipc_mapeable(df, ruta_tmp)
+            os.replace(ruta_tmp, ruta)
+            self._contar("escrituras")
+            if validadores is not None:
+                ruta_meta = self._ruta_validadores(dataset_id)
+                with open(f"{ruta_meta}.{os.getpid()}.tmp", "w") as f:
+                    json.dump({**validadores, "version": version}, f)
+                os.replace(f"{ruta_meta}.{os.getpid()}.tmp", ruta_meta)
+        except Exception as e:
+            print(f"⚠️ Caché: no se pudo guardar el dataset {dataset_id}: {e}")
+            if os.path.exists(ruta_tmp): os.remove(ruta_tmp)
+            return
+        self._evictar()
+
+    def invalidar(self, dataset_id: str):
+        """ Elimina todas las versiones cacheadas de un dataset. """
+        prefijo = f"{self._prefijo(dataset_id)}__"
+        try:
+            os.remove(self._ruta_validadores(dataset_id))
+        except FileNotFoundError:
+            pass
+        for ruta, _, _ in self._entradas():
+            if os.path.basename(ruta).startswith(prefijo):
+                try:
+                    os.remove(ruta)
+                    self._contar("invalidaciones")
+                except FileNotFoundError:
+                    pass
+        self._soltar_mapeos()
+
+    def estadisticas(self) -> dict:
+        """ Contadores del proceso actual y ocupación actual del directorio compartido. """
+        self._soltar_mapeos()
+        entradas = self._entradas()
+        with self._lock:
+            contadores = dict(self._contadores)
+            bytes_mapeados = sum(tabla.nbytes for tabla in self._tablas_mapeadas.values())
+            tablas_mapeadas = len(self._tablas_mapeadas)
+        consultas = contadores["hits"] + contadores["misses"]
+        return {
+            **contadores,
+            "tasa_hits": round(contadores["hits"] / consultas, 4) if consultas else 0.0,
+            "entradas": len(entradas),
+            "bytes_usados": sum(tamano for _, tamano, _ in entradas),
+            "bytes_maximos": self.max_bytes,
+            "tablas_mapeadas": tablas_mapeadas,
+            "bytes_mapeados": bytes_mapeados,
+            "pid": os.getpid()
+        }
+
+
+# Instancia compartida por todos los servicios del proceso
+dataset_cache = DatasetCache(Config.DATASET_CACHE_DIR, Config.DATASET_CACHE_MAX_MB * 1024 * 1024)
+
+
+# =============================================================================
+# 2️⃣ Caché LRU en memoria para resultados derivados
+# =============================================================================
+# Resultados caros de recalcular pero baratos de guardar (scores, modelos, muestras...).
+# Es por proceso: cada worker tiene la suya. La clave debe incluir la versión del dataset,
+# así una versión nueva nunca reutiliza resultados de la anterior.
+caches_en_memoria = {}
+
+class CacheEnMemoria:
+    """ Caché LRU en memoria, acotada por número de entradas y segura entre hilos. """
+    def __init__(self, nombre: str, max_entradas: int):
+        self.nombre = nombre
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self._contadores = {"hits": 0, "misses": 0, "evicciones": 0}
+        caches_en_memoria[nombre] = self
+
+    def obtener(self, clave):
+        """ Devuelve el valor guardado para `clave` (marcándolo como usado) o None. """
+        with self._lock:
+            if clave not in self._entradas:
+                self._contadores["misses"] += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self._contadores["hits"] += 1
+            return self._entradas[clave]
+
+    def guardar(self, clave, valor):
+        with self._lock:
+            self._entradas[clave] = valor
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+                self._contadores["evicciones"] += 1
+
+    def invalidar(self, prefijo):
+        """ Elimina las entradas cuya clave (tupla) empieza por `prefijo`, p. ej. el ID del dataset. """
+        with self._lock:
+            for clave in [c for c in self._entradas if isinstance(c, tuple) and c[:1] == (prefijo,)]:
+                del self._entradas[clave]
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            contadores = dict(self._contadores)
+            entradas = len(self._entradas)
+        consultas = contadores["hits"] + contadores["misses"]
+        return {**contadores, "tasa_hits": round(contadores["hits"] / consultas, 4) if consultas else 0.0, "entradas": entradas, "max_entradas": self.max_entradas, "pid": os.getpid()}
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+from sklearn.preprocessing import StandardScaler
+from sklearn.impute import SimpleImputer
+from app.config import Config
+from app.services.cache_service import CacheEnMemoria
+from app.services.procesos_service import mapear_en_procesos
+
+# Modelos ajustados por (dataset, versión, n_clusters, columnas): el mismo clustering no se reajusta en cada petición
+modelos_clustering = CacheEnMemoria("modelos_clustering", Config.CLUSTERING_CACHE_ENTRADAS)
+
+# =============================================================================
+# 1️⃣ Preparación y Ajuste (KMeans o MiniBatchKMeans según el tamaño)
+# =============================================================================
+def columnas_clustering(df: pd.DataFrame) -> list:
+    """ Columnas numéricas útiles para agrupar: sin IDs ni columnas constantes. """
+    numeric_cols = df.select_dtypes(include=np.number).columns.tolist()
+    cols_to_exclude = [col for col in numeric_cols if 'id' in col.lower() or df[col].nunique() < 2 or df[col].std(skipna=True) < 1e-9] # skipna=True en std
+    return [col for col in numeric_cols if col not in cols_to_exclude]
+
+def matriz_clustering(df: pd.DataFrame, columnas: list) -> tuple:
+    """ Imputa con la media y estandariza. Devuelve (X_escalada, scaler). """
+    # CORRECCIÓN: Imputar ANTES de escalar
+    imputer = SimpleImputer(strategy='mean'); X_imputed = imputer.fit_transform(df[columnas])
+    scaler = StandardScaler(); X_scaled = scaler.fit_transform(pd.DataFrame(X_imputed, columns=columnas))
+    return X_scaled, scaler
+
+def crear_kmeans(n_clusters: int, filas: int):
+    """
+    KMeans completo (n_init=10) hasta Config.CLUSTERING_UMBRAL_FILAS filas. Por encima, MiniBatchKMeans:
+    inicializa con k-means++ sobre una muestra y ajusta con lotes de Config.CLUSTERING_LOTE filas,
+    así el coste por iteración no depende del tamaño del dataset.
+    """
+    if filas > Config.CLUSTERING_UMBRAL_FILAS:
+        return MiniBatchKMeans(n_clusters=n_clusters, random_state=42, n_init=3, batch_size=Config.CLUSTERING_LOTE,
+                               init_size=min(filas, max(3 * Config.CLUSTERING_LOTE, 3 * n_clusters)))
+    return KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+
+def obtener_modelo_clustering(df: pd.DataFrame, columnas: list, n_clusters: int, clave: tuple = None) -> dict:
+    """
+    Ajusta (o recupera de la caché si se pasa `clave`) el modelo sobre `columnas`.
+    Devuelve {"modelo", "scaler", "etiquetas", "metodo"}; n_clusters se reduce si hay menos filas.
+    """
+    if clave is not None:
+        guardado = modelos_clustering.obtener(clave)
+        if guardado is not None: return guardado
+
+    X_scaled, scaler = matriz_clustering(df, columnas)
+    actual_n_clusters = min(n_clusters, len(X_scaled))
+    if actual_n_clusters < 2: raise ValueError("No hay suficientes muestras.")
+    if actual_n_clusters != n_clusters: print(f"⚠️ n_clusters reducido a {actual_n_clusters}")
+    modelo = crear_kmeans(actual_n_clusters, len(X_scaled))
+    etiquetas = modelo.fit_predict(X_scaled)
+    resultado = {"modelo": modelo, "scaler": scaler, "etiquetas": etiquetas, "metodo": type(modelo).__name__}
+    if clave is not None: modelos_clustering.guardar(clave, resultado)
+    return resultado
+
+# =============================================================================
+# 2️⃣ Barrido de k en Paralelo (codo + silueta)
+# =============================================================================
+def _evaluar_k(ruta_matriz: str, k: int, muestra_silueta: int) -> dict:
+    """ Se ejecuta en un proceso del pool: la matriz se abre con memory-map (no viaja por el pipe). """
+    X = np.load(ruta_matriz, mmap_mode='r')
+    modelo = crear_kmeans(k, len(X))
+    etiquetas = modelo.fit_predict(X)
+    silueta = None
+    if len(np.unique(etiquetas)) > 1:
+        silueta = float(silhouette_score(X, etiquetas, sample_size=min(muestra_silueta, len(X)), random_state=42))
+    return {"k": k, "inercia": round(float(modelo.inertia_), 4), "silueta": round(silueta, 4) if silueta is not None else None}
+
+def barrido_k(X_scaled: np.ndarray, k_min: int, k_max: int, muestra_silueta: int = None) -> list:
+    """ Ajusta un modelo por cada k en [k_min, k_max] repartidos en el pool de procesos. """
+    muestra_silueta = muestra_silueta or Config.CLUSTERING_MUESTRA_SILUETA
+    fd, ruta = tempfile.mkstemp(prefix="clustering_", suffix=".npy")
+    try:
+        with os.fdopen(fd, "wb") as archivo:
+            np.save(archivo, np.ascontiguousarray(X_scaled, dtype=np.float64))
+        return mapear_en_procesos(_evaluar_k, [(ruta, k, muestra_silueta) for k in range(k_min, k_max + 1)])
+    finally:
+        os.remove(ruta)
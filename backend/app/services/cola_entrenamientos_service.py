@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import uuid
+import threading
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from app.config import Config
+from app.services.supabase_service import supabase
+from app.services.entrenamiento_service import iniciar_nuevo_entrenamiento, EntrenamientoCancelado
+
+# =============================================================================
+# 1️⃣ Cola de Entrenamientos (pool de procesos acotado)
+# =============================================================================
+# POST /api/entrenamientos solo crea la fila del experimento ('en_cola') y encola el trabajo; el
+# entrenamiento corre en un pool propio de Config.ENTRENAMIENTO_PROCESOS procesos por worker (separado del
+# pool de análisis para que un entrenamiento largo no bloquee los barridos). El estado vive en la fila del
+# experimento, así cualquier worker de gunicorn puede informar del progreso o pedir la cancelación.
+# Estados: en_cola -> entrenando -> completado | completado_sin_artefactos | error | cancelado
+# ('cancelando' mientras el proceso que lo entrena no ha visto la petición).
+
+ESTADOS_ACTIVOS = ("en_cola", "entrenando", "cancelando")
+TIPOS_MODELO = ("red_neuronal", "regresion")
+VALIDACIONES = ("holdout", "kfold")
+
+_pool = None
+_lock = threading.Lock()
+_trabajos = {} # experimento_id -> Future de este worker
+
+def _pool_entrenamientos() -> ProcessPoolExecutor:
+    global _pool
+    with _lock:
+        if _pool is None or getattr(_pool, "_broken", False):
+            _pool = ProcessPoolExecutor(max_workers=max(1, Config.ENTRENAMIENTO_PROCESOS), mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def _actualizar(experimento_id: str, cambios: dict, salvo_estado: str = None, solo_estados: tuple = None) -> list:
+    """
+    Devuelve las filas actualizadas. Con `salvo_estado` no se toca la fila si está en ese estado; con
+    `solo_estados`, solo si está en uno de ellos (la condición se evalúa en la misma sentencia que escribe).
+    """
+    consulta = supabase.table("experimentos").update(cambios).eq("id", experimento_id)
+    if salvo_estado: consulta = consulta.neq("estado", salvo_estado)
+    if solo_estados: consulta = consulta.in_("estado", list(solo_estados))
+    return consulta.execute().data
+
+def _leer_experimento(experimento_id: str, columnas: str = "id, estado") -> dict:
+    res = supabase.table("experimentos").select(columnas).eq("id", experimento_id).single().execute()
+    if not res.data: raise LookupError(f"Experimento con ID '{experimento_id}' no encontrado.")
+    return res.data
+
+# =============================================================================
+# 2️⃣ Ejecución en el Proceso Hijo (progreso y cancelación)
+# =============================================================================
+class ReportadorProgreso:
+    """
+    Callback `progreso` de iniciar_nuevo_entrenamiento: acumula las épocas y, como mucho cada
+    Config.ENTRENAMIENTO_INTERVALO_PROGRESO segundos, las vuelca en metricas_por_epoca y comprueba
+    si se pidió cancelar (lanza EntrenamientoCancelado). Solo la primera escritura pasa la fila a
+    'entrenando' (y nunca sobre un 'cancelando'); las siguientes no tocan el estado.
+    """
+    def __init__(self, experimento_id: str, guardar_epocas: bool = True):
+        self.experimento_id = experimento_id
+        self.guardar_epocas = guardar_epocas # False: solo vigila la cancelación (p. ej. las pruebas de una búsqueda)
+        self.epocas = []
+        self._ultimo = None
+        self._iniciado = False
+
+    def __call__(self, metricas_epoca: dict = None, forzar: bool = False):
+        if metricas_epoca: self.epocas.append(metricas_epoca)
+        ahora = time.monotonic()
+        if not forzar and self._ultimo is not None and ahora - self._ultimo < Config.ENTRENAMIENTO_INTERVALO_PROGRESO: return
+        self._ultimo = ahora
+        if _leer_experimento(self.experimento_id)["estado"] == "cancelando": raise EntrenamientoCancelado()
+        if not self.guardar_epocas: return
+        if self._iniciado:
+            _actualizar(self.experimento_id, {"metricas_por_epoca": json.dumps(self.epocas)})
+            return
+        # Condicional: una cancelación pedida entre la lectura y esta escritura no se pierde
+        if not _actualizar(self.experimento_id, {"estado": "entrenando", "metricas_por_epoca": json.dumps(self.epocas)}, salvo_estado="cancelando"):
+            raise EntrenamientoCancelado()
+        self._iniciado = True
+
+def ejecutar_entrenamiento(config: dict, experimento_id: str) -> str:
+    """ Se ejecuta en un proceso del pool. Devuelve el estado final del experimento. """
+    reportador = ReportadorProgreso(experimento_id)
+    try:
+        reportador(forzar=True) # 'en_cola' -> 'entrenando' (o cancelado si se pidió mientras esperaba)
+        return iniciar_nuevo_entrenamiento(config, experimento_id=experimento_id, progreso=reportador).get("estado", "completado")
+    except EntrenamientoCancelado:
+        print(f"⚠️ Entrenamiento {experimento_id} cancelado tras {len(reportador.epocas)} épocas.")
+        _actualizar(experimento_id, {"estado": "cancelado", "metricas_por_epoca": json.dumps(reportador.epocas)})
+        return "cancelado"
+
+def _al_terminar(experimento_id: str, futuro):
+    """ Si el proceso hijo murió (p. ej. sin memoria) la fila quedaría 'entrenando' para siempre: se marca como error. """
+    _trabajos.pop(experimento_id, None)
+    if futuro.cancelled(): return
+    error = futuro.exception()
+    if error is None: return
+    print(f"🚨 El proceso del entrenamiento {experimento_id} falló: {error}")
+    try:
+        if _leer_experimento(experimento_id)["estado"] in ESTADOS_ACTIVOS:
+            _actualizar(experimento_id, {"estado": "error", "metricas": json.dumps({"error": str(error) or type(error).__name__})})
+    except Exception as e:
+        print(f"⚠️ No se pudo marcar el experimento {experimento_id} como fallido: {e}")
+
+# =============================================================================
+# 3️⃣ API de la Cola (encolar, estado, cancelar, profundidad)
+# =============================================================================
+def validar_configuracion(config: dict):
+    """ Comprobaciones previas a encolar (lanza ValueError para que la ruta responda 400). """
+    if config.get('columna_objetivo') in config.get('columnas_entrada', []):
+        raise ValueError("La columna objetivo no puede estar incluida en las columnas de entrada.")
+    if not config.get('dataset_id') or not config.get('columna_objetivo') or not config.get('columnas_entrada'):
+        raise ValueError("Se requieren 'dataset_id', 'columna_objetivo' y 'columnas_entrada'.")
+    if config.get('tipo_modelo') not in TIPOS_MODELO:
+        raise ValueError(f"Tipo de modelo '{config.get('tipo_modelo')}' no reconocido. Opciones: {list(TIPOS_MODELO)}")
+    if (config.get('validacion') or 'holdout') not in VALIDACIONES:
+        raise ValueError(f"Validación '{config.get('validacion')}' no reconocida. Opciones: {list(VALIDACIONES)}")
+    if config.get('validacion') == 'kfold':
+        try: pliegues = int(config.get('pliegues') or Config.VALIDACION_PLIEGUES)
+        except (TypeError, ValueError): raise ValueError("'pliegues' debe ser un número entero.")
+        if not 2 <= pliegues <= Config.VALIDACION_MAX_PLIEGUES:
+            raise ValueError(f"'pliegues' debe estar entre 2 y {Config.VALIDACION_MAX_PLIEGUES}.")
+    if config.get('fraccion_parada') is not None:
+        try: fraccion = float(config['fraccion_parada'])
+        except (TypeError, ValueError): raise ValueError("'fraccion_parada' debe ser un número.")
+        if not 0 < fraccion < 1: raise ValueError("'fraccion_parada' debe estar entre 0 y 1.")
+
+def enviar_a_cola(experimento_id: str, funcion, *args):
+    """ Ejecuta funcion(*args) en el pool de entrenamientos; si el proceso muere, el experimento queda en 'error'. """
+    futuro = _pool_entrenamientos().submit(funcion, *args)
+    _trabajos[experimento_id] = futuro
+    futuro.add_done_callback(lambda f: _al_terminar(experimento_id, f))
+    print(f"-> Trabajo {experimento_id} encolado ({profundidad_cola()['en_cola']} en cola en el worker {os.getpid()})")
+
+def encolar_entrenamiento(config: dict) -> dict:
+    """ Valida la configuración, crea la fila del experimento en 'en_cola' y devuelve su ID sin esperar al entrenamiento. """
+    validar_configuracion(config)
+
+    experimento_id = str(uuid.uuid4())
+    supabase.table("experimentos").insert({
+        'id': experimento_id,
+        'nombre': f"Experimento_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+        'dataset_id': config.get('dataset_id'),
+        'configuracion': json.dumps(config),
+        'estado': 'en_cola',
+        'fecha_creacion': datetime.utcnow().isoformat(),
+        'columnas_entrada': json.dumps(config.get('columnas_entrada', [])),
+        'columna_objetivo': config.get('columna_objetivo'),
+        'metricas_por_epoca': json.dumps([]),
+    }).execute()
+
+    enviar_a_cola(experimento_id, ejecutar_entrenamiento, config, experimento_id)
+    return {"id": experimento_id, "estado": "en_cola"}
+
+def estado_entrenamiento(experimento_id: str) -> dict:
+    """ Estado y épocas completadas hasta ahora (para sondeo). """
+    datos = _leer_experimento(experimento_id, "id, estado, metricas_por_epoca, metricas")
+    epocas = json.loads(datos.get("metricas_por_epoca") or "[]")
+    metricas = json.loads(datos.get("metricas") or "null") if datos["estado"] not in ESTADOS_ACTIVOS else None
+    return {"id": experimento_id, "estado": datos["estado"], "epocas_completadas": len(epocas), "metricas_por_epoca": epocas, "metricas": metricas}
+
+def eventos_entrenamiento(experimento_id: str, desde: int = 0):
+    """
+    Generador de Server-Sent Events: un evento 'progreso' por época nueva (id = número de época, así el
+    navegador reanuda con Last-Event-ID) y un evento 'fin' con el estado final. Se cierra tras
+    Config.ENTRENAMIENTO_SSE_MAX_SEGUNDOS para no retener el worker; EventSource se reconecta solo.
+    """
+    limite = time.monotonic() + Config.ENTRENAMIENTO_SSE_MAX_SEGUNDOS
+    enviadas = desde
+    while True:
+        estado = estado_entrenamiento(experimento_id)
+        for epoca in estado["metricas_por_epoca"][enviadas:]:
+            enviadas += 1
+            yield f"id: {enviadas}\nevent: progreso\ndata: {json.dumps(epoca)}\n\n"
+        if estado["estado"] not in ESTADOS_ACTIVOS:
+            yield f"event: fin\ndata: {json.dumps({'estado': estado['estado'], 'metricas': estado['metricas']})}\n\n"
+            return
+        if time.monotonic() > limite: return
+        yield f": {estado['estado']}\n\n" # Comentario: mantiene viva la conexión a través de proxies
+        time.sleep(Config.ENTRENAMIENTO_INTERVALO_PROGRESO)
+
+def cancelar_entrenamiento(experimento_id: str) -> dict:
+    """
+    Si el trabajo aún espera en la cola de este worker se descarta; si ya corre (o está en otro worker)
+    se marca 'cancelando' y el proceso que lo entrena se detiene en su próximo volcado de progreso.
+    Las escrituras solo se aplican si el experimento sigue activo: si terminó entretanto, ValueError (409).
+    """
+    estado = _leer_experimento(experimento_id)["estado"]
+    if estado not in ESTADOS_ACTIVOS: raise ValueError(f"El experimento ya terminó (estado '{estado}').")
+    futuro = _trabajos.get(experimento_id)
+    nuevo_estado = "cancelado" if futuro is not None and futuro.cancel() else "cancelando"
+    if not _actualizar(experimento_id, {"estado": nuevo_estado}, solo_estados=ESTADOS_ACTIVOS):
+        raise ValueError(f"El experimento ya terminó (estado '{_leer_experimento(experimento_id)['estado']}').")
+    return {"id": experimento_id, "estado": nuevo_estado}
+
+def profundidad_cola() -> dict:
+    """ Trabajos de este worker esperando y en ejecución, y capacidad del pool. """
+    futuros = list(_trabajos.values())
+    procesos = max(1, Config.ENTRENAMIENTO_PROCESOS)
+    # El executor pasa a "running" un trabajo más de los que caben (el que espera en su cola interna)
+    en_ejecucion = min(sum(1 for f in futuros if f.running()), procesos)
+    return {"en_cola": len(futuros) - en_ejecucion, "en_ejecucion": en_ejecucion, "procesos": procesos, "pid": os.getpid()}
+
+def metricas_cola() -> dict:
+    """ Profundidad de la cola de este worker y experimentos activos de todos los workers (según la base de datos). """
+    global_ = {}
+    for estado in ESTADOS_ACTIVOS:
+        res = supabase.table("experimentos").select("id").eq("estado", estado).execute()
+        global_[estado] = len(res.data or [])
+    return {"worker": profundidad_cola(), "global": global_}
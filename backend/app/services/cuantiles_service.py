@@ -0,0 +1,259 @@
+import math
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from app.config import Config
+from app.services.datasets_service import EXTENSION_CUANTILES
+from app.services.lectura_service import LectorPorChunks, chunks_de, valor_nativo
+from app.services.artefactos_service import guardar_artefacto, obtener_artefacto
+
+# Pares (columna de grupo, columna de valor) que se resumen por grupo en los sketches del dataset
+# (los que usan por defecto generar_boxplot y generar_segmentacion_mercado)
+GRUPOS_CUANTILES = [('zona', 'precio')]
+
+# =============================================================================
+# 1️⃣ Sketch de Cuantiles con Error Relativo Acotado (DDSketch)
+# =============================================================================
+class SketchCuantiles:
+    """
+    Resumen de una columna numérica que permite estimar cualquier cuantil sin guardar los valores
+    (DDSketch, Masson et al. 2019). Cada valor x != 0 cae en el bucket i = ceil(log_γ |x|), con
+    γ = (1 + α) / (1 - α), y solo se guarda cuántos valores hay en cada bucket. Dos sketches con
+    el mismo α se combinan sumando los conteos, así que se pueden construir por chunks (o en
+    varios workers) y unir después; el resultado es el mismo que con un único recorrido.
+
+    Cota de error: para q en [0, 1], cuantil(q) difiere del valor exacto de pandas
+    (Series.quantile(q), interpolación lineal) en a lo sumo α·|valor exacto| cuando los valores
+    tienen un mismo signo (precios, áreas...). El mínimo y el máximo (q=0 y q=1) son exactos.
+    Con α=0.01 el error es <= 1%; el tamaño crece con log(max/min)/α, no con el número de filas
+    (unos 700 buckets para precios entre 10^3 y 10^9).
+    """
+    MINIMO_INDEXABLE = 1e-9 # |x| por debajo de esto cuenta como cero
+
+    def __init__(self, alfa: float = None):
+        self.alfa = alfa or Config.CUANTILES_ALFA
+        self._log_gamma = math.log((1 + self.alfa) / (1 - self.alfa))
+        self.n, self.ceros, self.suma = 0, 0, 0.0
+        self.minimo, self.maximo = math.inf, -math.inf
+        self.positivos, self.negativos = {}, {} # índice de bucket -> conteo
+
+    def _sumar_buckets(self, buckets: dict, magnitudes: np.ndarray):
+        if magnitudes.size == 0: return
+        indices, conteos = np.unique(np.ceil(np.log(magnitudes) / self._log_gamma).astype(np.int64), return_counts=True)
+        for indice, conteo in zip(indices.tolist(), conteos.tolist()):
+            buckets[indice] = buckets.get(indice, 0) + conteo
+
+    def agregar(self, valores):
+        """ Añade un bloque de valores (los NaN e infinitos se ignoran). """
+        valores = np.asarray(valores, dtype=np.float64)
+        valores = valores[np.isfinite(valores)]
+        if valores.size == 0: return
+        self.n += int(valores.size)
+        self.suma += float(valores.sum())
+        self.minimo, self.maximo = min(self.minimo, float(valores.min())), max(self.maximo, float(valores.max()))
+        positivos = valores[valores > self.MINIMO_INDEXABLE]
+        negativos = -valores[valores < -self.MINIMO_INDEXABLE]
+        self.ceros += int(valores.size - positivos.size - negativos.size)
+        self._sumar_buckets(self.positivos, positivos)
+        self._sumar_buckets(self.negativos, negativos)
+
+    def combinar(self, otro: "SketchCuantiles"):
+        """ Suma otro sketch (mismo α) a este. """
+        if otro.alfa != self.alfa: raise ValueError("Solo se pueden combinar sketches con el mismo α.")
+        self.n += otro.n; self.ceros += otro.ceros; self.suma += otro.suma
+        self.minimo, self.maximo = min(self.minimo, otro.minimo), max(self.maximo, otro.maximo)
+        for propios, ajenos in ((self.positivos, otro.positivos), (self.negativos, otro.negativos)):
+            for indice, conteo in ajenos.items():
+                propios[indice] = propios.get(indice, 0) + conteo
+        return self
+
+    def _valor_en_rango(self, rango: int) -> float:
+        """ Estimación del valor de rango `rango` (0 = mínimo) de los valores ordenados. """
+        if rango <= 0: return self.minimo
+        if rango >= self.n - 1: return self.maximo
+        gamma = math.exp(self._log_gamma)
+        acumulado = 0
+        # Orden ascendente: negativos de mayor a menor magnitud, ceros, positivos de menor a mayor
+        for indice in sorted(self.negativos, reverse=True):
+            acumulado += self.negativos[indice]
+            if acumulado > rango: return max(self.minimo, -2 * gamma ** indice / (gamma + 1))
+        acumulado += self.ceros
+        if acumulado > rango: return 0.0
+        for indice in sorted(self.positivos):
+            acumulado += self.positivos[indice]
+            if acumulado > rango: return min(self.maximo, 2 * gamma ** indice / (gamma + 1))
+        return self.maximo
+
+    def cuantil(self, q: float) -> float:
+        """ Cuantil q con la misma interpolación lineal que pandas (None si el sketch está vacío). """
+        if self.n == 0: return None
+        rango = q * (self.n - 1)
+        inferior, t = int(math.floor(rango)), rango - math.floor(rango)
+        valor = self._valor_en_rango(inferior)
+        return valor if t == 0 else (1 - t) * valor + t * self._valor_en_rango(inferior + 1)
+
+    def media(self) -> float:
+        return self.suma / self.n if self.n else None
+
+    def a_dict(self) -> dict:
+        return {
+            "alfa": self.alfa, "n": self.n, "ceros": self.ceros, "suma": self.suma,
+            "min": self.minimo if self.n else None, "max": self.maximo if self.n else None,
+            "positivos": [[i, c] for i, c in sorted(self.positivos.items())],
+            "negativos": [[i, c] for i, c in sorted(self.negativos.items())]
+        }
+
+    @classmethod
+    def desde_dict(cls, datos: dict) -> "SketchCuantiles":
+        sketch = cls(datos["alfa"])
+        sketch.n, sketch.ceros, sketch.suma = datos["n"], datos["ceros"], datos["suma"]
+        if sketch.n:
+            sketch.minimo, sketch.maximo = datos["min"], datos["max"]
+        sketch.positivos = {int(i): int(c) for i, c in datos["positivos"]}
+        sketch.negativos = {int(i): int(c) for i, c in datos["negativos"]}
+        return sketch
+
+# =============================================================================
+# 2️⃣ Construcción por Chunks y Persistencia junto al Dataset
+# =============================================================================
+def construir_cuantiles(chunks, grupos: list = None, alfa: float = None) -> dict:
+    """
+    Recorre los chunks una sola vez y devuelve {"alfa", "columnas": {col: sketch}, "grupos": {col_grupo: {col_valor: [[grupo, sketch], ...]}}}
+    con un sketch por columna numérica y uno por grupo para cada par de `grupos` (por defecto GRUPOS_CUANTILES).
+    """
+    alfa = alfa or Config.CUANTILES_ALFA
+    grupos = GRUPOS_CUANTILES if grupos is None else grupos
+    columnas, por_grupo = {}, {}
+    for chunk in chunks:
+        for c in chunk.columns:
+            if pd.api.types.is_numeric_dtype(chunk[c]) and not pd.api.types.is_bool_dtype(chunk[c]):
+                columnas.setdefault(c, SketchCuantiles(alfa)).agregar(chunk[c].to_numpy(dtype=np.float64, na_value=np.nan))
+        for col_grupo, col_valor in grupos:
+            if col_grupo not in chunk.columns or col_valor not in chunk.columns: continue
+            valores = pd.to_numeric(chunk[col_valor], errors='coerce')
+            sketches = por_grupo.setdefault((col_grupo, col_valor), {})
+            for grupo, serie in valores.groupby(chunk[col_grupo], observed=True, sort=False):
+                sketches.setdefault(grupo, SketchCuantiles(alfa)).agregar(serie.to_numpy(dtype=np.float64, na_value=np.nan))
+
+    grupos_dict = {}
+    for (col_grupo, col_valor), sketches in por_grupo.items():
+        grupos_dict.setdefault(col_grupo, {})[col_valor] = [[valor_nativo(g), s.a_dict()] for g, s in sketches.items() if s.n > 0]
+    return {
+        "alfa": alfa,
+        "columnas": {c: s.a_dict() for c, s in columnas.items()},
+        "grupos": grupos_dict,
+        "fecha_generacion": datetime.utcnow().isoformat()
+    }
+
+def _construir_cuantiles_por_chunks(dataset_id: str) -> dict:
+    with LectorPorChunks(dataset_id) as lector:
+        return construir_cuantiles(lector.iterar())
+
+def guardar_cuantiles(cuantiles: dict, archivo_url: str) -> bool:
+    """ Sube los sketches al Storage junto al CSV. Devuelve False si no se pudo. """
+    return guardar_artefacto(cuantiles, archivo_url, EXTENSION_CUANTILES, "sketches de cuantiles")
+
+def generar_cuantiles_dataset(df: pd.DataFrame, archivo_url: str) -> dict:
+    """ Etapa de ingesta al limpiar: construye los sketches por chunks y los guarda. No interrumpe el flujo si falla. """
+    try:
+        cuantiles = construir_cuantiles(chunks_de(df))
+        guardar_cuantiles(cuantiles, archivo_url)
+        return cuantiles
+    except Exception as e:
+        print(f"⚠️ No se pudieron generar los sketches de cuantiles de {archivo_url}: {e}")
+        return None
+
+def generar_cuantiles_por_chunks(lector: LectorPorChunks, archivo_url: str) -> dict:
+    """ Etapa de ingesta al registrar: construye los sketches con los chunks del lector y los guarda. No interrumpe el flujo si falla. """
+    try:
+        cuantiles = construir_cuantiles(lector.iterar())
+        guardar_cuantiles(cuantiles, archivo_url)
+        return cuantiles
+    except Exception as e:
+        print(f"⚠️ No se pudieron generar los sketches de cuantiles de {archivo_url}: {e}")
+        return None
+
+def obtener_cuantiles(dataset_id: str) -> dict:
+    """
+    Devuelve los sketches guardados del dataset (copia local revalidada con un GET condicional).
+    Si el dataset se registró sin ellos, los construye por chunks la primera vez que se piden.
+    """
+    return obtener_artefacto(dataset_id, EXTENSION_CUANTILES, "cuantiles", _construir_cuantiles_por_chunks, "sketches de cuantiles")
+
+def _sketches_por_grupo(dataset_id: str, col_grupo: str, col_valor: str) -> list:
+    """ [(grupo, sketch)] del par pedido: de los sketches guardados o, si no se precalculó, en un recorrido por chunks. """
+    guardados = obtener_cuantiles(dataset_id).get("grupos", {}).get(col_grupo, {}).get(col_valor)
+    if guardados is None:
+        with LectorPorChunks(dataset_id, columnas=[col_grupo, col_valor]) as lector:
+            guardados = construir_cuantiles(lector.iterar(), grupos=[(col_grupo, col_valor)])["grupos"].get(col_grupo, {}).get(col_valor, [])
+    return [(grupo, SketchCuantiles.desde_dict(datos)) for grupo, datos in guardados]
+
+# =============================================================================
+# 3️⃣ Análisis Aproximados a partir de los Sketches
+# =============================================================================
+def generar_boxplot_aproximado(dataset_id: str, col_grupo: str = 'zona', col_valor: str = 'precio') -> list:
+    """
+    Igual que generar_boxplot pero leyendo solo los sketches guardados (sin tocar las filas):
+    cada q1/mediana/q3 tiene un error relativo <= α (Config.CUANTILES_ALFA); min y max son exactos.
+    """
+    print(f"-> generando_boxplot_aproximado (grupo='{col_grupo}', valor='{col_valor}') para dataset {dataset_id}")
+    try:
+        sketches = _sketches_por_grupo(dataset_id, col_grupo, col_valor)
+        data = []
+        for grupo, sketch in sorted(sketches, key=lambda item: item[0]): # Mismo orden que groupby
+            data.append({"zona": grupo, "min": sketch.minimo, "q1": sketch.cuantil(0.25), "mediana": sketch.cuantil(0.5), "q3": sketch.cuantil(0.75), "max": sketch.maximo})
+        print(f"   -> Boxplot aproximado generado para {len(data)} zonas.")
+        return data
+    except Exception as e:
+        print(f"🚨 ERROR en generar_boxplot_aproximado: {e}")
+        return []
+
+def generar_segmentacion_mercado_aproximada(dataset_id: str, col_precio: str = 'precio', col_area: str = 'area_m2') -> dict:
+    """
+    Igual que generar_segmentacion_mercado, pero los cortes (cuantiles 0.33 y 0.66 del precio) salen del sketch
+    guardado (error relativo <= α) y los agregados de cada segmento se acumulan en un recorrido por chunks,
+    sin cargar ni ordenar la columna completa.
+    """
+    print(f"-> generando_segmentacion_mercado_aproximada para dataset {dataset_id}")
+    try:
+        datos_sketch = obtener_cuantiles(dataset_id).get("columnas", {}).get(col_precio)
+        if datos_sketch is None: raise ValueError(f"Dataset vacío o columna '{col_precio}' inválida.")
+        sketch = SketchCuantiles.desde_dict(datos_sketch)
+        if sketch.n < 3: return {"distribucion": [], "estadisticas": {}}
+        q1, q2 = sketch.cuantil(0.33), sketch.cuantil(0.66)
+
+        nombres = ['Economico', 'Medio', 'Lujo']
+        acumulados = {nombre: {"cantidad": 0, "n": 0, "suma": 0.0, "min": np.inf, "max": -np.inf, "n_area": 0, "suma_area": 0.0} for nombre in nombres}
+        total_casas = 0
+        with LectorPorChunks(dataset_id, columnas=[col_precio, col_area]) as lector:
+            for chunk in lector.iterar():
+                total_casas += len(chunk)
+                precio = pd.to_numeric(chunk[col_precio], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+                area = None
+                if col_area in chunk.columns and pd.api.types.is_numeric_dtype(chunk[col_area]):
+                    area = chunk[col_area].to_numpy(dtype=np.float64, na_value=np.nan)
+                condiciones = {'Economico': precio <= q1, 'Medio': (precio > q1) & (precio <= q2), 'Lujo': precio > q2}
+                for nombre, condicion in condiciones.items():
+                    a = acumulados[nombre]
+                    a["cantidad"] += int(condicion.sum())
+                    finitos = condicion & np.isfinite(precio)
+                    if not finitos.any(): continue
+                    a["n"] += int(finitos.sum()); a["suma"] += float(precio[finitos].sum())
+                    a["min"] = min(a["min"], float(precio[finitos].min())); a["max"] = max(a["max"], float(precio[finitos].max()))
+                    if area is not None:
+                        areas = area[finitos]; areas = areas[np.isfinite(areas)]
+                        a["n_area"] += int(areas.size); a["suma_area"] += float(areas.sum())
+
+        distribucion = []
+        for nombre in nombres:
+            a = acumulados[nombre]
+            if a["cantidad"] == 0 or a["n"] == 0: continue
+            area_prom = a["suma_area"] / a["n_area"] if a["n_area"] else 0
+            distribucion.append({"segmento": nombre, "cantidad": a["cantidad"], "precio_promedio": round(a["suma"] / a["n"], 2), "precio_min": round(a["min"], 2), "precio_max": round(a["max"], 2), "porcentaje": round((a["cantidad"] / total_casas) * 100, 1) if total_casas > 0 else 0, "area_promedio": round(area_prom, 2)})
+
+        precio_medio_total = sketch.media()
+        estadisticas_generales = {"precio_promedio_total": round(precio_medio_total, 2) if precio_medio_total is not None else 0, "total_propiedades": total_casas, "error_relativo_cuantiles": sketch.alfa}
+        return {"distribucion": distribucion, "estadisticas": estadisticas_generales}
+    except Exception as e:
+        print(f"🚨 ERROR en generar_segmentacion_mercado_aproximada: {e}")
+        return {"distribucion": [], "estadisticas": {}}
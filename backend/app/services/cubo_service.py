@@ -0,0 +1,330 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from app.services.datasets_service import EXTENSION_CUBO
+from app.services.lectura_service import LectorPorChunks, chunks_de, valor_nativo, promover_tipo
+from app.services.artefactos_service import guardar_artefacto, obtener_artefacto
+
+# Dimensiones del cubo guardado: zona × año (de la fecha) × segmento de precio
+COL_ZONA, COL_FECHA, COL_PRECIO = 'zona', 'fecha', 'precio'
+# Medidas acumuladas en cada celda (las que no existan o no sean numéricas se omiten)
+MEDIDAS_CUBO = ['precio', 'area_m2', 'habitaciones', 'banos', 'ano_construccion']
+# Mismos cortes que generar_segmentacion_mercado: cuantiles 0.33 y 0.66 del precio
+SEGMENTOS = ['Economico', 'Medio', 'Lujo']
+ESTADISTICOS = ('n', 'suma', 'suma_cuadrados', 'min', 'max')
+
+# =============================================================================
+# 1️⃣ Construcción del Cubo (por chunks, una vez por versión del dataset)
+# =============================================================================
+# Cada celda no vacía guarda sus filas y, por medida, n (valores finitos), suma, suma de cuadrados,
+# mínimo y máximo. Sumar celdas da cualquier agregado por zona, año o segmento sin volver a leer filas.
+# "precio_valido" separa las filas con precio ±inf: entran en un segmento (p > q2 o p <= q1)
+# pero la segmentación las descarta al calcular sus medias, como hace la versión sobre el DataFrame.
+
+def _lista(valores: np.ndarray) -> list:
+    """ Lista JSON-compatible (NaN -> None). """
+    return [None if v != v else v for v in np.asarray(valores, dtype=np.float64).tolist()]
+
+def _codigos(serie: pd.Series, indice: dict) -> np.ndarray:
+    """ Códigos de la dimensión (-1 = nulo) en orden de primera aparición entre chunks; `indice` acumula valor -> código. """
+    codigos, valores = pd.factorize(serie)
+    mapa = np.array([indice.setdefault(valor_nativo(v), len(indice)) for v in np.asarray(valores, dtype=object)] + [-1], dtype=np.int64)
+    return mapa[codigos] # El código -1 de factorize apunta al último (nulo)
+
+def _anos(chunk: pd.DataFrame, col_fecha: str, vacia: pd.Series) -> pd.Series:
+    if not col_fecha or col_fecha not in chunk.columns: return vacia
+    try: return pd.to_datetime(chunk[col_fecha], errors='coerce').dt.year
+    except Exception as e:
+        print(f"⚠️ No se pudo convertir '{col_fecha}' a fecha para el cubo: {e}")
+        return vacia
+
+def _valores(chunk: pd.DataFrame, columna: str) -> np.ndarray:
+    """ Valores de la medida como float64, con ±inf como NaN (ausente si el chunk no es numérico). """
+    if not pd.api.types.is_numeric_dtype(chunk[columna]): return np.full(len(chunk), np.nan)
+    valores = chunk[columna].to_numpy(dtype=np.float64, na_value=np.nan)
+    return np.where(np.isfinite(valores), valores, np.nan)
+
+def construir_cubo(df: pd.DataFrame, col_zona: str = COL_ZONA, col_fecha: str = COL_FECHA, col_precio: str = COL_PRECIO, medidas: list = None) -> dict:
+    """ Agrega `df` en el cubo zona × año × segmento de precio. Las dimensiones ausentes quedan como nulo. """
+    # Sin filas chunks_de no devuelve ningún chunk: se pasa el DataFrame vacío para conservar sus tipos
+    return construir_cubo_por_chunks(lambda: chunks_de(df) if len(df) else iter([df]), col_zona, col_fecha, col_precio, medidas)
+
+def construir_cubo_por_chunks(iterar, col_zona: str = COL_ZONA, col_fecha: str = COL_FECHA, col_precio: str = COL_PRECIO, medidas: list = None) -> dict:
+    """
+    Igual que construir_cubo pero en dos pasadas por chunks (cada llamada a iterar() empieza una, p. ej.
+    LectorPorChunks.iterar): la primera fija los tipos de las medidas y los cortes de precio (cuantiles
+    exactos de los precios finitos, lo único que se guarda de cada fila); la segunda agrupa cada chunk
+    por celda y combina los parciales (n y sumas se suman, mínimos y máximos se comparan).
+    """
+    candidatas = medidas or MEDIDAS_CUBO
+    tipos, precios, n = {}, [], 0
+    for chunk in iterar():
+        n += len(chunk)
+        for c in candidatas:
+            if c in chunk.columns: tipos[c] = promover_tipo(tipos.get(c), chunk[c].dtype)
+        if col_precio in candidatas and col_precio in chunk.columns:
+            precio = _valores(chunk, col_precio)
+            precios.append(precio[np.isfinite(precio)])
+    medidas = [c for c in candidatas if c in tipos and pd.api.types.is_numeric_dtype(tipos[c])]
+
+    cortes = None
+    if col_precio in medidas:
+        precios = np.concatenate(precios)
+        if len(precios) >= 3: cortes = pd.Series(precios).quantile([0.33, 0.66]).tolist()
+    del precios
+
+    claves = ['zona', 'ano', 'segmento', 'precio_valido']
+    indice_zonas, indice_anos, parciales = {}, {}, []
+    for chunk in iterar():
+        vacia = pd.Series(np.nan, index=chunk.index)
+        segmento, precio_valido = np.full(len(chunk), -1, dtype=np.int8), np.zeros(len(chunk), dtype=bool)
+        if col_precio in medidas:
+            precio = chunk[col_precio].to_numpy(dtype=np.float64, na_value=np.nan) if pd.api.types.is_numeric_dtype(chunk[col_precio]) else np.full(len(chunk), np.nan)
+            precio_valido = np.isfinite(precio)
+            if cortes is not None:
+                q1, q2 = cortes
+                with np.errstate(invalid='ignore'):
+                    segmento = np.select([precio <= q1, precio <= q2, precio > q2], [0, 1, 2], -1).astype(np.int8)
+        tabla = {
+            'zona': _codigos(chunk[col_zona] if col_zona in chunk.columns else vacia, indice_zonas),
+            'ano': _codigos(_anos(chunk, col_fecha, vacia), indice_anos),
+            'segmento': segmento, 'precio_valido': precio_valido
+        }
+        for m in medidas:
+            valores = _valores(chunk, m) if m in chunk.columns else np.full(len(chunk), np.nan)
+            tabla[m], tabla[f"{m}__cuadrado"] = valores, valores * valores
+        grupos = pd.DataFrame(tabla).groupby(claves, sort=False)
+        parcial = {"filas": grupos.size()}
+        if medidas:
+            conteo, suma = grupos[medidas].count(), grupos[medidas + [f"{m}__cuadrado" for m in medidas]].sum()
+            minimo, maximo = grupos[medidas].min(), grupos[medidas].max()
+            for m in medidas:
+                parcial |= {f"{m}__n": conteo[m], f"{m}__suma": suma[m], f"{m}__suma_cuadrados": suma[f"{m}__cuadrado"], f"{m}__min": minimo[m], f"{m}__max": maximo[m]}
+        parciales.append(pd.DataFrame(parcial))
+
+    combinacion = {"filas": "sum"}
+    for m in medidas:
+        combinacion |= {f"{m}__n": "sum", f"{m}__suma": "sum", f"{m}__suma_cuadrados": "sum", f"{m}__min": "min", f"{m}__max": "max"}
+    if parciales:
+        total = pd.concat(parciales).groupby(level=claves, sort=True).agg(combinacion)
+    else:
+        total = pd.DataFrame({c: pd.Series(dtype=np.float64) for c in combinacion}, index=pd.MultiIndex.from_arrays([[]] * len(claves), names=claves))
+    celdas = total.index.to_frame(index=False)
+
+    resumen_medidas = {}
+    for m in medidas:
+        resumen_medidas[m] = {
+            "n": total[f"{m}__n"].astype(np.int64).tolist(), "suma": total[f"{m}__suma"].astype(np.float64).tolist(),
+            "suma_cuadrados": total[f"{m}__suma_cuadrados"].astype(np.float64).tolist(),
+            "min": _lista(total[f"{m}__min"]), "max": _lista(total[f"{m}__max"])
+        }
+
+    return {
+        "columnas": {"zona": col_zona, "fecha": col_fecha, "precio": col_precio},
+        "dimensiones": {"zona": list(indice_zonas), "ano": [int(a) for a in indice_anos], "segmento": SEGMENTOS},
+        "cortes_precio": cortes,
+        "celdas": {c: celdas[c].astype(np.int64).tolist() if c != 'precio_valido' else celdas[c].astype(bool).tolist() for c in claves} | {"filas": total["filas"].astype(np.int64).tolist()},
+        "medidas": resumen_medidas,
+        "total_filas": n,
+        "fecha_generacion": datetime.utcnow().isoformat()
+    }
+
+# =============================================================================
+# 2️⃣ Persistencia junto al Dataset
+# =============================================================================
+def _calcular_cubo(dataset_id: str) -> dict:
+    with LectorPorChunks(dataset_id, columnas=[COL_ZONA, COL_FECHA] + MEDIDAS_CUBO) as lector:
+        return construir_cubo_por_chunks(lector.iterar)
+
+def guardar_cubo(cubo: dict, archivo_url: str) -> bool:
+    """ Sube el cubo al Storage junto al CSV. Devuelve False si no se pudo. """
+    return guardar_artefacto(cubo, archivo_url, EXTENSION_CUBO, "cubo de agregados")
+
+def generar_cubo_dataset(df: pd.DataFrame, archivo_url: str) -> dict:
+    """ Etapa de ingesta al limpiar: construye el cubo una vez por versión y lo guarda. No interrumpe el flujo si falla. """
+    try:
+        cubo = construir_cubo(df)
+        guardar_cubo(cubo, archivo_url)
+        return cubo
+    except Exception as e:
+        print(f"⚠️ No se pudo generar el cubo de agregados de {archivo_url}: {e}")
+        return None
+
+def generar_cubo_por_chunks(lector: LectorPorChunks, archivo_url: str) -> dict:
+    """ Etapa de ingesta al registrar: construye el cubo con los chunks del lector y lo guarda. No interrumpe el flujo si falla. """
+    try:
+        cubo = construir_cubo_por_chunks(lector.iterar)
+        guardar_cubo(cubo, archivo_url)
+        return cubo
+    except Exception as e:
+        print(f"⚠️ No se pudo generar el cubo de agregados de {archivo_url}: {e}")
+        return None
+
+def obtener_cubo(dataset_id: str) -> "CuboAgregado":
+    """
+    Devuelve el cubo guardado del dataset (copia local revalidada con un GET condicional).
+    Si el dataset se registró sin él, lo construye por chunks la primera vez que se pide.
+    """
+    return CuboAgregado(obtener_artefacto(dataset_id, EXTENSION_CUBO, "cubos", _calcular_cubo, "cubo de agregados"))
+
+# =============================================================================
+# 3️⃣ Consultas sobre el Cubo (marginales por dimensión)
+# =============================================================================
+class CuboAgregado:
+    """ Vista de consulta del cubo: una fila por celda, con las etiquetas de cada dimensión (None = nulo). """
+
+    def __init__(self, datos: dict):
+        self.datos = datos
+        self.medidas = list(datos["medidas"])
+        celdas = datos["celdas"]
+        tabla = {"filas": np.asarray(celdas["filas"], dtype=np.int64), "precio_valido": np.asarray(celdas["precio_valido"], dtype=bool)}
+        for dimension, valores in datos["dimensiones"].items():
+            etiquetas = np.asarray(valores + [None], dtype=object) # El código -1 apunta al último (nulo)
+            tabla[dimension] = etiquetas[np.asarray(celdas[dimension], dtype=np.int64)]
+        for m, estadisticos in datos["medidas"].items():
+            for e in ESTADISTICOS:
+                tabla[f"{m}__{e}"] = np.asarray(estadisticos[e], dtype=np.float64 if e != "n" else np.int64)
+        self.celdas = pd.DataFrame(tabla)
+
+    @property
+    def total_filas(self) -> int:
+        return self.datos["total_filas"]
+
+    def marginal(self, dimensiones: list, medida: str, solo_precio_valido: bool = False) -> pd.DataFrame:
+        """
+        Suma las celdas por `dimensiones` (sin los miembros nulos, como un groupby) y devuelve filas, n, suma,
+        suma_cuadrados, min, max, media y std (muestral) de `medida`.
+        """
+        if medida not in self.medidas: raise ValueError(f"Medida '{medida}' no disponible en el cubo.")
+        celdas = self.celdas[self.celdas["precio_valido"]] if solo_precio_valido else self.celdas
+        columnas = {f"{medida}__{e}": e for e in ESTADISTICOS}
+        agregacion = {"filas": "sum"} | {c: ("min" if e == "min" else "max" if e == "max" else "sum") for c, e in columnas.items()}
+        if dimensiones:
+            resultado = celdas.groupby(dimensiones, sort=True)[list(agregacion)].agg(agregacion).rename(columns=columnas)
+        else:
+            resultado = celdas[list(agregacion)].agg(agregacion).to_frame().T.rename(columns=columnas)
+        n = resultado["n"].astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            resultado["media"] = resultado["suma"] / n
+            varianza = (resultado["suma_cuadrados"] - n * resultado["media"] ** 2) / (n - 1)
+            resultado["std"] = np.sqrt(varianza.clip(lower=0))
+        return resultado
+
+def mapa_calor_desde_cubo(cubo: CuboAgregado, col_valor: str = COL_PRECIO) -> list:
+    """ Mismo resultado que generar_mapa_calor: media del valor por zona. """
+    mapa = cubo.marginal(["zona"], col_valor)
+    mapa = mapa[mapa["n"] > 0]
+    return [{"zona": zona, "precio_promedio": media} for zona, media in mapa["media"].round(2).items()]
+
+def serie_temporal_desde_cubo(cubo: CuboAgregado, col_valor: str = COL_PRECIO) -> list:
+    """ Mismo resultado que generar_serie_temporal: media del valor por año. """
+    serie = cubo.marginal(["ano"], col_valor)
+    serie = serie[serie["n"] > 0]
+    return [{"ano": int(ano), "precio_promedio": media} for ano, media in serie["media"].round(2).items()]
+
+def segmentacion_desde_cubo(cubo: CuboAgregado, col_precio: str = COL_PRECIO, col_area: str = 'area_m2') -> dict:
+    """ Mismo resultado que generar_segmentacion_mercado (cortes exactos calculados al construir el cubo). """
+    if col_precio not in cubo.medidas: raise ValueError(f"Dataset vacío o columna '{col_precio}' inválida.")
+    if cubo.datos["cortes_precio"] is None: return {"distribucion": [], "estadisticas": {}}
+
+    def _redondeo(valor, decimales=2):
+        return round(valor, decimales) if pd.notna(valor) and np.isfinite(valor) else 0
+
+    cantidades = cubo.celdas.groupby("segmento")["filas"].sum()
+    precios = cubo.marginal(["segmento"], col_precio, solo_precio_valido=True)
+    areas = cubo.marginal(["segmento"], col_area, solo_precio_valido=True) if col_area in cubo.medidas else None
+    distribucion, total_casas = [], cubo.total_filas
+    for nombre in SEGMENTOS:
+        cantidad = int(cantidades.get(nombre, 0))
+        if cantidad == 0 or nombre not in precios.index or precios.at[nombre, "n"] == 0: continue
+        precio = precios.loc[nombre]
+        area_prom = areas.at[nombre, "media"] if areas is not None and nombre in areas.index else 0
+        distribucion.append({"segmento": nombre, "cantidad": cantidad, "precio_promedio": _redondeo(precio["media"]), "precio_min": _redondeo(precio["min"]), "precio_max": _redondeo(precio["max"]), "porcentaje": round((cantidad / total_casas) * 100, 1) if total_casas > 0 else 0, "area_promedio": _redondeo(area_prom)})
+
+    precio_medio_total = cubo.marginal([], col_precio)["media"].iloc[0]
+    return {"distribucion": distribucion, "estadisticas": {"precio_promedio_total": _redondeo(precio_medio_total), "total_propiedades": total_casas}}
+
+def _zonas_principales(cubo: CuboAgregado, max_zonas: int) -> pd.Series:
+    """ Filas por zona (sin nulos), de mayor a menor y a lo sumo `max_zonas`. """
+    filas = cubo.celdas.groupby("zona", sort=True)["filas"].sum()
+    return filas.sort_values(ascending=False, kind="stable").head(max_zonas)
+
+def radar_desde_cubo(cubo: CuboAgregado, max_zonas: int = 4) -> list:
+    """
+    Compara las zonas con más propiedades: cada métrica (media por zona) se expresa de 0 a 100
+    respecto a la zona con el valor más alto; "valor_real" conserva la media sin escalar.
+    """
+    zonas = _zonas_principales(cubo, max_zonas).index
+    if len(zonas) == 0: return []
+    metricas = {}
+    if COL_PRECIO in cubo.medidas and 'area_m2' in cubo.medidas:
+        medias_precio, medias_area = cubo.marginal(["zona"], COL_PRECIO)["media"], cubo.marginal(["zona"], 'area_m2')["media"]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            metricas["Precio/m²"] = medias_precio / medias_area.where(medias_area > 0)
+    for nombre, medida in (("Tamaño", 'area_m2'), ("Habitaciones", 'habitaciones'), ("Baños", 'banos')):
+        if medida in cubo.medidas: metricas[nombre] = cubo.marginal(["zona"], medida)["media"]
+    if 'ano_construccion' in cubo.medidas:
+        metricas["Antigüedad"] = datetime.utcnow().year - cubo.marginal(["zona"], 'ano_construccion')["media"]
+    if not metricas: return []
+
+    escaladas = {}
+    for nombre, valores in metricas.items():
+        valores = valores.reindex(zonas)
+        maximo = valores[np.isfinite(valores)].max() if np.isfinite(valores).any() else np.nan
+        escaladas[nombre] = (valores, maximo)
+    data = []
+    for zona in zonas:
+        items = []
+        for nombre, (valores, maximo) in escaladas.items():
+            valor = valores[zona]
+            escalado = round(float(valor / maximo * 100), 1) if np.isfinite(valor) and np.isfinite(maximo) and maximo > 0 else 0
+            items.append({"metrica": nombre, "valor": escalado, "valor_real": round(float(valor), 2) if np.isfinite(valor) else None})
+        data.append({"casa": f"Zona {zona}", "metricas": items})
+    return data
+
+def sankey_desde_cubo(cubo: CuboAgregado, max_zonas: int = 6) -> dict:
+    """
+    Flujo de propiedades zona -> segmento de precio (Bajo/Medio/Alto = Economico/Medio/Lujo).
+    Las zonas fuera de las `max_zonas` más grandes se agrupan en "Otras zonas".
+    """
+    celdas = cubo.celdas[cubo.celdas["zona"].notna() & cubo.celdas["segmento"].notna()]
+    if celdas.empty: return {"nodes": [], "links": []}
+    principales = list(_zonas_principales(cubo, max_zonas).index)
+    origen = celdas["zona"].where(celdas["zona"].isin(principales), "Otras zonas")
+    flujos = celdas.groupby([origen, celdas["segmento"]], sort=False)["filas"].sum()
+
+    nombres_zona = [z for z in principales if z in set(origen)] + (["Otras zonas"] if (~celdas["zona"].isin(principales)).any() else [])
+    nodos_zona = {z: i for i, z in enumerate(nombres_zona)}
+    nombres_segmento = {"Economico": "Precio Bajo", "Medio": "Precio Medio", "Lujo": "Precio Alto"}
+    nodos_segmento = {s: len(nodos_zona) + i for i, s in enumerate(SEGMENTOS)}
+    nodes = [{"id": i, "name": z if z == "Otras zonas" else f"Zona {z}"} for z, i in nodos_zona.items()]
+    nodes += [{"id": i, "name": nombres_segmento[s]} for s, i in nodos_segmento.items()]
+    links = [{"source": nodos_zona[z], "target": nodos_segmento[s], "value": int(valor)}
+             for (z, s), valor in flujos.items() if valor > 0]
+    links.sort(key=lambda l: (l["source"], l["target"]))
+    return {"nodes": nodes, "links": links}
+
+# =============================================================================
+# 4️⃣ Endpoints Respondidos desde el Cubo Guardado
+# =============================================================================
+def generar_mapa_calor_cubo(dataset_id: str) -> list:
+    try:
+        return mapa_calor_desde_cubo(obtener_cubo(dataset_id))
+    except Exception as e:
+        print(f"Error en generar_mapa_calor_cubo: {e}")
+        return []
+
+def generar_serie_temporal_cubo(dataset_id: str) -> list:
+    try:
+        return serie_temporal_desde_cubo(obtener_cubo(dataset_id))
+    except Exception as e:
+        print(f"Error en generar_serie_temporal_cubo: {e}")
+        return []
+
+def generar_segmentacion_mercado_cubo(dataset_id: str) -> dict:
+    print(f"-> generando_segmentacion_mercado (cubo) para dataset {dataset_id}")
+    try:
+        return segmentacion_desde_cubo(obtener_cubo(dataset_id))
+    except Exception as e:
+        print(f"🚨 ERROR en generar_segmentacion_mercado_cubo: {e}")
+        return {"distribucion": [], "estadisticas": {}}
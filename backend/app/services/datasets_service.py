@@ -1,10 +1,194 @@
+import os
+import json
+import tempfile
+import numpy as np
 import pandas as pd
-import io
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from app.config import Config
 from app.services.supabase_service import supabase # Asumimos que tienes el cliente Supabase inicializado
+from app.services.cache_service import dataset_cache
+from app.services.anomalias_service import eliminar_modelos_anomalias
+from app.services import http_service
 from datetime import datetime
 from io import BytesIO
 from typing import Tuple, Any
 
+# Prefijo de las URLs públicas del bucket 'datasets' en Supabase Storage
+PREFIJO_URL_STORAGE = '/storage/v1/object/public/datasets/'
+# Extensión de la copia columnar que se guarda junto a cada CSV
+EXTENSION_COLUMNAR = '.parquet'
+# Bytes de CSV que se convierten en cada lote (un row group) al escribir la copia columnar desde disco
+BLOQUE_PARQUET_BYTES = 32 * 1024 * 1024
+# Tipo Arrow de cada tipo de tipos_para_indice (así la copia columnar tipa las columnas como pd.read_csv)
+TIPOS_ARROW = {"bool": pa.bool_(), "int64": pa.int64(), "float64": pa.float64(), "str": pa.string()}
+# Extensión del índice de filas (offsets en bytes) que se guarda junto a cada CSV
+EXTENSION_INDICE_FILAS = '.idx.json'
+# Extensión del perfil precalculado (estadísticas, columnas, distribución) de cada CSV
+EXTENSION_PERFIL = '.perfil.json'
+# Extensión de los sketches de cuantiles (boxplots y segmentación aproximados) de cada CSV
+EXTENSION_CUANTILES = '.cuantiles.json'
+# Extensión de los momentos por pares (correlación y sensibilidad sin recorrer los datos) de cada CSV
+EXTENSION_MOMENTOS = '.momentos.json'
+# Extensión del cubo de agregados zona × año × segmento de precio (mapa de calor, serie, segmentación, radar, sankey)
+EXTENSION_CUBO = '.cubo.json'
+# Archivos derivados que se borran del Storage junto con el CSV
+EXTENSIONES_DERIVADAS = (EXTENSION_COLUMNAR, EXTENSION_INDICE_FILAS, EXTENSION_PERFIL, EXTENSION_CUANTILES, EXTENSION_MOMENTOS, EXTENSION_CUBO)
+
+# =============================================================================
+# 0. Copia Columnar (Parquet) de los Datasets
+# =============================================================================
+
+def ruta_derivada(ruta_csv: str, extension: str) -> str:
+    """
+    Devuelve la ruta (o URL) de un archivo derivado que acompaña a un CSV (copia columnar, índice,
+    perfil...): ruta_derivada('datasets/u/archivo.csv', '.perfil.json') -> 'datasets/u/archivo.perfil.json'.
+    """
+    base = ruta_csv.rsplit('.', 1)[0] if ruta_csv.lower().endswith('.csv') else ruta_csv
+    return base + extension
+
+def ruta_columnar(ruta_csv: str) -> str:
+    """ 'datasets/u/archivo.csv' -> 'datasets/u/archivo.parquet' (también sirve con URLs). """
+    return ruta_derivada(ruta_csv, EXTENSION_COLUMNAR)
+
+def guardar_version_columnar(df: pd.DataFrame, archivo_url: str) -> bool:
+    """
+    Convierte el DataFrame a Parquet (tipado y comprimido con zstd) y lo sube al Storage
+    junto al CSV original. Devuelve False si no se pudo (p.ej. columnas con tipos mezclados),
+    en cuyo caso las lecturas seguirán usando el CSV.
+    """
+    try:
+        parquet_buffer = BytesIO()
+        df.to_parquet(parquet_buffer, index=False, compression='zstd')
+        path_in_storage = ruta_columnar(archivo_url.split(PREFIJO_URL_STORAGE)[-1])
+        supabase.storage.from_("datasets").upload(
+            path_in_storage, parquet_buffer.getvalue(),
+            {"content-type": "application/octet-stream", "upsert": "true"}
+        )
+        print(f"-> Copia columnar guardada en {path_in_storage} ({parquet_buffer.tell() / 1e6:.2f} MB)")
+        return True
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar la copia columnar de {archivo_url}: {e}")
+        return False
+
+def guardar_version_columnar_desde_csv(ruta_csv_local: str, ruta_parquet: str, archivo_url: str, tipos: dict) -> bool:
+    """
+    Igual que guardar_version_columnar pero desde un CSV en disco: lo convierte lote a lote
+    (pyarrow.csv + ParquetWriter) con los tipos de `tipos` (tipos_para_indice), sin cargarlo entero.
+    La copia se escribe en `ruta_parquet` y se deja ahí (la borra quien la pidió).
+    """
+    try:
+        lectura = pacsv.ReadOptions(block_size=BLOQUE_PARQUET_BYTES)
+        conversion = pacsv.ConvertOptions(column_types={c: TIPOS_ARROW[t] for c, t in tipos.items()}, strings_can_be_null=True)
+        with pacsv.open_csv(ruta_csv_local, read_options=lectura, convert_options=conversion) as lector:
+            with pq.ParquetWriter(ruta_parquet, lector.schema, compression='zstd') as escritor:
+                for lote in lector: escritor.write_batch(lote)
+        path_in_storage = ruta_columnar(archivo_url.split(PREFIJO_URL_STORAGE)[-1])
+        supabase.storage.from_("datasets").upload(
+            path_in_storage, ruta_parquet,
+            {"content-type": "application/octet-stream", "upsert": "true"}
+        )
+        print(f"-> Copia columnar guardada en {path_in_storage} ({os.path.getsize(ruta_parquet) / 1e6:.2f} MB)")
+        return True
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar la copia columnar de {archivo_url}: {e}")
+        return False
+
+# =============================================================================
+# 0.1 Índice de Filas del CSV (offsets en bytes para leer páginas por rango)
+# =============================================================================
+
+def ruta_indice_filas(ruta_csv: str) -> str:
+    """ 'datasets/u/archivo.csv' -> 'datasets/u/archivo.idx.json' (también sirve con URLs). """
+    return ruta_derivada(ruta_csv, EXTENSION_INDICE_FILAS)
+
+def tipos_para_indice(dtypes) -> dict:
+    """ Resume los dtypes del CSV completo para reproducirlos al parsear solo una porción. """
+    tipos = {}
+    for columna, dtype in dtypes.items():
+        if pd.api.types.is_bool_dtype(dtype): tipos[columna] = "bool"
+        elif pd.api.types.is_integer_dtype(dtype): tipos[columna] = "int64"
+        elif pd.api.types.is_float_dtype(dtype): tipos[columna] = "float64"
+        else: tipos[columna] = "str"
+    return tipos
+
+def construir_indice_filas(bloques, tipos: dict, validadores: dict = None, paso: int = None) -> dict:
+    """
+    Recorre el CSV una sola vez (como iterable de bloques de bytes) y anota el offset en bytes
+    del inicio de cada fila de datos múltiplo de `paso`, además del total de filas.
+
+    Los saltos de línea dentro de campos entre comillas no cuentan como fin de fila (se sigue
+    la paridad de comillas) y las líneas en blanco se ignoran, igual que hace pd.read_csv.
+    """
+    paso = paso or Config.VISTA_PREVIA_PASO_INDICE
+    offsets = []
+    total_filas = 0
+    bytes_cabecera = None
+    base = 0 # Offset global del bloque actual
+    inicio_registro = 0 # Offset global donde empieza el registro en curso
+    dentro_comillas = False
+    ultimo_byte = None
+    inicio_archivo = bytearray() # Primeros bytes, hasta tener la línea de cabecera completa
+
+    def _registrar(inicios, finales, primer_byte):
+        nonlocal total_filas, bytes_cabecera
+        longitudes = finales - inicios
+        en_blanco = (longitudes == 0) | ((longitudes == 1) & (primer_byte == ord('\r')))
+        for inicio, fin in zip(inicios[~en_blanco], finales[~en_blanco]):
+            if bytes_cabecera is None:
+                bytes_cabecera = int(fin) + 1
+                continue
+            if total_filas % paso == 0: offsets.append(int(inicio))
+            total_filas += 1
+
+    for bloque in bloques:
+        if not bloque: continue
+        datos = np.frombuffer(bloque, dtype=np.uint8)
+        if bytes_cabecera is None and len(inicio_archivo) < 1024 * 1024: inicio_archivo.extend(bloque[:1024 * 1024 - len(inicio_archivo)])
+        comillas = np.cumsum(datos == ord('"'))
+        saltos = np.flatnonzero(datos == ord('\n'))
+        paridad = (comillas[saltos] + int(dentro_comillas)) % 2
+        finales = saltos[paridad == 0] + base
+        if len(finales):
+            inicios = np.concatenate(([inicio_registro], finales[:-1] + 1))
+            # Primer byte de cada registro (puede estar en el bloque anterior si el registro lo cruza)
+            primer_byte = np.where(inicios >= base, datos[np.clip(inicios - base, 0, len(datos) - 1)], ultimo_byte or 0)
+            _registrar(inicios, finales, primer_byte)
+            inicio_registro = int(finales[-1]) + 1
+        dentro_comillas = bool((comillas[-1] + int(dentro_comillas)) % 2)
+        ultimo_byte = int(datos[-1])
+        base += len(datos)
+
+    # Última fila sin salto de línea final
+    if inicio_registro < base:
+        _registrar(np.array([inicio_registro]), np.array([base]), np.array([ultimo_byte if base - inicio_registro == 1 else 0]))
+
+    return {
+        "paso": paso,
+        "total_filas": total_filas,
+        "bytes_cabecera": bytes_cabecera or 0,
+        "cabecera": bytes(inicio_archivo[:bytes_cabecera or 0]).decode("utf-8", errors="replace"),
+        "tamano": base,
+        "offsets": offsets,
+        "tipos": tipos,
+        "validadores": validadores or {}
+    }
+
+def guardar_indice_filas(indice: dict, archivo_url: str) -> bool:
+    """ Sube el índice de filas al Storage junto al CSV. Devuelve False si no se pudo. """
+    try:
+        path_in_storage = ruta_indice_filas(archivo_url.split(PREFIJO_URL_STORAGE)[-1])
+        supabase.storage.from_("datasets").upload(
+            path_in_storage, json.dumps(indice).encode("utf-8"),
+            {"content-type": "application/json", "upsert": "true"}
+        )
+        print(f"-> Índice de filas guardado en {path_in_storage} ({indice['total_filas']} filas, {len(indice['offsets'])} offsets)")
+        return True
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar el índice de filas de {archivo_url}: {e}")
+        return False
+
 # =============================================================================
 # 1. Rutas de Lectura (GET /datasets)
 # =============================================================================
@@ -44,21 +228,27 @@ def obtener_lista_datasets() -> list:
 # 2. Rutas de Creación (POST /datasets)
 # =============================================================================
 
+def generar_artefactos_por_chunks(ruta_local: str, es_parquet: bool, archivo_url: str):
+    """
+    Calcula y guarda los artefactos derivados (perfil, sketches de cuantiles, momentos y cubo) de una versión del dataset recorriendo por chunks
+    su copia en disco. Cada uno se genera por separado: si alguno falla, los demás se guardan igual.
+    """
+    # Imports locales: estos servicios importan (directa o indirectamente) este módulo
+    from app.services.lectura_service import LectorPorChunks
+    from app.services.perfil_service import generar_perfil_por_chunks
+    from app.services.cuantiles_service import generar_cuantiles_por_chunks
+    from app.services.momentos_service import generar_momentos_por_chunks
+    from app.services.cubo_service import generar_cubo_por_chunks
+    with LectorPorChunks(archivo_local=ruta_local, es_parquet=es_parquet) as lector:
+        for generar in (generar_perfil_por_chunks, generar_cuantiles_por_chunks, generar_momentos_por_chunks, generar_cubo_por_chunks):
+            generar(lector, archivo_url)
+
 def subir_dataset_csv_metadata(data: dict) -> dict:
     """
     Registra la metadata de un nuevo dataset en la tabla 'datasets'.
     Asumimos que el archivo ya se subió al Storage de Supabase desde el frontend.
     """
     try:
-        # Usamos obtener_dataframe_crudo (del análisis_service) para obtener 
-        # las filas y columnas reales antes de guardar la metadata.
-        # Esto requiere una modificación temporal en obtener_dataframe_crudo para 
-        # aceptar la URL o una llamada al servicio de análisis, pero por simplicidad
-        # aquí, usaremos los datos que envía el frontend y añadimos la fecha.
-        
-        # Simulamos la obtención de filas y columnas si no se proporcionan, 
-        # aunque lo ideal es leer el CSV antes de esta llamada.
-        
         metadata = {
             "nombre": data.get("nombre"),
             "archivo_url": data.get("archivo_url"),
@@ -68,6 +258,31 @@ def subir_dataset_csv_metadata(data: dict) -> dict:
             "fecha_subida": datetime.utcnow().isoformat(),
             "es_limpio": False,
         }
+
+        # Volcamos el CSV a disco por streaming para obtener las filas y columnas reales y
+        # guardar la copia columnar, el índice de filas y los artefactos derivados que usarán las lecturas posteriores.
+        ruta_tmp = ruta_parquet = None
+        try:
+            from app.services.lectura_service import volcar_a_disco, tipos_columnas_csv, BLOQUE_DESCARGA_BYTES # Import local: lectura_service importa este módulo
+            resp = http_service.get(metadata["archivo_url"], timeout=60, stream=True)
+            resp.raise_for_status()
+            validadores = http_service.validadores_de(resp.headers)
+            ruta_tmp, _ = volcar_a_disco(resp)
+            tipos = tipos_columnas_csv(ruta_tmp) # Por chunks: los mismos dtypes que pd.read_csv sobre el archivo completo
+            fd, ruta_parquet = tempfile.mkstemp(prefix="dataset_", suffix=EXTENSION_COLUMNAR)
+            os.close(fd)
+            columnar = guardar_version_columnar_desde_csv(ruta_tmp, ruta_parquet, metadata["archivo_url"], tipos)
+            with open(ruta_tmp, "rb") as f:
+                indice = construir_indice_filas(iter(lambda: f.read(BLOQUE_DESCARGA_BYTES), b""), tipos, validadores)
+            guardar_indice_filas(indice, metadata["archivo_url"])
+            metadata["filas"], metadata["columnas"] = int(indice["total_filas"]), len(tipos)
+            # Los artefactos se leen de la copia Parquet recién escrita (o del CSV si no se pudo), sin volver a descargar
+            generar_artefactos_por_chunks(ruta_parquet if columnar else ruta_tmp, columnar, metadata["archivo_url"])
+        except Exception as e:
+            print(f"⚠️ No se pudo leer el CSV al registrar el dataset (se usará la metadata recibida): {e}")
+        finally:
+            for ruta in (ruta_tmp, ruta_parquet):
+                if ruta and os.path.exists(ruta): os.remove(ruta)
         
         # Insertar el nuevo registro en la base de datos
         res = supabase.table("datasets").insert([metadata]).execute()
@@ -87,8 +302,22 @@ def eliminar_dataset_por_id(dataset_id: str):
     Asumimos que el frontend ya eliminó el archivo del Storage de Supabase.
     """
     try:
+        # Obtener la URL antes de borrar para poder eliminar la copia columnar
+        res = supabase.table("datasets").select("archivo_url").eq("id", dataset_id).execute()
+        archivo_url = res.data[0].get("archivo_url") if res.data else None
+
         # Elimina el registro por ID
         supabase.table("datasets").delete().eq("id", dataset_id).execute()
+
+        if archivo_url:
+            try:
+                ruta_csv = archivo_url.split(PREFIJO_URL_STORAGE)[-1]
+                supabase.storage.from_("datasets").remove([ruta_derivada(ruta_csv, extension) for extension in EXTENSIONES_DERIVADAS])
+            except Exception as e:
+                print(f"⚠️ No se pudo eliminar la copia columnar de {dataset_id}: {e}")
+        # Liberar las copias locales del dataset eliminado y sus modelos de anomalías
+        dataset_cache.invalidar(dataset_id)
+        eliminar_modelos_anomalias(dataset_id)
         # Se podría añadir lógica para eliminar registros relacionados (cascada)
     except Exception as e:
         print(f"Error al eliminar dataset {dataset_id}: {e}")
@@ -113,7 +342,7 @@ def obtener_archivo_dataset(dataset_id: str) -> Tuple[BytesIO, str]:
         
         # 2. Extraer la ruta del archivo del Storage (ej: 'datasets/user_id/timestamp_file.csv')
         # Esto es necesario si usamos el cliente de Python para descargar en lugar de requests
-        path_in_storage = archivo_url.split('/storage/v1/object/public/datasets/')[-1]
+        path_in_storage = archivo_url.split(PREFIJO_URL_STORAGE)[-1]
 
         # 3. Descargar el archivo del Storage
         # Nota: Usamos el método de descarga del cliente Supabase
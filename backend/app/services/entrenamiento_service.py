@@ -1,6 +1,8 @@
 # --- Importaciones ---
 import torch
 import torch.nn as nn
+from torch.utils.data import TensorDataset, DataLoader, BatchSampler, RandomSampler, SequentialSampler
+from app.config import Config
 from app.services.supabase_service import supabase
 from app.services.analisis_service import obtener_dataframe_crudo
 from sklearn.model_selection import train_test_split
@@ -121,16 +123,416 @@ class NeuralNet(nn.Module):
         x = self.network(x)
         return self.output_layer(x)
 
-def iniciar_nuevo_entrenamiento(config: dict):
+# --- Entrenamiento por Lotes (mini-batch) ---
+class CargadorLotes:
+    """
+    Lotes por corte de índices sobre los tensores ya en memoria: sin copias fila a fila ni procesos extra.
+    Sin barajar cada lote es una vista; barajando, un index_select por lote (orden reproducible con `semilla`).
+    """
+    def __init__(self, X: torch.Tensor, y: torch.Tensor, tamano_lote: int, barajar: bool = True, descartar_ultimo: bool = False, semilla: int = 42):
+        self.X, self.y = X, y
+        self.tamano_lote = tamano_lote
+        self.barajar = barajar
+        self.descartar_ultimo = descartar_ultimo
+        self.generador = torch.Generator().manual_seed(semilla)
+
+    def __len__(self):
+        n = len(self.X)
+        return n // self.tamano_lote if self.descartar_ultimo else -(-n // self.tamano_lote)
+
+    def __iter__(self):
+        n = len(self.X)
+        orden = torch.randperm(n, generator=self.generador) if self.barajar else None
+        fin = n - n % self.tamano_lote if self.descartar_ultimo else n
+        for inicio in range(0, fin, self.tamano_lote):
+            if orden is None:
+                yield self.X[inicio:inicio + self.tamano_lote], self.y[inicio:inicio + self.tamano_lote]
+            else:
+                indices = orden[inicio:inicio + self.tamano_lote]
+                yield self.X.index_select(0, indices), self.y.index_select(0, indices)
+
+def crear_cargador_lotes(X_t: torch.Tensor, y_t: torch.Tensor, config: dict):
+    """
+    Cargador de lotes según la configuración del experimento:
+    - `tamano_lote`: filas por paso de optimización (0, vacío o >= filas de entrenamiento: lote completo, devuelve None).
+    - `barajar` (True) y `descartar_ultimo` (False): como shuffle y drop_last de DataLoader.
+    - `procesos_carga` (0) y `memoria_fijada` (False, solo con CUDA): si se piden se usa un DataLoader de
+      PyTorch con prefetch; si no, CargadorLotes, que evita su coste por lote cuando los datos ya están en memoria.
+    """
+    tamano_lote = int(config.get('tamano_lote') or 0)
+    if tamano_lote < 0: raise ValueError("'tamano_lote' no puede ser negativo.")
+    if tamano_lote == 0 or tamano_lote >= len(X_t): return None
+    barajar = bool(config.get('barajar', True))
+    descartar_ultimo = bool(config.get('descartar_ultimo', False))
+    procesos_carga = int(config.get('procesos_carga') or 0)
+    memoria_fijada = bool(config.get('memoria_fijada', False)) and torch.cuda.is_available()
+    if procesos_carga <= 0 and not memoria_fijada:
+        return CargadorLotes(X_t, y_t, tamano_lote, barajar=barajar, descartar_ultimo=descartar_ultimo)
+
+    # BatchSampler + batch_size=None: TensorDataset recibe los índices del lote de una vez (sin collate fila a fila)
+    dataset = TensorDataset(X_t, y_t)
+    muestreo = RandomSampler(dataset, generator=torch.Generator().manual_seed(42)) if barajar else SequentialSampler(dataset)
+    return DataLoader(
+        dataset, sampler=BatchSampler(muestreo, tamano_lote, descartar_ultimo), batch_size=None,
+        num_workers=max(procesos_carga, 0), pin_memory=memoria_fijada,
+        persistent_workers=procesos_carga > 0, prefetch_factor=2 if procesos_carga > 0 else None,
+        multiprocessing_context="spawn" if procesos_carga > 0 else None
+    )
+
+def entrenar_epoca(modelo: nn.Module, optimizer, criterion, X_t: torch.Tensor, y_t: torch.Tensor, cargador=None) -> float:
+    """ Un paso de optimización por lote (uno solo con todo el conjunto si no hay cargador). Devuelve la pérdida media de los lotes. """
+    modelo.train()
+    total, filas = torch.zeros(()), 0
+    for X_lote, y_lote in ([(X_t, y_t)] if cargador is None else cargador):
+        if len(X_lote) < 2 and filas: continue # BatchNorm no puede normalizar un lote de una sola fila
+        loss = criterion(modelo(X_lote), y_lote)
+        optimizer.zero_grad(); loss.backward(); optimizer.step()
+        total += loss.detach() * len(X_lote); filas += len(X_lote)
+    return float(total) / max(filas, 1)
+
+# --- Evaluación sobre Tensores y Parada Temprana ---
+def r2_tensor(y_true: torch.Tensor, y_pred: torch.Tensor) -> float:
+    """
+    R² como sklearn.metrics.r2_score, sin salir de torch. No cambia al desescalar 'y' (transformación
+    afín), así que se calcula sobre los valores escalados sin pasar por scaler_y.inverse_transform.
+    """
+    y_true, y_pred = y_true.double().flatten(), y_pred.double().flatten()
+    ss_res = ((y_true - y_pred) ** 2).sum()
+    ss_tot = ((y_true - y_true.mean()) ** 2).sum()
+    if ss_tot == 0: return 1.0 if ss_res == 0 else 0.0
+    return float(1 - ss_res / ss_tot)
+
+def precision_ponderada_tensor(y_true: torch.Tensor, y_pred: torch.Tensor, num_classes: int) -> float:
+    """ precision_score(average='weighted', zero_division=0) a partir de la matriz de confusión calculada con bincount. """
+    k = max(num_classes, 2)
+    confusion = torch.bincount(y_true * k + y_pred, minlength=k * k).reshape(k, k).double()
+    predichos, soporte = confusion.sum(dim=0), confusion.sum(dim=1)
+    precision = torch.where(predichos > 0, confusion.diagonal() / predichos.clamp(min=1), torch.zeros_like(predichos))
+    return float((precision * soporte).sum() / soporte.sum().clamp(min=1))
+
+def evaluar_red(modelo: nn.Module, criterion, X_t: torch.Tensor, y_t: torch.Tensor, es_clasificacion: bool, num_classes: int) -> tuple:
+    """ Una pasada en modo evaluación: (pérdida, precisión ponderada o R²). """
+    modelo.eval()
+    with torch.no_grad():
+        salidas = modelo(X_t)
+        perdida = float(criterion(salidas, y_t))
+        if not es_clasificacion: return perdida, r2_tensor(y_t, salidas)
+        if num_classes == 2:
+            etiquetas, predichas = y_t.flatten().long(), (salidas > 0).long().flatten() # sigmoid(x) > 0.5 <=> x > 0
+        else:
+            etiquetas, predichas = y_t, salidas.argmax(dim=1)
+        return perdida, precision_ponderada_tensor(etiquetas, predichas, num_classes)
+
+def muestra_evaluacion(X_t: torch.Tensor, y_t: torch.Tensor, filas: int = None) -> tuple:
+    """ Filas de entrenamiento fijas para las métricas de entrenamiento de cada época (todas si caben en `filas`). """
+    filas = filas or Config.ENTRENAMIENTO_MUESTRA_EVALUACION
+    if len(X_t) <= filas: return X_t, y_t
+    indices = torch.randperm(len(X_t), generator=torch.Generator().manual_seed(42))[:filas]
+    return X_t.index_select(0, indices), y_t.index_select(0, indices)
+
+class ParadaTemprana:
+    """
+    Detiene el entrenamiento cuando la pérdida del conjunto de parada ('perdida_parada', filas apartadas del
+    entrenamiento con separar_parada) lleva `paciencia` épocas sin bajar más de `mejora_minima`, y guarda una
+    copia de los pesos (y las métricas) de la mejor época para restaurarlos. Elegir la época con el test
+    inflaría las métricas que luego se informan de él.
+    """
+    def __init__(self, paciencia: int, mejora_minima: float = 0.0):
+        self.paciencia = paciencia
+        self.mejora_minima = mejora_minima
+        self.mejor_perdida = float("inf")
+        self.mejor_epoca = 0
+        self.mejor_estado = None
+        self.mejores_metricas = None
+
+    def actualizar(self, modelo: nn.Module, metricas_epoca: dict) -> bool:
+        """ Registra una época evaluada; devuelve True si hay que parar. """
+        if metricas_epoca['perdida_parada'] < self.mejor_perdida - self.mejora_minima:
+            self.mejor_perdida = metricas_epoca['perdida_parada']
+            self.mejor_epoca = metricas_epoca['epoca']
+            self.mejor_estado = {k: v.detach().clone() for k, v in modelo.state_dict().items()}
+            self.mejores_metricas = metricas_epoca
+            return False
+        return metricas_epoca['epoca'] - self.mejor_epoca >= self.paciencia
+
+    def restaurar(self, modelo: nn.Module):
+        if self.mejor_estado is not None: modelo.load_state_dict(self.mejor_estado)
+
+def separar_parada(X_t: torch.Tensor, y_t: torch.Tensor, fraccion: float = None) -> tuple:
+    """
+    Aparta al azar (semilla fija) `fraccion` de las filas de entrenamiento para la parada temprana.
+    Devuelve (X_ajuste, y_ajuste, X_parada, y_parada); deja al menos 2 filas para ajustar (BatchNorm).
+    """
+    fraccion = Config.ENTRENAMIENTO_FRACCION_PARADA if fraccion is None else fraccion
+    if not 0 < fraccion < 1: raise ValueError("'fraccion_parada' debe estar entre 0 y 1.")
+    filas_parada = min(max(1, round(len(X_t) * fraccion)), len(X_t) - 2)
+    orden = torch.randperm(len(X_t), generator=torch.Generator().manual_seed(42))
+    parada, ajuste = orden[:filas_parada], orden[filas_parada:]
+    return X_t[ajuste], y_t[ajuste], X_t[parada], y_t[parada]
+
+
+# --- Preparación de Datos y Entrenamiento ---
+def preprocesar_dataset(config: dict) -> dict:
+    """
+    Carga y preprocesa el dataset del experimento (medias, dummies, codificación o escalado de 'y') sin
+    dividirlo. Devuelve {"X" (DataFrame), "y" (Series), "columnas", "es_clasificacion", "num_classes",
+    "scaler_y", "label_encoder"}; la validación cruzada reparte estas mismas filas en pliegues.
+    """
+    dataset_id = config.get('dataset_id')
+    columna_objetivo = config.get('columna_objetivo')
+    # Solo se cargan las columnas que usa el modelo (lectura columnar)
+    df = obtener_dataframe_crudo(dataset_id, columnas=list(config.get('columnas_entrada', [])) + [columna_objetivo])
+    for col in df.select_dtypes(include=np.number).columns:
+        if df[col].isnull().sum() > 0: df[col] = df[col].fillna(df[col].mean()) # Reasignar: la columna puede ser una vista mapeada
+
+    columnas_categoricas = [col for col in df.columns if (df[col].dtype == 'object' or isinstance(df[col].dtype, pd.CategoricalDtype)) and col != columna_objetivo]
+    if columnas_categoricas: df = pd.get_dummies(df, columns=columnas_categoricas, drop_first=True)
+
+    columnas_disponibles = [col for col in config['columnas_entrada'] if col in df.columns]
+    X = df[columnas_disponibles].apply(pd.to_numeric, errors='coerce').fillna(0)
+    y_raw = df[columna_objetivo]
+
+
+    # --- 2. Detección y Procesamiento de 'y' ---
+    es_clasificacion = (pd.api.types.is_string_dtype(y_raw) or
+                        pd.api.types.is_categorical_dtype(y_raw) or
+                       (pd.api.types.is_integer_dtype(y_raw) and y_raw.nunique() <= 30))
+
+    print(f"🧠 Tipo de problema detectado: {'CLASIFICACION' if es_clasificacion else 'REGRESION'}")
+
+    if config.get('tipo_modelo') == 'regresion' and es_clasificacion and y_raw.nunique() > 30:
+        raise ValueError(f"Conflicto de tipos. El modelo 'Random Forest' no soporta clasificación de alta cardinalidad ({y_raw.nunique()} clases). Intente con 'Red Neuronal'.")
+
+    num_classes_detected = 1
+    scaler_y, le = None, None
+    if es_clasificacion:
+        le = LabelEncoder()
+        y = pd.Series(le.fit_transform(y_raw.fillna(y_raw.mode()[0])), name=columna_objetivo)
+        num_classes_detected = y.nunique()
+        if num_classes_detected < 2:
+            raise ValueError(f"La columna objetivo '{columna_objetivo}' debe tener al menos 2 clases para clasificar.")
+    else:
+        y = pd.to_numeric(y_raw, errors='coerce').fillna(y_raw.mean())
+        scaler_y = TargetScaler()
+        y = pd.Series(scaler_y.fit_transform(y.values.reshape(-1, 1)).flatten(), name=columna_objetivo)
+        print("-> Variable objetivo 'y' escalada (regresión).")
+
+    return {
+        'X': X, 'y': y, 'columnas': X.columns.tolist(), 'es_clasificacion': bool(es_clasificacion),
+        'num_classes': int(num_classes_detected), 'scaler_y': scaler_y, 'label_encoder': le
+    }
+
+def preparar_datos_entrenamiento(config: dict, base: dict = None) -> dict:
+    """
+    División train/test y StandardScaler sobre preprocesar_dataset (`base` reutiliza uno ya hecho). Se separa
+    del entrenamiento para que una búsqueda de hiperparámetros prepare los datos una sola vez y los comparta
+    entre todas las pruebas.
+    """
+    base = base or preprocesar_dataset(config)
+    X, y, es_clasificacion = base['X'], base['y'], base['es_clasificacion']
+
+    # --- División y Escalado de 'X' ---
+    try:
+        print("-> Intentando división estratificada...")
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=config.get('validacion_split', 0.2), random_state=42, stratify=y if es_clasificacion else None)
+    except ValueError:
+        print("⚠️ Advertencia: La estratificación falló. Usando división normal.")
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=config.get('validacion_split', 0.2), random_state=42, stratify=None)
+
+    scaler_x = StandardScaler(); X_train_scaled = scaler_x.fit_transform(X_train); X_test_scaled = scaler_x.transform(X_test)
+
+    return {
+        'columnas': base['columnas'], 'es_clasificacion': es_clasificacion, 'num_classes': base['num_classes'],
+        'X_train_scaled': X_train_scaled, 'X_test_scaled': X_test_scaled,
+        'y_train': y_train.reset_index(drop=True), 'y_test': y_test.reset_index(drop=True),
+        'scaler_x': scaler_x, 'scaler_y': base['scaler_y'], 'label_encoder': base['label_encoder']
+    }
+
+def metricas_prediccion(es_clasificacion: bool, y_test_eval, predicciones, y_train_eval=None, train_predicciones=None) -> dict:
+    """ Métricas de validación (y de entrenamiento si se dan sus predicciones) con 'y' en su escala original. """
+    if es_clasificacion:
+        metricas = {
+            'accuracy': accuracy_score(y_test_eval, predicciones),
+            'precision': precision_score(y_test_eval, predicciones, average='weighted', zero_division=0),
+            'recall': recall_score(y_test_eval, predicciones, average='weighted', zero_division=0),
+            'f1_score': f1_score(y_test_eval, predicciones, average='weighted', zero_division=0),
+        }
+        if train_predicciones is not None:
+            metricas['precision_entrenamiento'] = precision_score(y_train_eval, train_predicciones, average='weighted', zero_division=0)
+        metricas['precision_validacion'] = metricas['precision']
+        return metricas
+
+    mse_validacion = mean_squared_error(y_test_eval, predicciones)
+    return {
+        'mse': mse_validacion,
+        'mse_validacion': mse_validacion,
+        'mse_entrenamiento': mean_squared_error(y_train_eval, train_predicciones) if train_predicciones is not None else None,
+        'perdida_final': mse_validacion,
+        'r2_score': r2_score(y_test_eval, predicciones),
+    }
+
+def entrenar_modelo(datos: dict, config: dict, progreso=None) -> dict:
+    """
+    Entrena la red neuronal o el Random Forest sobre los datos de preparar_datos_entrenamiento y devuelve
+    el modelo, las predicciones (desescaladas) de test y train y el historial por época.
+    """
+    tipo_modelo_usuario = config.get('tipo_modelo')
+    columna_objetivo = config.get('columna_objetivo')
+    es_clasificacion, num_classes_detected, scaler_y = datos['es_clasificacion'], datos['num_classes'], datos['scaler_y']
+    X_train_scaled, X_test_scaled, y_train, y_test = datos['X_train_scaled'], datos['X_test_scaled'], datos['y_train'], datos['y_test']
+
+    modelo_entrenado, predicciones, train_predicciones, metricas_por_epoca, tiempos_por_epoca = None, None, None, [], []
+    metricas_epoca_final, epocas_entrenadas = None, None # Con parada temprana, las métricas de la mejor época
+    y_test_original = y_test
+    y_train_original = y_train
+
+    if tipo_modelo_usuario == 'red_neuronal':
+        # ... (Entrenamiento PyTorch) ...
+        print("-> Entrenando Red Neuronal (PyTorch)...")
+        X_train_t = torch.tensor(X_train_scaled, dtype=torch.float32); X_test_t = torch.tensor(X_test_scaled, dtype=torch.float32)
+
+        y_train_torch = torch.tensor(y_train_original.values, dtype=torch.long)
+        y_test_torch = torch.tensor(y_test_original.values, dtype=torch.long)
+
+        if es_clasificacion:
+            if num_classes_detected == 2: # Clasificación binaria
+                y_train_t = y_train_torch.float().unsqueeze(1)
+                y_test_t = y_test_torch.float().unsqueeze(1)
+                criterion = nn.BCEWithLogitsLoss()
+            else: # Clasificación multiclase
+                y_train_t = y_train_torch
+                y_test_t = y_test_torch
+                criterion = nn.CrossEntropyLoss()
+        else: # Regresión
+            y_train_t = torch.tensor(y_train_original.values, dtype=torch.float32).unsqueeze(1)
+            y_test_t = torch.tensor(y_test_original.values, dtype=torch.float32).unsqueeze(1)
+            criterion = nn.MSELoss()
+
+        modelo_entrenado = NeuralNet(X_train_t.shape[1], num_classes_detected, is_regression=not es_clasificacion)
+        optimizer = torch.optim.Adam(modelo_entrenado.parameters(), lr=config.get('tasa_aprendizaje', 0.001))
+
+        # Con parada temprana la red se ajusta sin las filas de parada, que eligen la mejor época; el test solo informa
+        paciencia = int(config.get('paciencia', Config.ENTRENAMIENTO_PACIENCIA) or 0)
+        parada = ParadaTemprana(paciencia, float(config.get('mejora_minima') or 0.0)) if paciencia > 0 and len(X_train_t) >= 3 else None
+        X_ajuste_t, y_ajuste_t = X_train_t, y_train_t
+        if parada:
+            X_ajuste_t, y_ajuste_t, X_parada_t, y_parada_t = separar_parada(X_train_t, y_train_t, config.get('fraccion_parada'))
+            print(f"-> Parada temprana: {len(X_parada_t)} filas de entrenamiento apartadas para elegir la mejor época.")
+        cargador = crear_cargador_lotes(X_ajuste_t, y_ajuste_t, config)
+        print("-> Lote completo por época." if cargador is None else f"-> {len(cargador)} lotes de {config.get('tamano_lote')} filas por época.")
+
+        # Métricas en tensores cada `intervalo_evaluacion` épocas (y en la última); las de entrenamiento sobre una muestra fija
+        epocas = config.get('epocas', 100)
+        intervalo_evaluacion = max(1, int(config.get('intervalo_evaluacion') or Config.ENTRENAMIENTO_INTERVALO_EVALUACION))
+        X_eval_train_t, y_eval_train_t = muestra_evaluacion(X_ajuste_t, y_ajuste_t)
+        nombre_metrica = 'precision' if es_clasificacion else 'r2'
+
+        for epoch in range(epocas):
+             epoch_start_time = time.time()
+             entrenar_epoca(modelo_entrenado, optimizer, criterion, X_ajuste_t, y_ajuste_t, cargador)
+
+             epoca_metrics = None
+             if (epoch + 1) % intervalo_evaluacion == 0 or epoch + 1 == epocas:
+                 train_loss, train_metrica = evaluar_red(modelo_entrenado, criterion, X_eval_train_t, y_eval_train_t, es_clasificacion, num_classes_detected)
+                 val_loss, val_metrica = evaluar_red(modelo_entrenado, criterion, X_test_t, y_test_t, es_clasificacion, num_classes_detected)
+                 epoca_metrics = {
+                     'epoca': epoch + 1,
+                     'perdida_validacion': val_loss,
+                     'perdida_entrenamiento': train_loss,
+                     f'{nombre_metrica}_entrenamiento': train_metrica,
+                     f'{nombre_metrica}_validacion': val_metrica
+                 }
+                 if parada: epoca_metrics['perdida_parada'] = evaluar_red(modelo_entrenado, criterion, X_parada_t, y_parada_t, es_clasificacion, num_classes_detected)[0]
+                 metricas_por_epoca.append(epoca_metrics)
+
+             epoch_end_time = time.time()
+             tiempos_por_epoca.append(epoch_end_time - epoch_start_time)
+             if progreso: progreso(epoca_metrics)
+             if parada and epoca_metrics and parada.actualizar(modelo_entrenado, epoca_metrics):
+                 print(f"-> Parada temprana en la época {epoch + 1}: sin mejora en el conjunto de parada desde la época {parada.mejor_epoca}.")
+                 break
+
+        epocas_entrenadas = len(tiempos_por_epoca)
+        if parada and parada.mejor_estado is not None:
+             parada.restaurar(modelo_entrenado)
+             metricas_epoca_final = parada.mejores_metricas
+             print(f"-> Restaurados los pesos de la época {parada.mejor_epoca}.")
+
+        with torch.no_grad():
+             final_outputs = modelo_entrenado(X_test_t)
+             final_train_outputs = modelo_entrenado(X_train_t)
+
+             if es_clasificacion:
+                  if num_classes_detected == 2:
+                      predicciones = (torch.sigmoid(final_outputs) > 0.5).long().flatten().numpy()
+                      train_predicciones = (torch.sigmoid(final_train_outputs) > 0.5).long().flatten().numpy()
+                  else:
+                      _, predicciones = torch.max(final_outputs.data, 1); predicciones = predicciones.numpy()
+                      _, train_predicciones = torch.max(final_train_outputs.data, 1); train_predicciones = train_predicciones.numpy()
+             else: # Regresión
+                 predicciones_scaled = final_outputs.numpy().flatten()
+                 train_predicciones_scaled = final_train_outputs.numpy().flatten()
+                 if scaler_y:
+                     predicciones = scaler_y.inverse_transform(predicciones_scaled.reshape(-1, 1)).flatten()
+                     train_predicciones = scaler_y.inverse_transform(train_predicciones_scaled.reshape(-1, 1)).flatten()
+                     print("-> Predicciones desescaladas.")
+                 else:
+                     predicciones = predicciones_scaled
+                     train_predicciones = train_predicciones_scaled
+
+    elif tipo_modelo_usuario == 'regresion':
+          y_test_orig_rf = y_test
+          y_train_orig_rf = y_train
+
+          if not es_clasificacion and scaler_y:
+               y_train = pd.Series(scaler_y.inverse_transform(y_train.values.reshape(-1, 1)).flatten(), name=columna_objetivo)
+               y_test = pd.Series(scaler_y.inverse_transform(y_test.values.reshape(-1, 1)).flatten(), name=columna_objetivo)
+               print("-> 'y' desescalada para entrenamiento Sklearn.")
+
+          if es_clasificacion:
+              print(f"-> Entrenando Clasificación (Random Forest Classifier)...")
+              modelo_entrenado = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=config.get('n_jobs', -1))
+          else:
+              print(f"-> Entrenando Regresión (Random Forest Regressor)...")
+              modelo_entrenado = RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=config.get('n_jobs', -1))
+
+          modelo_entrenado.fit(X_train_scaled, y_train)
+          if progreso: progreso(None)
+          predicciones = modelo_entrenado.predict(X_test_scaled)
+          train_predicciones = modelo_entrenado.predict(X_train_scaled)
+
+          y_test = y_test_orig_rf
+          y_train = y_train_orig_rf
+    else:
+         raise ValueError(f"Tipo de modelo '{tipo_modelo_usuario}' no reconocido.")
+
+    return {
+        'modelo': modelo_entrenado, 'predicciones': predicciones, 'train_predicciones': train_predicciones,
+        'metricas_por_epoca': metricas_por_epoca, 'tiempos_por_epoca': tiempos_por_epoca,
+        'metricas_epoca_final': metricas_epoca_final, 'epocas_entrenadas': epocas_entrenadas
+    }
+
+
+class EntrenamientoCancelado(Exception):
+    """ Se pidió cancelar el experimento: la lanza el callback de progreso de la cola de entrenamientos. """
+
+
+def iniciar_nuevo_entrenamiento(config: dict, experimento_id: str = None, progreso=None, datos: dict = None):
+    """
+    Entrena y guarda el experimento. `experimento_id` reutiliza la fila creada al encolar; `progreso`, si se
+    indica, recibe las métricas de cada época (o None tras ajustar un Random Forest) y puede lanzar
+    EntrenamientoCancelado para detenerlo (también si se pidió cancelar mientras se guardaba el resultado). `datos` reutiliza un preparar_datos_entrenamiento ya hecho.
+    Con config 'validacion': 'kfold' (y sin `datos`), los pliegues se entrenan en paralelo con el modelo train/test
+    y sus medias sustituyen a las métricas de validación (ver validacion_cruzada_service).
+    """
     # ... (Validación inicial, variables, preparación datos, entrenamiento... todo sin cambios hasta el final) ...
     if config.get('columna_objetivo') in config.get('columnas_entrada', []):
         raise ValueError("La columna objetivo no puede estar incluida en las columnas de entrada.")
 
-    experimento_id = str(uuid.uuid4())
+    experimento_id = experimento_id or str(uuid.uuid4())
     estado_experimento = 'iniciando'
     tipo_problema_detectado = 'indefinido'
-    scaler_y = None
-    le = None # NUEVO: Guardaremos el LabelEncoder si existe
+    validacion_cruzada, cruzada = None, None
 
     try:
         # --- 1. Preparación de Datos ---
@@ -140,179 +542,23 @@ def iniciar_nuevo_entrenamiento(config: dict):
         columna_objetivo = config.get('columna_objetivo')
         print(f"🚀 Iniciando entrenamiento para: {dataset_id} con {tipo_modelo_usuario}")
 
-        df = obtener_dataframe_crudo(dataset_id)
-        for col in df.select_dtypes(include=np.number).columns:
-            if df[col].isnull().sum() > 0: df[col].fillna(df[col].mean(), inplace=True)
-
-        columnas_categoricas = [col for col in df.columns if df[col].dtype == 'object' and col != columna_objetivo]
-        if columnas_categoricas: df = pd.get_dummies(df, columns=columnas_categoricas, drop_first=True)
-
-        columnas_disponibles = [col for col in config['columnas_entrada'] if col in df.columns]
-        X = df[columnas_disponibles].apply(pd.to_numeric, errors='coerce').fillna(0)
-        y_raw = df[columna_objetivo]
-
-
-        # --- 2. Detección y Procesamiento de 'y' ---
-        es_clasificacion = (pd.api.types.is_string_dtype(y_raw) or
-                            pd.api.types.is_categorical_dtype(y_raw) or
-                           (pd.api.types.is_integer_dtype(y_raw) and y_raw.nunique() <= 30))
-
+        base = None if datos else preprocesar_dataset(config)
+        datos = datos or preparar_datos_entrenamiento(config, base)
+        if config.get('validacion') == 'kfold' and base is not None:
+            from app.services.validacion_cruzada_service import ValidacionCruzada # Import local: ese servicio importa este módulo
+            validacion_cruzada = ValidacionCruzada(config, base, experimento_id, vigilar=progreso is not None)
+        del base
+        columnas_modelo = datos['columnas']
+        es_clasificacion, num_classes_detected = datos['es_clasificacion'], datos['num_classes']
+        scaler_x, scaler_y, le = datos['scaler_x'], datos['scaler_y'], datos['label_encoder']
+        X_test_scaled, y_train, y_test = datos['X_test_scaled'], datos['y_train'], datos['y_test']
         tipo_problema_detectado = "clasificacion" if es_clasificacion else "regresion"
-        print(f"🧠 Tipo de problema detectado: {tipo_problema_detectado.upper()}")
-
-        if tipo_modelo_usuario == 'regresion' and es_clasificacion and y_raw.nunique() > 30:
-            raise ValueError(f"Conflicto de tipos. El modelo 'Random Forest' no soporta clasificación de alta cardinalidad ({y_raw.nunique()} clases). Intente con 'Red Neuronal'.")
-
-        num_classes_detected = 1
-        if es_clasificacion:
-            le = LabelEncoder() # NUEVO: Asignar a la variable global
-            y = pd.Series(le.fit_transform(y_raw.fillna(y_raw.mode()[0])), name=columna_objetivo)
-            num_classes_detected = y.nunique()
-            if num_classes_detected < 2:
-                raise ValueError(f"La columna objetivo '{columna_objetivo}' debe tener al menos 2 clases para clasificar.")
-        else:
-            y = pd.to_numeric(y_raw, errors='coerce').fillna(y_raw.mean())
-            scaler_y = TargetScaler()
-            y = pd.Series(scaler_y.fit_transform(y.values.reshape(-1, 1)).flatten(), name=columna_objetivo)
-            print("-> Variable objetivo 'y' escalada (regresión).")
-
-        # --- División y Escalado de 'X' ---
-        try:
-            print("-> Intentando división estratificada...")
-            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=config.get('validacion_split', 0.2), random_state=42, stratify=y if es_clasificacion else None)
-        except ValueError:
-            print("⚠️ Advertencia: La estratificación falló. Usando división normal.")
-            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=config.get('validacion_split', 0.2), random_state=42, stratify=None)
-
-        scaler_x = StandardScaler(); X_train_scaled = scaler_x.fit_transform(X_train); X_test_scaled = scaler_x.transform(X_test)
 
         # --- 3. Entrenamiento del Modelo ---
-        modelo_entrenado, predicciones, train_predicciones, metricas_por_epoca, tiempos_por_epoca = None, None, None, [], []
-        y_test_original = y_test
-        y_train_original = y_train
-
-        # ... (Toda la lógica de entrenamiento de NN y RF sin cambios) ...
-        if tipo_modelo_usuario == 'red_neuronal':
-            # ... (Entrenamiento PyTorch) ...
-            print("-> Entrenando Red Neuronal (PyTorch)...")
-            X_train_t = torch.tensor(X_train_scaled, dtype=torch.float32); X_test_t = torch.tensor(X_test_scaled, dtype=torch.float32)
-
-            y_train_torch = torch.tensor(y_train_original.values, dtype=torch.long)
-            y_test_torch = torch.tensor(y_test_original.values, dtype=torch.long)
-
-            if es_clasificacion:
-                if num_classes_detected == 2: # Clasificación binaria
-                    y_train_t = y_train_torch.float().unsqueeze(1)
-                    y_test_t = y_test_torch.float().unsqueeze(1)
-                    criterion = nn.BCEWithLogitsLoss()
-                else: # Clasificación multiclase
-                    y_train_t = y_train_torch
-                    y_test_t = y_test_torch
-                    criterion = nn.CrossEntropyLoss()
-            else: # Regresión
-                y_train_t = torch.tensor(y_train_original.values, dtype=torch.float32).unsqueeze(1)
-                y_test_t = torch.tensor(y_test_original.values, dtype=torch.float32).unsqueeze(1)
-                criterion = nn.MSELoss()
-
-            modelo_entrenado = NeuralNet(X_train_t.shape[1], num_classes_detected, is_regression=not es_clasificacion)
-            optimizer = torch.optim.Adam(modelo_entrenado.parameters(), lr=config.get('tasa_aprendizaje', 0.001))
-
-            for epoch in range(config.get('epocas', 100)):
-                 epoch_start_time = time.time()
-                 modelo_entrenado.train()
-                 outputs = modelo_entrenado(X_train_t);
-                 loss = criterion(outputs, y_train_t)
-                 optimizer.zero_grad(); loss.backward(); optimizer.step()
-
-                 modelo_entrenado.eval()
-                 with torch.no_grad():
-                     train_outputs = modelo_entrenado(X_train_t)
-                     train_loss = criterion(train_outputs, y_train_t)
-                     val_outputs = modelo_entrenado(X_test_t)
-                     val_loss = criterion(val_outputs, y_test_t)
-
-                     epoca_metrics = {
-                         'epoca': epoch + 1,
-                         'perdida_validacion': float(val_loss.item()),
-                         'perdida_entrenamiento': float(train_loss.item())
-                     }
-
-                     if es_clasificacion:
-                          train_labels, val_labels = None, None
-                          if num_classes_detected == 2:
-                              train_labels = (torch.sigmoid(train_outputs) > 0.5).long().flatten()
-                              val_labels = (torch.sigmoid(val_outputs) > 0.5).long().flatten()
-                          else:
-                              _, train_labels = torch.max(train_outputs.data, 1)
-                              _, val_labels = torch.max(val_outputs.data, 1)
-
-                          epoca_metrics['precision_entrenamiento'] = precision_score(y_train_original, train_labels.numpy(), average='weighted', zero_division=0)
-                          epoca_metrics['precision_validacion'] = precision_score(y_test_original, val_labels.numpy(), average='weighted', zero_division=0)
-                     else: # Regresión
-                         if scaler_y:
-                             y_train_true_orig = scaler_y.inverse_transform(y_train_t.detach().numpy())
-                             train_preds_orig = scaler_y.inverse_transform(train_outputs.detach().numpy())
-                             y_test_true_orig = scaler_y.inverse_transform(y_test_t.detach().numpy())
-                             val_preds_orig = scaler_y.inverse_transform(val_outputs.detach().numpy())
-
-                             epoca_metrics['r2_entrenamiento'] = r2_score(y_train_true_orig, train_preds_orig)
-                             epoca_metrics['r2_validacion'] = r2_score(y_test_true_orig, val_preds_orig)
-                         else:
-                              epoca_metrics['r2_entrenamiento'] = r2_score(y_train_t.detach().numpy(), train_outputs.detach().numpy())
-                              epoca_metrics['r2_validacion'] = r2_score(y_test_t.detach().numpy(), val_outputs.detach().numpy())
-
-                     metricas_por_epoca.append(epoca_metrics)
-
-                 epoch_end_time = time.time()
-                 tiempos_por_epoca.append(epoch_end_time - epoch_start_time)
-
-            with torch.no_grad():
-                 final_outputs = modelo_entrenado(X_test_t)
-                 final_train_outputs = modelo_entrenado(X_train_t)
-
-                 if es_clasificacion:
-                      if num_classes_detected == 2:
-                          predicciones = (torch.sigmoid(final_outputs) > 0.5).long().flatten().numpy()
-                          train_predicciones = (torch.sigmoid(final_train_outputs) > 0.5).long().flatten().numpy()
-                      else:
-                          _, predicciones = torch.max(final_outputs.data, 1); predicciones = predicciones.numpy()
-                          _, train_predicciones = torch.max(final_train_outputs.data, 1); train_predicciones = train_predicciones.numpy()
-                 else: # Regresión
-                     predicciones_scaled = final_outputs.numpy().flatten()
-                     train_predicciones_scaled = final_train_outputs.numpy().flatten()
-                     if scaler_y:
-                         predicciones = scaler_y.inverse_transform(predicciones_scaled.reshape(-1, 1)).flatten()
-                         train_predicciones = scaler_y.inverse_transform(train_predicciones_scaled.reshape(-1, 1)).flatten()
-                         print("-> Predicciones desescaladas.")
-                     else:
-                         predicciones = predicciones_scaled
-                         train_predicciones = train_predicciones_scaled
-
-        elif tipo_modelo_usuario == 'regresion':
-              y_test_orig_rf = y_test
-              y_train_orig_rf = y_train
-
-              if not es_clasificacion and scaler_y:
-                   y_train = pd.Series(scaler_y.inverse_transform(y_train.values.reshape(-1, 1)).flatten(), name=columna_objetivo)
-                   y_test = pd.Series(scaler_y.inverse_transform(y_test.values.reshape(-1, 1)).flatten(), name=columna_objetivo)
-                   print("-> 'y' desescalada para entrenamiento Sklearn.")
-
-              if es_clasificacion:
-                  print(f"-> Entrenando Clasificación (Random Forest Classifier)...")
-                  modelo_entrenado = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1)
-              else:
-                  print(f"-> Entrenando Regresión (Random Forest Regressor)...")
-                  modelo_entrenado = RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=-1)
-
-              modelo_entrenado.fit(X_train_scaled, y_train)
-              predicciones = modelo_entrenado.predict(X_test_scaled)
-              train_predicciones = modelo_entrenado.predict(X_train_scaled)
-
-              y_test = y_test_orig_rf
-              y_train = y_train_orig_rf
-        else:
-             raise ValueError(f"Tipo de modelo '{tipo_modelo_usuario}' no reconocido.")
-
+        entrenado = entrenar_modelo(datos, config, progreso)
+        modelo_entrenado, predicciones, train_predicciones = entrenado['modelo'], entrenado['predicciones'], entrenado['train_predicciones']
+        metricas_por_epoca, tiempos_por_epoca = entrenado['metricas_por_epoca'], entrenado['tiempos_por_epoca']
+        metricas_epoca_final, epocas_entrenadas = entrenado['metricas_epoca_final'], entrenado['epocas_entrenadas']
 
         end_time = time.time()
 
@@ -329,16 +575,8 @@ def iniciar_nuevo_entrenamiento(config: dict):
 
         if predicciones is not None:
              # ... (Cálculo de métricas sin cambios) ...
+              metricas = metricas_prediccion(es_clasificacion, y_test_eval, predicciones, y_train_eval, train_predicciones)
               if es_clasificacion:
-                  metricas = {
-                      'accuracy': accuracy_score(y_test_eval, predicciones),
-                      'precision': precision_score(y_test_eval, predicciones, average='weighted', zero_division=0),
-                      'recall': recall_score(y_test_eval, predicciones, average='weighted', zero_division=0),
-                      'f1_score': f1_score(y_test_eval, predicciones, average='weighted', zero_division=0),
-                  }
-                  if train_predicciones is not None:
-                       metricas['precision_entrenamiento'] = precision_score(y_train_eval, train_predicciones, average='weighted', zero_division=0)
-                  metricas['precision_validacion'] = metricas['precision']
                   matriz_confusion = confusion_matrix(y_test_eval, predicciones).tolist()
 
                   if num_classes_detected == 2:
@@ -355,25 +593,15 @@ def iniciar_nuevo_entrenamiento(config: dict):
                             curva_roc = {'auc': roc_auc_score(y_test_eval, pred_prob), 'fpr': fpr.tolist(), 'tpr': tpr.tolist()}
 
               else: # REGRESSION
-                  mse_validacion = mean_squared_error(y_test_eval, predicciones)
-                  r2 = r2_score(y_test_eval, predicciones)
-                  mse_entrenamiento = mean_squared_error(y_train_eval, train_predicciones) if train_predicciones is not None else None
-
-                  metricas = {
-                      'mse': mse_validacion,
-                      'mse_validacion': mse_validacion,
-                      'mse_entrenamiento': mse_entrenamiento,
-                      'perdida_final': mse_validacion,
-                      'r2_score': r2,
-                  }
-
                   distribucion_errores = (y_test_eval.values - predicciones).tolist()
                   predicciones_vs_reales = [{'real': float(r), 'prediccion': float(p)} for r, p in zip(y_test_eval.values, predicciones)]
 
 
         if metricas_por_epoca:
              # ... (Sobrescritura métricas NN sin cambios) ...
-              last_epoch_metrics = metricas_por_epoca[-1]
+              last_epoch_metrics = metricas_epoca_final or metricas_por_epoca[-1]
+              metricas['epocas_entrenadas'] = epocas_entrenadas
+              if metricas_epoca_final: metricas['mejor_epoca'] = metricas_epoca_final['epoca']
               if es_clasificacion:
                   if 'precision_validacion' in last_epoch_metrics:
                       metricas['precision'] = last_epoch_metrics['precision_validacion']
@@ -388,6 +616,13 @@ def iniciar_nuevo_entrenamiento(config: dict):
                   if 'r2_validacion' in last_epoch_metrics:
                       metricas['r2_score'] = last_epoch_metrics['r2_validacion']
 
+        # --- Validación cruzada: media y desviación de los pliegues en lugar de la única división train/test ---
+        if validacion_cruzada:
+             print(f"-> Esperando a los {validacion_cruzada.pliegues} pliegues de la validación cruzada...")
+             cruzada = validacion_cruzada.resultados(progreso)
+             metricas.update(cruzada['metricas'])
+             metricas['pliegues'] = validacion_cruzada.pliegues
+
 
         # --- Cálculo de Importancia de Features (sin cambios) ---
         print("-> Calculando importancia de features...")
@@ -413,11 +648,11 @@ def iniciar_nuevo_entrenamiento(config: dict):
                     random_state=42,
                     n_jobs=n_jobs_val
                 )
-                importancia_features = [{'feature': f, 'importancia': float(imp)} for f, imp in zip(X.columns, imps.importances_mean)]
+                importancia_features = [{'feature': f, 'importancia': float(imp)} for f, imp in zip(columnas_modelo, imps.importances_mean)]
 
             else: # Para modelos Sklearn
                 imps = permutation_importance(modelo_entrenado, X_test_scaled, y_test_eval, n_repeats=10, random_state=42, n_jobs=n_jobs_val)
-                importancia_features = [{'feature': f, 'importancia': float(imp)} for f, imp in zip(X.columns, imps.importances_mean)]
+                importancia_features = [{'feature': f, 'importancia': float(imp)} for f, imp in zip(columnas_modelo, imps.importances_mean)]
 
             importancia_features.sort(key=lambda x: x['importancia'], reverse=True)
             print("-> Importancia de features calculada.")
@@ -436,7 +671,7 @@ def iniciar_nuevo_entrenamiento(config: dict):
             # Definir nombres de archivo únicos
             base_path = f"experimento_{experimento_id}"
             artefactos_info['model_type'] = tipo_modelo_usuario
-            artefactos_info['columns'] = X.columns.tolist() # Guardar columnas usadas
+            artefactos_info['columns'] = columnas_modelo # Guardar columnas usadas
 
             # Guardar scaler_x (siempre existe)
             scaler_x_buffer = io.BytesIO()
@@ -471,7 +706,7 @@ def iniciar_nuevo_entrenamiento(config: dict):
                 artefactos_guardados['model_statedict.pth'] = model_buffer
                 artefactos_info['model_path'] = f"{base_path}/model_statedict.pth"
                 # NUEVO: Guardar info necesaria para reconstruir la NN
-                artefactos_info['nn_input_size'] = X_train_t.shape[1]
+                artefactos_info['nn_input_size'] = len(columnas_modelo)
                 artefactos_info['nn_num_classes'] = num_classes_detected
                 artefactos_info['nn_is_regression'] = not es_clasificacion
 
@@ -482,6 +717,15 @@ def iniciar_nuevo_entrenamiento(config: dict):
                 artefactos_guardados['model.joblib'] = model_buffer
                 artefactos_info['model_path'] = f"{base_path}/model.joblib"
 
+            # Ensamble de los modelos de los pliegues (la predicción promedia sus salidas)
+            if cruzada and cruzada['modelos']:
+                nombre_modelo = 'model_statedict.pth' if tipo_modelo_usuario == 'red_neuronal' else 'model.joblib'
+                artefactos_info['ensamble'] = []
+                for i, (modelo_bytes, scaler_bytes) in enumerate(cruzada['modelos'], start=1):
+                    artefactos_guardados[f'pliegue_{i}/{nombre_modelo}'] = io.BytesIO(modelo_bytes)
+                    artefactos_guardados[f'pliegue_{i}/scaler_x.joblib'] = io.BytesIO(scaler_bytes)
+                    artefactos_info['ensamble'].append({'model_path': f"{base_path}/pliegue_{i}/{nombre_modelo}", 'scaler_x_path': f"{base_path}/pliegue_{i}/scaler_x.joblib"})
+
             # Subir todos los artefactos guardados a Supabase
             print(f"-> Subiendo {len(artefactos_guardados)} artefactos a Supabase Storage/{ARTEFACTOS_BUCKET_NAME}...")
             storage_client = supabase.storage.from_(ARTEFACTOS_BUCKET_NAME)
@@ -507,12 +751,13 @@ def iniciar_nuevo_entrenamiento(config: dict):
             artefactos_info = {"error": f"Fallo al guardar artefactos: {str(save_err)}"}
             # Podrías querer cambiar el estado del experimento aquí también
 
+        if cruzada: artefactos_info['validacion_cruzada'] = {'pliegues': len(cruzada['por_pliegue']), 'por_pliegue': cruzada['por_pliegue']}
 
         # --- 6. Guardar el experimento completo (AHORA CON artefactos_info) ---
         estado_experimento = 'completado' if 'error' not in artefactos_info else 'completado_sin_artefactos'
         nuevo_experimento = {
             'id': experimento_id,
-            'nombre': f"Experimento_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+            'nombre': config.get('nombre') or f"Experimento_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
             'dataset_id': dataset_id,
             'configuracion': json.dumps(config),
             'estado': estado_experimento,
@@ -531,7 +776,12 @@ def iniciar_nuevo_entrenamiento(config: dict):
             'importancia_features': json.dumps(importancia_features),
         }
 
-        result = supabase.table('experimentos').insert(nuevo_experimento).execute()
+        if progreso is not None:
+            # La fila ya existe (la creó la cola o la búsqueda): update condicional para no pisar un 'cancelando'
+            result = supabase.table('experimentos').update(nuevo_experimento).eq('id', experimento_id).neq('estado', 'cancelando').execute()
+            if not result.data: raise EntrenamientoCancelado()
+        else:
+            result = supabase.table('experimentos').upsert(nuevo_experimento).execute()
         # NUEVO: Mejor manejo de errores de Supabase
         if not result.data or len(result.data) == 0:
              # Intenta obtener el error de la respuesta si existe
@@ -541,6 +791,8 @@ def iniciar_nuevo_entrenamiento(config: dict):
         print("🎉 Entrenamiento completado y guardado (con artefactos).")
         return result.data[0]
 
+    except EntrenamientoCancelado:
+        raise # La cola marca el experimento como cancelado
     except Exception as e:
         # ... (Manejo de errores sin cambios) ...
         print(f"🔥🔥🔥 Error detallado en el servicio de entrenamiento: {e}")
@@ -558,6 +810,8 @@ def iniciar_nuevo_entrenamiento(config: dict):
             'artefactos_info': json.dumps({"error": f"Entrenamiento falló: {str(e)}"}),
             'metricas': json.dumps({'error': str(e)})
         }
-        supabase.table('experimentos').insert(experimento_fallido).execute()
+        supabase.table('experimentos').upsert(experimento_fallido).execute()
         raise e
+    finally:
+        if validacion_cruzada: validacion_cruzada.cerrar()
 
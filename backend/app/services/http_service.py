@@ -0,0 +1,119 @@
+import os
+import json
+import threading
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from app.config import Config
+
+# =============================================================================
+# 1️⃣ Sesión HTTP Compartida (keep-alive + reintentos)
+# =============================================================================
+# Una única sesión por proceso: las descargas de datasets y artefactos reutilizan
+# las conexiones TLS abiertas en lugar de abrir una nueva en cada requests.get.
+_reintentos = Retry(
+    total=Config.HTTP_REINTENTOS,
+    backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["HEAD", "GET"],
+    raise_on_status=False
+)
+_adaptador = HTTPAdapter(pool_connections=Config.HTTP_POOL_HOSTS, pool_maxsize=Config.HTTP_POOL_CONEXIONES, max_retries=_reintentos)
+
+sesion = requests.Session()
+sesion.mount("https://", _adaptador)
+sesion.mount("http://", _adaptador)
+
+_lock = threading.Lock()
+_estadisticas_host = {}
+
+def _registrar(url: str, **incrementos):
+    host = urlparse(url).netloc
+    with _lock:
+        stats = _estadisticas_host.setdefault(host, {"peticiones": 0, "respuestas_304": 0, "bytes_descargados": 0, "bytes_ahorrados": 0})
+        for clave, valor in incrementos.items():
+            stats[clave] += valor
+
+def get(url: str, headers: dict = None, stream: bool = False, timeout=(10, 120)) -> requests.Response:
+    """ GET a través de la sesión compartida (contabiliza la petición por host). """
+    resp = sesion.get(url, headers=headers or {}, stream=stream, timeout=timeout)
+    _registrar(url, peticiones=1, respuestas_304=int(resp.status_code == 304))
+    return resp
+
+def registrar_bytes(url: str, descargados: int = 0, ahorrados: int = 0):
+    """ Permite a los llamadores contabilizar bytes transferidos o evitados gracias a un 304. """
+    _registrar(url, bytes_descargados=descargados, bytes_ahorrados=ahorrados)
+
+# =============================================================================
+# 2️⃣ Validadores HTTP (ETag / Last-Modified)
+# =============================================================================
+def validadores_de(headers) -> dict:
+    """ Extrae los validadores de una respuesta para revalidar después con un GET condicional. """
+    return {"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified"), "content_length": headers.get("Content-Length")}
+
+def cabeceras_condicionales(validadores: dict) -> dict:
+    """ Cabeceras If-None-Match / If-Modified-Since a partir de validadores guardados. """
+    cabeceras = {}
+    if validadores and validadores.get("etag"): cabeceras["If-None-Match"] = validadores["etag"]
+    if validadores and validadores.get("last_modified"): cabeceras["If-Modified-Since"] = validadores["last_modified"]
+    return cabeceras
+
+def version_de(validadores: dict):
+    """ Identificador de versión estable a partir de los validadores (None si no hay). """
+    if validadores.get("etag"): return f"etag:{validadores['etag']}"
+    if validadores.get("last_modified"): return f"lm:{validadores['last_modified']}:{validadores.get('content_length') or ''}"
+    return None
+
+def descargar_con_revalidacion(url: str, ruta_local: str) -> str:
+    """
+    Mantiene una copia local de `url` en `ruta_local`. Si ya existe, revalida con un GET
+    condicional y, ante un 304, no transfiere el cuerpo. Devuelve la ruta local.
+    """
+    ruta_meta = f"{ruta_local}.meta.json"
+    validadores = None
+    if os.path.exists(ruta_local) and os.path.exists(ruta_meta):
+        try:
+            with open(ruta_meta) as f: validadores = json.load(f)
+        except (OSError, ValueError):
+            validadores = None
+
+    with get(url, headers=cabeceras_condicionales(validadores), stream=True) as resp:
+        if resp.status_code == 304:
+            registrar_bytes(url, ahorrados=os.path.getsize(ruta_local))
+            return ruta_local
+        resp.raise_for_status()
+        os.makedirs(os.path.dirname(ruta_local), exist_ok=True)
+        ruta_tmp = f"{ruta_local}.{os.getpid()}.tmp"
+        descargados = 0
+        with open(ruta_tmp, "wb") as destino:
+            for bloque in resp.iter_content(chunk_size=1024 * 1024):
+                destino.write(bloque)
+                descargados += len(bloque)
+        os.replace(ruta_tmp, ruta_local)
+        with open(ruta_meta, "w") as f: json.dump(validadores_de(resp.headers), f)
+        registrar_bytes(url, descargados=descargados)
+    return ruta_local
+
+# =============================================================================
+# 3️⃣ Métricas de Reutilización de Conexiones
+# =============================================================================
+def estadisticas() -> dict:
+    """
+    Por host: peticiones, respuestas 304, bytes descargados/ahorrados y, desde los pools de
+    urllib3, conexiones abiertas frente a peticiones servidas (la diferencia son reutilizaciones).
+    """
+    with _lock:
+        por_host = {host: dict(stats) for host, stats in _estadisticas_host.items()}
+    pools = _adaptador.poolmanager.pools
+    for clave in list(pools.keys()):
+        pool = pools.get(clave)
+        if pool is None: continue
+        host = f"{pool.host}:{pool.port}" if pool.port not in (80, 443, None) else pool.host
+        stats = por_host.setdefault(host, {"peticiones": 0, "respuestas_304": 0, "bytes_descargados": 0, "bytes_ahorrados": 0})
+        stats["conexiones_abiertas"] = stats.get("conexiones_abiertas", 0) + pool.num_connections
+        stats["peticiones_pool"] = stats.get("peticiones_pool", 0) + pool.num_requests
+    for stats in por_host.values():
+        if "peticiones_pool" in stats:
+            stats["conexiones_reutilizadas"] = max(0, stats["peticiones_pool"] - stats["conexiones_abiertas"])
+    return {"hosts": por_host, "pid": os.getpid()}
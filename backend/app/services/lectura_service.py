@@ -0,0 +1,316 @@
+import io
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+import requests
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from app.config import Config
+from app.services.supabase_service import supabase
+from app.services.cache_service import dataset_cache
+from app.services.datasets_service import ruta_columnar, ruta_indice_filas, EXTENSION_INDICE_FILAS, construir_indice_filas, guardar_indice_filas, tipos_para_indice
+from app.services import http_service
+
+# Tamaño de los bloques al descargar por streaming (1 MB)
+BLOQUE_DESCARGA_BYTES = 1024 * 1024
+
+# =============================================================================
+# 1️⃣ Resolución de la Fuente de un Dataset (GET condicional)
+# =============================================================================
+def _url_archivo_dataset(dataset_id: str) -> str:
+    dataset_res = supabase.table("datasets").select("archivo_url").eq("id", dataset_id).single().execute()
+    if not dataset_res.data:
+        raise ValueError(f"❌ Dataset con ID '{dataset_id}' no encontrado.")
+
+    archivo_url = dataset_res.data.get("archivo_url")
+    if not archivo_url:
+        raise ValueError("❌ El registro del dataset no tiene una URL de archivo.")
+    return archivo_url
+
+def abrir_fuente_dataset(dataset_id: str, revalidar: bool = True) -> dict:
+    """
+    Decide desde dónde leer un dataset: la copia Parquet (si se generó al registrarlo) o el CSV.
+    Si hay una copia local, revalida con If-None-Match / If-Modified-Since en el mismo GET,
+    así un dataset sin cambios responde 304 y no se transfiere el cuerpo.
+
+    Devuelve {"url", "es_parquet", "version", "validadores", "respuesta"}. "respuesta" es None
+    cuando la copia local está vigente; si no, es una respuesta en streaming que el llamador
+    debe consumir (volcar_a_disco o LectorPorChunks) o cerrar.
+    """
+    archivo_url = _url_archivo_dataset(dataset_id)
+    conocidos = dataset_cache.validadores(dataset_id) if revalidar else None
+    if conocidos and not dataset_cache.existe(dataset_id, conocidos.get("version")):
+        conocidos = None # La copia local fue evictada: hay que descargar completo
+
+    for url, es_parquet in ((ruta_columnar(archivo_url), True), (archivo_url, False)):
+        cabeceras = http_service.cabeceras_condicionales(conocidos) if conocidos and conocidos.get("url") == url else {}
+        resp = http_service.get(url, headers=cabeceras, stream=True)
+        if resp.status_code == 304:
+            resp.close()
+            http_service.registrar_bytes(url, ahorrados=int(conocidos.get("content_length") or 0))
+            return {"url": url, "es_parquet": es_parquet, "version": conocidos["version"], "validadores": conocidos, "respuesta": None}
+        if es_parquet and not resp.ok:
+            resp.close()
+            continue # El dataset no tiene copia columnar: usar el CSV
+        resp.raise_for_status() # Lanza error si la descarga falla
+
+        validadores = {**http_service.validadores_de(resp.headers), "url": url}
+        version = http_service.version_de(validadores)
+        if version and dataset_cache.existe(dataset_id, version):
+            resp.close() # Otro worker ya guardó esta versión
+            return {"url": url, "es_parquet": es_parquet, "version": version, "validadores": validadores, "respuesta": None}
+        return {"url": url, "es_parquet": es_parquet, "version": version, "validadores": validadores, "respuesta": resp}
+
+def volcar_a_disco(resp) -> tuple:
+    """
+    Vuelca una respuesta en streaming a un temporal en disco, sin mantener el cuerpo
+    completo en memoria. Devuelve (ruta_temporal, sha256). El llamador debe borrar el archivo.
+    """
+    sha = hashlib.sha256()
+    descargados = 0
+    fd, ruta_tmp = tempfile.mkstemp(prefix="dataset_", suffix=".tmp")
+    try:
+        with resp, os.fdopen(fd, "wb") as destino:
+            for bloque in resp.iter_content(chunk_size=BLOQUE_DESCARGA_BYTES):
+                destino.write(bloque)
+                sha.update(bloque)
+                descargados += len(bloque)
+    except Exception:
+        os.remove(ruta_tmp)
+        raise
+    http_service.registrar_bytes(resp.url, descargados=descargados)
+    return ruta_tmp, sha.hexdigest()
+
+# =============================================================================
+# 2️⃣ Lectura por Chunks (datasets más grandes que la RAM del worker)
+# =============================================================================
+class _LecturaConCopia:
+    """ Envuelve el cuerpo HTTP: lo que pandas lee también se escribe en una copia local. """
+    def __init__(self, fuente, copia):
+        self.fuente = fuente
+        self.copia = copia
+
+    def read(self, n=-1):
+        datos = self.fuente.read(n if n is not None and n >= 0 else None)
+        if datos: self.copia.write(datos)
+        return datos
+
+
+class LectorPorChunks:
+    """
+    Itera un dataset en DataFrames de a lo sumo `filas_por_chunk` filas sin construir nunca el frame completo.
+
+    - Si el dataset está en la caché local, lee los record batches del archivo Arrow IPC (memory-map).
+    - Si hay copia Parquet, la descarga a disco y la recorre por row groups.
+    - Si solo existe el CSV, aplica pd.read_csv(chunksize=...) directamente sobre la respuesta HTTP
+      en streaming, guardando una copia en disco para que las pasadas siguientes no vuelvan a descargar.
+
+    Con `archivo_local` recorre esa copia en disco (CSV, o Parquet con `es_parquet`) en lugar de resolver la
+    fuente del dataset, p. ej. la que se acaba de escribir al registrarlo; el archivo no se borra al cerrar.
+
+    Cada llamada a iterar() empieza una pasada nueva (útil para algoritmos de dos pasadas).
+    """
+    def __init__(self, dataset_id: str = None, columnas: list = None, filas_por_chunk: int = None, archivo_local: str = None, es_parquet: bool = False):
+        self.dataset_id = dataset_id
+        self.columnas = columnas
+        self.filas_por_chunk = filas_por_chunk or Config.DATASET_CHUNK_FILAS
+        if archivo_local:
+            self.fuente = {"url": archivo_local, "es_parquet": es_parquet, "version": None}
+            self._respuesta = None
+        else:
+            self.fuente = abrir_fuente_dataset(dataset_id)
+            self._respuesta = self.fuente.pop("respuesta") # Respuesta pendiente de consumir (o None)
+        self._ruta_local = archivo_local # Copia en disco (CSV o Parquet) completa
+        self._ruta_ajena = archivo_local # La copia es de quien la pasó: no se borra al cerrar
+        self._copia_tmp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def cerrar(self):
+        if self._respuesta is not None: self._respuesta.close()
+        for ruta in (self._ruta_local, self._copia_tmp):
+            if ruta and ruta != self._ruta_ajena and os.path.exists(ruta): os.remove(ruta)
+        self._respuesta = self._ruta_local = self._copia_tmp = None
+
+    def _columnas_existentes(self, nombres: list):
+        if self.columnas is None: return None
+        return [c for c in self.columnas if c in nombres]
+
+    def _iterar_ipc(self, ruta: str):
+        with pa.memory_map(ruta, "r") as fuente:
+            lector = pa.ipc.open_file(fuente)
+            columnas = self._columnas_existentes(lector.schema.names)
+            for i in range(lector.num_record_batches):
+                lote = lector.get_batch(i)
+                if columnas is not None: lote = lote.select(columnas)
+                # La caché escribe un único batch: se trocea en chunks (slice no copia)
+                for inicio in range(0, lote.num_rows, self.filas_por_chunk):
+                    yield lote.slice(inicio, self.filas_por_chunk).to_pandas()
+
+    def _iterar_parquet(self, ruta: str):
+        archivo = pq.ParquetFile(ruta)
+        columnas = self._columnas_existentes(archivo.schema_arrow.names)
+        for lote in archivo.iter_batches(batch_size=self.filas_por_chunk, columns=columnas):
+            yield lote.to_pandas()
+
+    def _usecols(self):
+        if self.columnas is None: return None
+        pedidas = set(self.columnas)
+        return lambda c: c in pedidas
+
+    def _tomar_respuesta(self):
+        """ Devuelve la respuesta pendiente o, si ya se consumió, hace una descarga nueva. """
+        resp, self._respuesta = self._respuesta, None
+        if resp is None:
+            fuente = abrir_fuente_dataset(self.dataset_id, revalidar=False)
+            resp = fuente["respuesta"] or http_service.get(fuente["url"], stream=True)
+        return resp
+
+    def _iterar_csv_streaming(self):
+        if self._copia_tmp and os.path.exists(self._copia_tmp): os.remove(self._copia_tmp) # Pasada anterior incompleta
+        fd, self._copia_tmp = tempfile.mkstemp(prefix="dataset_", suffix=".csv")
+        completo = False
+        with self._tomar_respuesta() as resp, os.fdopen(fd, "wb") as copia:
+            resp.raw.decode_content = True # Descomprimir gzip/deflate de forma transparente
+            lector = pd.read_csv(_LecturaConCopia(resp.raw, copia), chunksize=self.filas_por_chunk, usecols=self._usecols())
+            with lector:
+                for chunk in lector:
+                    yield chunk
+            completo = True
+        if completo:
+            self._ruta_local, self._copia_tmp = self._copia_tmp, None
+            http_service.registrar_bytes(self.fuente["url"], descargados=os.path.getsize(self._ruta_local))
+
+    def iterar(self):
+        """ Generador de DataFrames (chunks) en el orden original de las filas. """
+        version = self.fuente["version"]
+        ruta_cache = dataset_cache.ruta_vigente(self.dataset_id, version) if version and self._respuesta is None and not self._ruta_local else None
+        if ruta_cache:
+            yield from self._iterar_ipc(ruta_cache)
+        elif self._ruta_local:
+            if self.fuente["es_parquet"]:
+                yield from self._iterar_parquet(self._ruta_local)
+            else:
+                with pd.read_csv(self._ruta_local, chunksize=self.filas_por_chunk, usecols=self._usecols()) as lector:
+                    yield from lector
+        elif self.fuente["es_parquet"]:
+            self._ruta_local, _ = volcar_a_disco(self._tomar_respuesta())
+            yield from self._iterar_parquet(self._ruta_local)
+        else:
+            yield from self._iterar_csv_streaming()
+
+def chunks_de(df: pd.DataFrame):
+    """ Recorre un DataFrame ya cargado en chunks de Config.DATASET_CHUNK_FILAS filas, como LectorPorChunks.iterar(). """
+    for inicio in range(0, len(df), Config.DATASET_CHUNK_FILAS):
+        yield df.iloc[inicio:inicio + Config.DATASET_CHUNK_FILAS]
+
+def valor_nativo(valor):
+    """ Convierte un escalar de NumPy (etiqueta de grupo, categoría...) al tipo de Python para guardarlo en JSON. """
+    return valor.item() if isinstance(valor, np.generic) else valor
+
+
+def promover_tipo(tipo_actual, tipo_nuevo):
+    """ Combina el dtype de una columna entre chunks como lo haría read_csv sobre el archivo completo. """
+    if tipo_actual is None or tipo_actual == tipo_nuevo: return tipo_nuevo
+    actual_num = pd.api.types.is_numeric_dtype(tipo_actual) and not pd.api.types.is_bool_dtype(tipo_actual)
+    nuevo_num = pd.api.types.is_numeric_dtype(tipo_nuevo) and not pd.api.types.is_bool_dtype(tipo_nuevo)
+    if actual_num and nuevo_num: return np.result_type(tipo_actual, tipo_nuevo)
+    # Un chunk sin valores se infiere como float64: manda el tipo no numérico
+    if actual_num: return tipo_nuevo
+    if nuevo_num: return tipo_actual
+    return np.dtype(object)
+
+# =============================================================================
+# 3️⃣ Lectura de Filas por Rango (índice de offsets + HTTP Range)
+# =============================================================================
+def _ruta_local_indice(archivo_url: str) -> str:
+    nombre = hashlib.sha1(archivo_url.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(Config.DATASET_CACHE_DIR, "indices", f"{nombre}{EXTENSION_INDICE_FILAS}")
+
+def tipos_columnas_csv(ruta: str) -> dict:
+    """ dtypes que pd.read_csv daría al archivo completo, calculados por chunks. """
+    tipos = {}
+    with pd.read_csv(ruta, chunksize=Config.DATASET_CHUNK_FILAS) as lector:
+        for chunk in lector:
+            for columna in chunk.columns:
+                tipos[columna] = promover_tipo(tipos.get(columna), chunk[columna].dtype)
+    return tipos_para_indice(tipos)
+
+def construir_indice_remoto(archivo_url: str) -> dict:
+    """ Descarga el CSV por streaming una vez, construye su índice de filas y lo sube junto al CSV. """
+    resp = http_service.get(archivo_url, stream=True)
+    resp.raise_for_status()
+    validadores = http_service.validadores_de(resp.headers)
+    ruta_tmp, _ = volcar_a_disco(resp)
+    try:
+        with open(ruta_tmp, "rb") as f:
+            indice = construir_indice_filas(iter(lambda: f.read(BLOQUE_DESCARGA_BYTES), b""), tipos_columnas_csv(ruta_tmp), validadores)
+    finally:
+        os.remove(ruta_tmp)
+    guardar_indice_filas(indice, archivo_url)
+    ruta_local = _ruta_local_indice(archivo_url)
+    os.makedirs(os.path.dirname(ruta_local), exist_ok=True)
+    with open(f"{ruta_local}.{os.getpid()}.tmp", "w") as f: json.dump(indice, f)
+    os.replace(f"{ruta_local}.{os.getpid()}.tmp", ruta_local)
+    return indice
+
+def obtener_indice_filas(archivo_url: str) -> dict:
+    """
+    Devuelve el índice de filas del CSV: la copia local revalidada contra el Storage (304 si no cambió)
+    o, si el dataset aún no tiene índice, lo construye una vez.
+    """
+    ruta_local = _ruta_local_indice(archivo_url)
+    try:
+        http_service.descargar_con_revalidacion(ruta_indice_filas(archivo_url), ruta_local)
+    except requests.exceptions.HTTPError:
+        return construir_indice_remoto(archivo_url) # Dataset registrado antes de existir los índices
+    with open(ruta_local) as f:
+        return json.load(f)
+
+def _leer_rango(archivo_url: str, indice: dict, inicio: int, cantidad: int):
+    """ Pide solo los bytes de las filas [inicio, inicio + cantidad). Devuelve el DataFrame o None si el CSV cambió. """
+    paso, offsets = indice["paso"], indice["offsets"]
+    bloque = inicio // paso
+    k_fin = -(-(inicio + cantidad) // paso) # ceil
+    byte_inicio = offsets[bloque]
+    byte_fin = offsets[k_fin] - 1 if k_fin < len(offsets) else indice["tamano"] - 1
+
+    validadores = indice.get("validadores") or {}
+    cabeceras = {"Range": f"bytes={byte_inicio}-{byte_fin}"}
+    # If-Range: si el CSV cambió desde que se construyó el índice, el servidor responde 200 en lugar de 206
+    if validadores.get("etag") or validadores.get("last_modified"):
+        cabeceras["If-Range"] = validadores.get("etag") or validadores.get("last_modified")
+    with http_service.get(archivo_url, headers=cabeceras, stream=True) as resp:
+        if resp.status_code != 206: return None
+        cuerpo = resp.content
+    http_service.registrar_bytes(archivo_url, descargados=len(cuerpo))
+
+    tipos = {c: (str if t == "str" else t) for c, t in indice.get("tipos", {}).items()}
+    # Se parsea desde el inicio del bloque indexado y se descartan las filas previas a `inicio`
+    desplazamiento = inicio - bloque * paso
+    df = pd.read_csv(io.BytesIO(indice["cabecera"].encode("utf-8") + cuerpo), dtype=tipos, nrows=desplazamiento + cantidad)
+    return df.iloc[desplazamiento:].reset_index(drop=True)
+
+def leer_filas_csv(archivo_url: str, inicio: int, cantidad: int, indice: dict = None):
+    """
+    Lee las filas [inicio, inicio + cantidad) del CSV sin descargarlo entero: con el índice de offsets
+    se pide por HTTP Range solo el tramo necesario. Devuelve (df_filas, total_filas), con df_filas None
+    si el servidor no admite rangos.
+    """
+    indice = indice or obtener_indice_filas(archivo_url)
+    for intento in range(2):
+        cantidad_valida = min(cantidad, indice["total_filas"] - inicio)
+        if cantidad_valida <= 0:
+            return pd.DataFrame(columns=list(indice.get("tipos", {}).keys())), indice["total_filas"]
+        df = _leer_rango(archivo_url, indice, inicio, cantidad_valida)
+        if df is not None: return df, indice["total_filas"]
+        if intento == 0:
+            indice = construir_indice_remoto(archivo_url) # El CSV cambió: reconstruir el índice y reintentar
+    return None, indice["total_filas"]
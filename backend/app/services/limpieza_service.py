@@ -5,6 +5,12 @@ from datetime import datetime
 from app.services.supabase_service import supabase
 # Importamos OBTENER_DATAFRAME_CRUDO, que SÍ se necesita
 from app.services.analisis_service import obtener_dataframe_crudo 
+from app.services.cache_service import dataset_cache
+from app.services.datasets_service import guardar_version_columnar
+from app.services.perfil_service import generar_perfil_dataset
+from app.services.cuantiles_service import generar_cuantiles_dataset
+from app.services.momentos_service import generar_momentos_dataset
+from app.services.cubo_service import generar_cubo_dataset
 # (Se eliminó la importación rota de 'NULL_REPRESENTATION')
 
 def limpiar_dataset(dataset_id: str, operaciones: dict):
@@ -13,7 +19,8 @@ def limpiar_dataset(dataset_id: str, operaciones: dict):
     con las estadísticas (ResultadoLimpieza).
     """
     try:
-        df_original = obtener_dataframe_crudo(dataset_id)
+        # Sin compactar: la versión limpia se guarda con los tipos originales
+        df_original = obtener_dataframe_crudo(dataset_id, compactar=False)
         if df_original.empty:
             raise ValueError("El dataset original está vacío, no se puede limpiar.")
             
@@ -83,6 +90,17 @@ def limpiar_dataset(dataset_id: str, operaciones: dict):
         archivo_url_res = bucket.get_public_url(nombre_archivo)
         if not archivo_url_res:
             raise Exception("No se pudo obtener la URL pública del archivo limpio.")
+
+        # Copia columnar del dataset limpio (las lecturas posteriores evitan parsear el CSV)
+        guardar_version_columnar(df_limpio, archivo_url_res)
+        # Perfil precalculado para /estadisticas, /columnas y /distribucion-clases
+        generar_perfil_dataset(df_limpio, archivo_url_res)
+        # Sketches de cuantiles para los boxplots y la segmentación aproximados
+        generar_cuantiles_dataset(df_limpio, archivo_url_res)
+        # Momentos por pares para la correlación y la sensibilidad sin recorrer los datos
+        generar_momentos_dataset(df_limpio, archivo_url_res)
+        # Cubo zona × año × segmento para el mapa de calor, la serie temporal, la segmentación, el radar y el sankey
+        generar_cubo_dataset(df_limpio, archivo_url_res)
         
         # 4.3. Registrar el nuevo dataset en la tabla de Supabase (PostgreSQL)
         nuevo_dataset_data = {
@@ -102,6 +120,10 @@ def limpiar_dataset(dataset_id: str, operaciones: dict):
             
         dataset_limpio_creado = insert_response.data[0]
 
+        # 4.4. Invalidar la caché local: la limpieza genera una nueva versión de los datos
+        dataset_cache.invalidar(dataset_id)
+        dataset_cache.invalidar(dataset_limpio_creado['id'])
+
         # 5. Devolver la respuesta completa esperada por el frontend
         return {
             "mensaje": "Limpieza completada exitosamente.",
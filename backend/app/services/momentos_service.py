@@ -0,0 +1,239 @@
+import numpy as np
+import pandas as pd
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from app.config import Config
+from app.services.datasets_service import EXTENSION_MOMENTOS
+from app.services.lectura_service import LectorPorChunks, chunks_de
+from app.services.artefactos_service import guardar_artefacto, obtener_artefacto
+
+# =============================================================================
+# 1️⃣ Acumulador de Momentos por Pares (Welford/Chan)
+# =============================================================================
+class MomentosPareados:
+    """
+    Medias, varianzas y co-momentos de las columnas numéricas de un dataset, acumulados por chunks.
+
+    pandas calcula df.corr() con observaciones completas por pares (cada par (i, j) usa solo las filas
+    donde ambas columnas tienen valor), así que aquí se guardan matrices p×p indexadas por par:
+      n[i, j]     filas con i y j finitas
+      media[i, j] media de i sobre esas filas
+      m2[i, j]    suma de cuadrados de las desviaciones de i sobre esas filas
+      c[i, j]     co-momento Σ (x_i - media[i, j]) (x_j - media[j, i])
+    Cada chunk se resume con cuatro productos de matrices y se une al acumulado con las fórmulas de
+    Chan et al. (actualización por lotes de Welford), que son estables y asociativas: resúmenes
+    construidos en paralelo o por partes se combinan con combinar() y dan el mismo resultado.
+    """
+    def __init__(self):
+        self.columnas = []
+        self.n = np.zeros((0, 0))
+        self.media = np.zeros((0, 0))
+        self.m2 = np.zeros((0, 0))
+        self.c = np.zeros((0, 0))
+        self.infinitos = {}       # columna -> cantidad de valores ±inf (pandas devuelve std NaN)
+        self.no_numericas = set() # columnas que algún chunk leyó como texto (el frame completo no las trataría como numéricas)
+
+    def _ampliar(self, columnas: list):
+        """ Añade columnas nuevas con conteo cero (un chunk puede traer columnas que no tenían los anteriores). """
+        nuevas = [c for c in columnas if c not in self.columnas]
+        if not nuevas: return
+        p, q = len(self.columnas), len(self.columnas) + len(nuevas)
+        for nombre in ("n", "media", "m2", "c"):
+            matriz = np.zeros((q, q))
+            matriz[:p, :p] = getattr(self, nombre)
+            setattr(self, nombre, matriz)
+        self.columnas = self.columnas + nuevas
+
+    @classmethod
+    def desde_chunk(cls, chunk: pd.DataFrame) -> "MomentosPareados":
+        """ Resume un chunk: se centra con la media del propio chunk para no perder precisión. """
+        momentos = cls()
+        numericas = [c for c in chunk.columns if pd.api.types.is_numeric_dtype(chunk[c]) and not pd.api.types.is_bool_dtype(chunk[c])]
+        momentos.no_numericas = {c for c in chunk.columns if c not in numericas and not pd.api.types.is_bool_dtype(chunk[c])}
+        momentos._ampliar(numericas)
+        if not numericas or chunk.empty: return momentos
+
+        X = np.column_stack([chunk[c].to_numpy(dtype=np.float64, na_value=np.nan) for c in numericas])
+        finitos = np.isfinite(X)
+        momentos.infinitos = {c: int(v) for c, v in zip(numericas, np.isinf(X).sum(axis=0)) if v}
+        M = finitos.astype(np.float64)
+        conteos = M.sum(axis=0)
+        centro = np.divide(np.where(finitos, X, 0).sum(axis=0), conteos, out=np.zeros(len(numericas)), where=conteos > 0)
+        X0 = np.where(finitos, X - centro, 0.0)
+
+        n = M.T @ M          # n[i, j]: filas con i y j finitas
+        S = X0.T @ M         # S[i, j]: Σ (x_i - centro_i) sobre esas filas
+        Q = (X0 * X0).T @ M  # Q[i, j]: Σ (x_i - centro_i)² sobre esas filas
+        P = X0.T @ X0        # P[i, j]: Σ (x_i - centro_i)(x_j - centro_j) sobre esas filas
+        with np.errstate(invalid='ignore', divide='ignore'):
+            hay = n > 0
+            momentos.n = n
+            momentos.media = np.where(hay, centro[:, None] + S / n, 0.0)
+            momentos.m2 = np.where(hay, Q - S * S / n, 0.0)
+            momentos.c = np.where(hay, P - S * S.T / n, 0.0)
+        return momentos
+
+    def agregar(self, chunk: pd.DataFrame):
+        """ Añade un chunk (DataFrame) al acumulado. """
+        return self.combinar(MomentosPareados.desde_chunk(chunk))
+
+    def combinar(self, otro: "MomentosPareados"):
+        """ Une otro acumulado a este (fórmulas de Chan); el orden de los chunks no cambia el resultado. """
+        self._ampliar(otro.columnas)
+        idx = [self.columnas.index(c) for c in otro.columnas]
+        # El otro acumulado se lleva al orden de columnas de este (las que no tiene quedan con conteo cero)
+        nb, media_b, m2_b, c_b = (np.zeros_like(self.n) for _ in range(4))
+        rejilla = np.ix_(idx, idx)
+        nb[rejilla], media_b[rejilla], m2_b[rejilla], c_b[rejilla] = otro.n, otro.media, otro.m2, otro.c
+
+        na, n = self.n, self.n + nb
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = media_b - self.media
+            peso = np.where(n > 0, na * nb / n, 0.0)
+            self.media = np.where(n > 0, self.media + delta * nb / n, 0.0)
+            self.m2 = self.m2 + m2_b + delta * delta * peso
+            self.c = self.c + c_b + delta * delta.T * peso
+        self.n = n
+        for c, v in otro.infinitos.items():
+            self.infinitos[c] = self.infinitos.get(c, 0) + v
+        self.no_numericas |= otro.no_numericas
+        return self
+
+    # --- Estadísticos derivados ---
+    def numericas(self) -> list:
+        return [c for c in self.columnas if c not in self.no_numericas]
+
+    def std(self, col: str, dado: str = None) -> float:
+        """ Desviación típica (ddof=1) de `col` sobre las filas donde también `dado` es finita. NaN si hay < 2 valores. """
+        i = self.columnas.index(col); j = i if dado is None else self.columnas.index(dado)
+        if self.infinitos.get(col) and dado is None: return np.nan
+        return float(np.sqrt(max(self.m2[i, j], 0.0) / (self.n[i, j] - 1))) if self.n[i, j] > 1 else np.nan
+
+    def correlaciones(self, columnas: list) -> np.ndarray:
+        """ Matriz de Pearson por pares completos (como df.corr()); NaN donde no hay al menos 2 pares o varianza. """
+        idx = [self.columnas.index(c) for c in columnas]
+        rejilla = np.ix_(idx, idx)
+        n, m2, c = self.n[rejilla], np.clip(self.m2[rejilla], 0.0, None), self.c[rejilla]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = np.where(n > 1, c / np.sqrt(m2 * m2.T), np.nan)
+        return np.clip(corr, -1.0, 1.0)
+
+    def a_dict(self) -> dict:
+        return {
+            "columnas": self.columnas, "n": self.n.tolist(), "media": self.media.tolist(),
+            "m2": self.m2.tolist(), "c": self.c.tolist(),
+            "infinitos": self.infinitos, "no_numericas": sorted(self.no_numericas)
+        }
+
+    @classmethod
+    def desde_dict(cls, datos: dict) -> "MomentosPareados":
+        momentos = cls()
+        momentos.columnas = list(datos["columnas"])
+        p = len(momentos.columnas)
+        for nombre in ("n", "media", "m2", "c"):
+            setattr(momentos, nombre, np.array(datos[nombre], dtype=np.float64).reshape(p, p))
+        momentos.infinitos = dict(datos.get("infinitos", {}))
+        momentos.no_numericas = set(datos.get("no_numericas", []))
+        return momentos
+
+# =============================================================================
+# 2️⃣ Construcción por Chunks (en paralelo) y Persistencia junto al Dataset
+# =============================================================================
+def construir_momentos(chunks, max_hilos: int = None) -> MomentosPareados:
+    """
+    Resume cada chunk en un pool de hilos (los productos de matrices de numpy liberan el GIL) y combina
+    los resúmenes en orden. Solo hay `max_hilos` chunks en vuelo, así que la memoria no crece con el dataset.
+    """
+    max_hilos = max(1, max_hilos or Config.MOMENTOS_HILOS)
+    total = MomentosPareados()
+    with ThreadPoolExecutor(max_workers=max_hilos) as executor:
+        pendientes = deque()
+        for chunk in chunks:
+            pendientes.append(executor.submit(MomentosPareados.desde_chunk, chunk))
+            if len(pendientes) >= max_hilos: total.combinar(pendientes.popleft().result())
+        while pendientes: total.combinar(pendientes.popleft().result())
+    return total
+
+def _calcular_momentos_desde_lector(lector: LectorPorChunks) -> dict:
+    return {**construir_momentos(lector.iterar()).a_dict(), "fecha_generacion": datetime.utcnow().isoformat()}
+
+def _calcular_momentos_por_chunks(dataset_id: str) -> dict:
+    with LectorPorChunks(dataset_id) as lector:
+        return _calcular_momentos_desde_lector(lector)
+
+def guardar_momentos(momentos: dict, archivo_url: str) -> bool:
+    """ Sube los momentos al Storage junto al CSV. Devuelve False si no se pudo. """
+    return guardar_artefacto(momentos, archivo_url, EXTENSION_MOMENTOS, "momentos por pares")
+
+def generar_momentos_dataset(df: pd.DataFrame, archivo_url: str) -> dict:
+    """ Etapa de ingesta al limpiar: acumula los momentos por chunks y los guarda. No interrumpe el flujo si falla. """
+    try:
+        momentos = {**construir_momentos(chunks_de(df)).a_dict(), "fecha_generacion": datetime.utcnow().isoformat()}
+        guardar_momentos(momentos, archivo_url)
+        return momentos
+    except Exception as e:
+        print(f"⚠️ No se pudieron generar los momentos de {archivo_url}: {e}")
+        return None
+
+def generar_momentos_por_chunks(lector: LectorPorChunks, archivo_url: str) -> dict:
+    """ Etapa de ingesta al registrar: acumula los momentos con los chunks del lector y los guarda. No interrumpe el flujo si falla. """
+    try:
+        momentos = _calcular_momentos_desde_lector(lector)
+        guardar_momentos(momentos, archivo_url)
+        return momentos
+    except Exception as e:
+        print(f"⚠️ No se pudieron generar los momentos de {archivo_url}: {e}")
+        return None
+
+def obtener_momentos(dataset_id: str) -> MomentosPareados:
+    """
+    Devuelve los momentos guardados del dataset (copia local revalidada con un GET condicional).
+    Si el dataset se registró sin ellos, los acumula por chunks la primera vez que se piden.
+    """
+    datos = obtener_artefacto(dataset_id, EXTENSION_MOMENTOS, "momentos", _calcular_momentos_por_chunks, "momentos por pares")
+    return MomentosPareados.desde_dict(datos)
+
+# =============================================================================
+# 3️⃣ Correlación y Sensibilidad sin Recorrer los Datos
+# =============================================================================
+def calcular_correlacion_momentos(dataset_id: str) -> dict:
+    """ Mismo resultado que calcular_correlacion(df) pero a partir de los momentos guardados. """
+    try:
+        momentos = obtener_momentos(dataset_id)
+        # Igual que df_numerico.std() > 1e-9: fuera columnas constantes, vacías o con infinitos
+        variables = [c for c in momentos.numericas() if momentos.std(c) > 1e-9]
+        if not variables: return {"variables": [], "matriz": []}
+        matriz = np.nan_to_num(np.round(momentos.correlaciones(variables), 4), nan=0.0)
+        return {"variables": variables, "matriz": matriz.tolist()}
+    except Exception as e:
+        print(f"🚨 [ERROR] en calcular_correlacion_momentos: {e}")
+        raise RuntimeError("No se pudo calcular la matriz de correlación.") from e
+
+def generar_analisis_sensibilidad_momentos(dataset_id: str, target_col: str = 'precio') -> list:
+    """
+    Mismo resultado que generar_analisis_sensibilidad(dataset_id) a partir de los momentos guardados:
+    allí cada columna se compara con el precio en las filas con precio finito, que son justo los pares (col, precio).
+    """
+    print(f"-> generando_analisis_sensibilidad (momentos) para dataset {dataset_id}")
+    try:
+        momentos = obtener_momentos(dataset_id)
+        if target_col not in momentos.numericas(): raise ValueError(f"Columna '{target_col}' inválida.")
+        t = momentos.columnas.index(target_col)
+        sensibilidad_data = []
+        for col in momentos.numericas():
+            if col == target_col: continue
+            i = momentos.columnas.index(col)
+            std = momentos.std(col, dado=target_col)
+            if not std > 1e-9: continue
+            corr = float(momentos.correlaciones([col, target_col])[0, 1]); media = momentos.media[i, t]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                vol = abs(std / media) * 100 if media else np.inf
+            impact = abs(corr) * 100
+            sensibilidad_data.append({"variable": col, "impacto_precio": round(impact, 1) if np.isfinite(impact) else 0, "volatilidad": round(vol, 1) if np.isfinite(vol) else 0, "correlacion": round(corr, 3) if np.isfinite(corr) else 0})
+        if not sensibilidad_data: print("⚠️ No hay vars numéricas válidas."); return []
+        sensibilidad_data.sort(key=lambda x: x['impacto_precio'], reverse=True)
+        return sensibilidad_data[:10]
+    except Exception as e:
+        print(f"🚨 ERROR en generar_analisis_sensibilidad_momentos: {e}")
+        return []
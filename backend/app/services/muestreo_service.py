@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+from app.config import Config
+
+# =============================================================================
+# 1️⃣ Reducción de Puntos para Gráficos (muestra, rejilla/vóxeles, estratificada)
+# =============================================================================
+# Los gráficos de dispersión, 3D y burbujas nunca necesitan más puntos de los que el navegador puede
+# dibujar. Cada modo elige a lo sumo `presupuesto` filas reales y devuelve cuántas filas del dataset
+# representa cada una ("densidad"), para poder dimensionar los puntos por densidad.
+MODOS_REDUCCION = ("muestra", "rejilla", "estratificado")
+
+def validar_reduccion(modo: str, puntos: int, estratificable: bool = True) -> tuple:
+    """ Normaliza y valida los parámetros de reducción (lanza ValueError para que la ruta responda 400). """
+    modo = (modo or "muestra").lower()
+    if modo not in MODOS_REDUCCION: raise ValueError(f"Modo '{modo}' no válido. Opciones: {list(MODOS_REDUCCION)}")
+    if modo == "estratificado" and not estratificable: raise ValueError("Este gráfico no tiene una columna categórica para estratificar.")
+    if puntos is not None and not 1 <= puntos <= Config.GRAFICOS_MAX_PUNTOS:
+        raise ValueError(f"'puntos' debe estar entre 1 y {Config.GRAFICOS_MAX_PUNTOS}.")
+    return modo, puntos
+
+def _ids_celdas(U: np.ndarray, divisiones: int) -> np.ndarray:
+    """ Celda de la rejilla (divisiones^d) de cada fila de U (valores normalizados a [0, 1]). """
+    indices = np.minimum((U * divisiones).astype(np.int64), divisiones - 1)
+    return np.ravel_multi_index(tuple(indices.T), (divisiones,) * U.shape[1])
+
+def reducir_por_rejilla(X: np.ndarray, presupuesto: int, semilla: int = 42) -> tuple:
+    """
+    Divide el rango de cada columna en la mayor cantidad de intervalos que deje a lo sumo `presupuesto`
+    celdas ocupadas (búsqueda binaria) y se queda con una fila al azar por celda. Conserva la forma de la
+    nube (zonas poco densas y extremos) mejor que una muestra uniforme. Devuelve (posiciones, filas por celda).
+    """
+    n, d = X.shape
+    if n <= presupuesto: return np.arange(n), np.ones(n, dtype=np.int64)
+    finitos = np.where(np.isfinite(X), X, np.nan)
+    with np.errstate(invalid='ignore'):
+        minimo = np.nan_to_num(np.nanmin(finitos, axis=0)); rango = np.nan_to_num(np.nanmax(finitos, axis=0)) - minimo
+        # ±inf quedan en la primera/última celda y los NaN en la primera
+        U = np.nan_to_num(np.clip((X - minimo) / np.where(rango > 0, rango, 1), 0, 1), nan=0.0)
+
+    # Con datos concentrados hay muchas celdas vacías: se buscan hasta 8 veces más divisiones que en una rejilla uniforme
+    inferior, superior = 1, min(int(np.ceil(presupuesto ** (1 / d))) * 8, int(2 ** (62 / d)))
+    mejor = np.zeros(n, dtype=np.int64) # 1 división = 1 celda (siempre cabe)
+    while inferior <= superior:
+        divisiones = (inferior + superior) // 2
+        celdas = _ids_celdas(U, divisiones)
+        if len(pd.unique(celdas)) <= presupuesto: mejor, inferior = celdas, divisiones + 1
+        else: superior = divisiones - 1
+
+    # Representante al azar: la primera fila de cada celda tras una permutación
+    orden = np.random.default_rng(semilla).permutation(n)
+    _, primera, conteos = np.unique(mejor[orden], return_index=True, return_counts=True)
+    posiciones = orden[primera]
+    ordenadas = np.argsort(posiciones)
+    return posiciones[ordenadas], conteos[ordenadas]
+
+def reducir_estratificado(estratos: pd.Series, presupuesto: int, semilla: int = 42) -> tuple:
+    """
+    Reparte el presupuesto entre los estratos (p. ej. zonas) en proporción a su tamaño, con al menos un
+    punto por estrato mientras alcance, y muestrea al azar dentro de cada uno. Devuelve (posiciones, filas que representa cada punto).
+    """
+    n = len(estratos)
+    if n <= presupuesto: return np.arange(n), np.ones(n)
+    codigos, _ = pd.factorize(estratos, use_na_sentinel=False)
+    tamanos = np.bincount(codigos)
+    # Cuotas por restos mayores: primero un punto a cada estrato (los más grandes si no alcanza), luego los restos
+    ideal = presupuesto * tamanos / n
+    cuotas = np.floor(ideal).astype(np.int64)
+    prioridad = np.lexsort((-(ideal - cuotas), -tamanos, cuotas > 0))
+    cuotas[prioridad[:presupuesto - int(cuotas.sum())]] += 1
+    rng = np.random.default_rng(semilla)
+    posiciones, densidad = [], []
+    for codigo in np.flatnonzero(cuotas):
+        cuota = int(min(cuotas[codigo], tamanos[codigo]))
+        elegidas = rng.choice(np.flatnonzero(codigos == codigo), size=cuota, replace=False)
+        posiciones.append(elegidas); densidad.append(np.full(cuota, tamanos[codigo] / cuota))
+    posiciones, densidad = np.concatenate(posiciones), np.concatenate(densidad)
+    ordenadas = np.argsort(posiciones)
+    return posiciones[ordenadas], densidad[ordenadas]
+
+def reducir_puntos(X: np.ndarray, modo: str, presupuesto: int, estratos: pd.Series = None) -> tuple:
+    """
+    Posiciones de las filas a dibujar y la densidad (filas del dataset que representa cada punto).
+    "muestra" reproduce df.sample(n=presupuesto, random_state=42).
+    """
+    n = len(X)
+    if modo == "rejilla": return reducir_por_rejilla(X, presupuesto)
+    if modo == "estratificado": return reducir_estratificado(estratos, presupuesto)
+    k = min(n, presupuesto)
+    posiciones = np.random.RandomState(42).choice(n, size=k, replace=False) # Con k == n también baraja, como pandas
+    return posiciones, np.full(k, n / k if k else 0.0)
+
+def escalar_tamanos(valores, minimo: int = 100, maximo: int = 1000) -> list:
+    """ Lleva los valores al rango [minimo, maximo] para el tamaño de las burbujas (NaN o rango nulo -> minimo). """
+    valores = np.asarray(valores, dtype=np.float64)
+    finitos = valores[np.isfinite(valores)]
+    min_s, max_s = (finitos.min(), finitos.max()) if finitos.size else (1, 1)
+    rango = max_s - min_s
+    return [int(minimo + ((v - min_s) / rango) * (maximo - minimo)) if np.isfinite(v) and rango > 0 else minimo for v in valores.tolist()]
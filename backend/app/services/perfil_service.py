@@ -0,0 +1,81 @@
+import pandas as pd
+from datetime import datetime
+from app.services.datasets_service import EXTENSION_PERFIL
+from app.services.artefactos_service import guardar_artefacto, obtener_artefacto
+from app.services.analisis_service import (
+    estadisticas_dataset,
+    obtener_columnas,
+    distribucion_clases,
+    LectorPorChunks,
+    estadisticas_dataset_por_chunks,
+    obtener_columnas_por_chunks
+)
+
+# =============================================================================
+# 1️⃣ Cálculo del Perfil de un Dataset
+# =============================================================================
+# El perfil reúne lo que sirven /estadisticas, /columnas y /distribucion-clases.
+# Se calcula una vez (al registrar o limpiar el dataset) y se guarda en el Storage junto
+# al CSV, así esas rutas no vuelven a recorrer los datos en cada petición.
+
+def calcular_perfil(df: pd.DataFrame) -> dict:
+    """ Perfil completo a partir del DataFrame ya cargado (filas, nulos, únicos, momentos, duplicados...). """
+    return {
+        "estadisticas": estadisticas_dataset(df),
+        "columnas": obtener_columnas(df),
+        "distribucion_clases": distribucion_clases(df),
+        "fecha_generacion": datetime.utcnow().isoformat()
+    }
+
+def calcular_perfil_desde_lector(lector: LectorPorChunks) -> dict:
+    """ Igual que calcular_perfil pero recorriendo los datos del lector por chunks (no los carga enteros). """
+    estadisticas = estadisticas_dataset_por_chunks(lector)
+    columnas = obtener_columnas_por_chunks(lector)
+    # distribucion_clases usa la última columna: se acumula value_counts por chunk (en orden de aparición)
+    conteos = {}
+    for chunk in lector.iterar():
+        if chunk.shape[1] == 0: break
+        for clase, cantidad in chunk[chunk.columns[-1]].value_counts(sort=False).items():
+            conteos[clase] = conteos.get(clase, 0) + int(cantidad)
+    orden = sorted(conteos.items(), key=lambda item: -item[1]) # sorted es estable, como value_counts
+    distribucion = [{"clase": str(clase), "cantidad": int(cantidad)} for clase, cantidad in orden]
+    return {"estadisticas": estadisticas, "columnas": columnas, "distribucion_clases": distribucion, "fecha_generacion": datetime.utcnow().isoformat()}
+
+def calcular_perfil_por_chunks(dataset_id: str) -> dict:
+    """ Perfil de un dataset ya registrado, leyéndolo por chunks. """
+    with LectorPorChunks(dataset_id) as lector:
+        return calcular_perfil_desde_lector(lector)
+
+# =============================================================================
+# 2️⃣ Persistencia del Perfil (Storage + copia local revalidada)
+# =============================================================================
+def guardar_perfil(perfil: dict, archivo_url: str) -> bool:
+    """ Sube el perfil al Storage junto al CSV. Devuelve False si no se pudo. """
+    return guardar_artefacto(perfil, archivo_url, EXTENSION_PERFIL, "el perfil")
+
+def generar_perfil_dataset(df: pd.DataFrame, archivo_url: str) -> dict:
+    """ Etapa de perfilado al limpiar: calcula el perfil y lo guarda. No interrumpe el flujo si falla. """
+    try:
+        perfil = calcular_perfil(df)
+        guardar_perfil(perfil, archivo_url)
+        return perfil
+    except Exception as e:
+        print(f"⚠️ No se pudo generar el perfil de {archivo_url}: {e}")
+        return None
+
+def generar_perfil_por_chunks(lector: LectorPorChunks, archivo_url: str) -> dict:
+    """ Etapa de perfilado al registrar: calcula el perfil por chunks y lo guarda. No interrumpe el flujo si falla. """
+    try:
+        perfil = calcular_perfil_desde_lector(lector)
+        guardar_perfil(perfil, archivo_url)
+        return perfil
+    except Exception as e:
+        print(f"⚠️ No se pudo generar el perfil de {archivo_url}: {e}")
+        return None
+
+def obtener_perfil(dataset_id: str) -> dict:
+    """
+    Devuelve el perfil guardado del dataset (copia local revalidada con un GET condicional).
+    Si el dataset se registró sin él, lo calcula por chunks la primera vez que se pide.
+    """
+    return obtener_artefacto(dataset_id, EXTENSION_PERFIL, "perfiles", calcular_perfil_por_chunks, "el perfil")
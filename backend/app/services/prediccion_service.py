@@ -4,11 +4,18 @@ import torch.nn as nn
 import pandas as pd
 import numpy as np
 import io
+import os
 import json
 import datetime # <- CAMBIO: Importar datetime para calcular antigüedad
+from app.config import Config
 from app.services.supabase_service import supabase
+from app.services import http_service
 from app.services.entrenamiento_service import NeuralNet
 from app.services.entrenamiento_service import ARTEFACTOS_BUCKET_NAME
+from app.services.cache_service import CacheEnMemoria
+
+# Modelos de experimentos ya cargados en este worker (predicción y sensibilidad por modelo)
+modelos_experimentos = CacheEnMemoria("modelos_experimentos", Config.MODELOS_CACHE_ENTRADAS)
 
 # --- INICIO DE LA NUEVA LÓGICA DE NEGOCIO ---
 
@@ -203,7 +210,15 @@ def cargar_artefacto_desde_storage(path_in_bucket: str):
     """Descarga un artefacto (modelo, scaler) desde Supabase Storage."""
     try:
         print(f"   -> Descargando artefacto desde: {ARTEFACTOS_BUCKET_NAME}/{path_in_bucket}")
-        storage_response = supabase.storage.from_(ARTEFACTOS_BUCKET_NAME).download(path_in_bucket)
+        # Copia local revalidada con GET condicional: si el artefacto no cambió, el Storage responde 304
+        ruta_local = os.path.join(Config.DATASET_CACHE_DIR, "artefactos", ARTEFACTOS_BUCKET_NAME, path_in_bucket)
+        try:
+            url = supabase.storage.from_(ARTEFACTOS_BUCKET_NAME).get_public_url(path_in_bucket)
+            with open(http_service.descargar_con_revalidacion(url, ruta_local), "rb") as f:
+                storage_response = f.read()
+        except Exception as e_http:
+            print(f"   -> Descarga HTTP no disponible ({e_http}), usando el cliente de Storage.")
+            storage_response = supabase.storage.from_(ARTEFACTOS_BUCKET_NAME).download(path_in_bucket)
         if not storage_response:
             raise FileNotFoundError(f"No se pudo descargar el artefacto en la ruta: {path_in_bucket}")
 
@@ -225,12 +240,35 @@ def cargar_artefacto_desde_storage(path_in_bucket: str):
         raise FileNotFoundError(f"Fallo al cargar {path_in_bucket}: {e}")
 
 
-def realizar_prediccion_casa(experimento_id: str, datos_casa: dict) -> dict:
+def _cargar_modelo(model_type: str, model_path: str, artefactos_info: dict):
+    """ Reconstruye la red neuronal (state_dict) o carga el modelo Sklearn guardado en `model_path`. """
+    if model_type == 'red_neuronal':
+        state_dict_buffer = cargar_artefacto_desde_storage(model_path)
+        nn_input_size = artefactos_info.get('nn_input_size')
+        nn_num_classes = artefactos_info.get('nn_num_classes')
+        nn_is_regression = artefactos_info.get('nn_is_regression')
+        if None in [nn_input_size, nn_num_classes, nn_is_regression]:
+            raise ValueError("Falta información para reconstruir la Red Neuronal.")
+
+        modelo = NeuralNet(nn_input_size, nn_num_classes, is_regression=nn_is_regression)
+        modelo.load_state_dict(torch.load(state_dict_buffer, map_location=torch.device('cpu')))
+        modelo.eval()
+        return modelo
+    if model_type == 'regresion':
+        return cargar_artefacto_desde_storage(model_path)
+    raise ValueError(f"Tipo de modelo '{model_type}' no soportado para predicción.")
+
+def cargar_modelo_experimento(experimento_id: str) -> dict:
     """
-    Carga el modelo, preprocesa, predice y llama a la lógica de negocio
-    para devolver el análisis completo.
+    Lee el experimento y carga sus artefactos desde Storage. Los artefactos de un experimento no cambian,
+    así que el resultado se guarda en memoria por ID. Devuelve {"model_type", "modelo", "scaler_x",
+    "scaler_y", "label_encoder", "columnas" (orden del scaler), "columnas_entrada", "metricas", "importancia_features",
+    "ensamble" [(modelo, scaler_x) de cada pliegue, o None]}.
     """
-    print(f"🚀 Predicción solicitada para experimento: {experimento_id}")
+    cargado = modelos_experimentos.obtener(experimento_id)
+    if cargado is not None:
+        print(f"-> Modelo del experimento {experimento_id} ya cargado en memoria.")
+        return cargado
 
     # --- 1. Obtener información del experimento (AHORA INCLUYE 'metricas') ---
     exp_res = supabase.table("experimentos").select(
@@ -242,10 +280,10 @@ def realizar_prediccion_casa(experimento_id: str, datos_casa: dict) -> dict:
 
     experimento_data = exp_res.data
     try:
-        configuracion = json.loads(experimento_data.get('configuracion', '{}'))
-        artefactos_info = json.loads(experimento_data.get('artefactos_info', '{}'))
-        importancia_features_guardada = json.loads(experimento_data.get('importancia_features', '[]')) or []
-        metricas_modelo = json.loads(experimento_data.get('metricas', '{}')) # <- CAMBIO: cargar metricas
+        configuracion = json.loads(experimento_data.get('configuracion') or '{}')
+        artefactos_info = json.loads(experimento_data.get('artefactos_info') or '{}')
+        importancia_features_guardada = json.loads(experimento_data.get('importancia_features') or '[]') or []
+        metricas_modelo = json.loads(experimento_data.get('metricas') or '{}') # <- CAMBIO: cargar metricas
 
         if not artefactos_info or 'error' in artefactos_info or 'urls' not in artefactos_info:
             raise ValueError(f"Información de artefactos inválida o faltante para el experimento {experimento_id}. Error: {artefactos_info.get('error', 'No hay URLs')}")
@@ -270,24 +308,65 @@ def realizar_prediccion_casa(experimento_id: str, datos_casa: dict) -> dict:
     scaler_y = cargar_artefacto_desde_storage(scaler_y_path) if scaler_y_path else None
     label_encoder = cargar_artefacto_desde_storage(le_path) if le_path else None
 
-    modelo = None
-    if model_type == 'red_neuronal':
-        state_dict_buffer = cargar_artefacto_desde_storage(model_path)
-        nn_input_size = artefactos_info.get('nn_input_size')
-        nn_num_classes = artefactos_info.get('nn_num_classes')
-        nn_is_regression = artefactos_info.get('nn_is_regression')
-        if None in [nn_input_size, nn_num_classes, nn_is_regression]:
-            raise ValueError("Falta información para reconstruir la Red Neuronal.")
+    modelo = _cargar_modelo(model_type, model_path, artefactos_info)
+    print("-> Modelo PyTorch cargado y reconstruido." if model_type == 'red_neuronal' else "-> Modelo Sklearn cargado.")
+
+    # Ensamble de validación cruzada: cada pliegue con su propio scaler_x
+    ensamble = [
+        (_cargar_modelo(model_type, miembro['model_path'], artefactos_info), cargar_artefacto_desde_storage(miembro['scaler_x_path']))
+        for miembro in artefactos_info.get('ensamble') or []
+    ] or None
+    if ensamble: print(f"-> Ensamble de {len(ensamble)} modelos de pliegues cargado.")
+
+    columnas_scaler = list(scaler_x.feature_names_in_) if hasattr(scaler_x, 'feature_names_in_') else list(columnas_entrenamiento)
+    cargado = {
+        "model_type": model_type, "modelo": modelo, "scaler_x": scaler_x, "scaler_y": scaler_y,
+        "label_encoder": label_encoder, "columnas": columnas_scaler, "columnas_entrada": configuracion.get('columnas_entrada', []),
+        "metricas": metricas_modelo, "importancia_features": importancia_features_guardada, "ensamble": ensamble
+    }
+    modelos_experimentos.guardar(experimento_id, cargado)
+    return cargado
 
-        modelo = NeuralNet(nn_input_size, nn_num_classes, is_regression=nn_is_regression)
-        modelo.load_state_dict(torch.load(state_dict_buffer, map_location=torch.device('cpu')))
-        modelo.eval()
-        print("-> Modelo PyTorch cargado y reconstruido.")
-    elif model_type == 'regresion':
-        modelo = cargar_artefacto_desde_storage(model_path)
-        print("-> Modelo Sklearn cargado.")
-    else:
-        raise ValueError(f"Tipo de modelo '{model_type}' no soportado para predicción.")
+
+def predecir_lote(cargado: dict, X_scaled: np.ndarray, probabilidad: bool = False) -> np.ndarray:
+    """
+    Predicción vectorizada sobre filas ya escaladas con scaler_x: en regresión, valores en la escala
+    original del objetivo; con `probabilidad=True` (clasificación binaria), la probabilidad de la clase positiva.
+    Con ensamble, promedia los modelos de los pliegues (voto mayoritario si predicen clases).
+    """
+    if cargado.get("ensamble"):
+        # Las filas llegan escaladas con el scaler principal: se vuelven a la escala original y se reescalan por pliegue
+        X_original = cargado["scaler_x"].inverse_transform(np.asarray(X_scaled))
+        salidas = np.array([
+            predecir_lote({**cargado, "modelo": modelo, "ensamble": None}, scaler_x.transform(X_original), probabilidad=probabilidad)
+            for modelo, scaler_x in cargado["ensamble"]
+        ])
+        if cargado["model_type"] == 'regresion' and cargado["label_encoder"] is not None and not probabilidad:
+            return np.array([np.bincount(columna).argmax() for columna in salidas.astype(np.int64).T])
+        return salidas.mean(axis=0)
+    modelo = cargado["modelo"]
+    if cargado["model_type"] == 'red_neuronal':
+        with torch.no_grad():
+            salida = modelo(torch.tensor(np.asarray(X_scaled), dtype=torch.float32))
+        if probabilidad: return torch.sigmoid(salida).numpy().flatten()
+        pred_scaled = salida.numpy().flatten() # Asumir regresión
+        if cargado["scaler_y"]: return cargado["scaler_y"].inverse_transform(pred_scaled.reshape(-1, 1)).flatten()
+        return pred_scaled
+    if probabilidad: return modelo.predict_proba(X_scaled)[:, 1]
+    # Asumir que 'y' no se escaló para modelos sklearn
+    return modelo.predict(X_scaled)
+
+
+def realizar_prediccion_casa(experimento_id: str, datos_casa: dict) -> dict:
+    """
+    Carga el modelo, preprocesa, predice y llama a la lógica de negocio
+    para devolver el análisis completo.
+    """
+    print(f"🚀 Predicción solicitada para experimento: {experimento_id}")
+
+    cargado = cargar_modelo_experimento(experimento_id)
+    scaler_x, metricas_modelo = cargado["scaler_x"], cargado["metricas"]
+    importancia_features_guardada = cargado["importancia_features"]
 
     # --- 3. Preprocesar datos de entrada ---
     print("-> Preprocesando datos de entrada...")
@@ -295,7 +374,7 @@ def realizar_prediccion_casa(experimento_id: str, datos_casa: dict) -> dict:
         # El frontend envía 'datos_casa' con las claves correctas
         # Necesitamos asegurarnos de que el DataFrame tenga el mismo orden de columnas que 'columnas_entrenamiento'
         datos_procesados = {}
-        columnas_scaler = scaler_x.feature_names_in_ if hasattr(scaler_x, 'feature_names_in_') else columnas_entrenamiento
+        columnas_scaler = cargado["columnas"]
         
         for col in columnas_scaler:
             if col in datos_casa:
@@ -321,25 +400,8 @@ def realizar_prediccion_casa(experimento_id: str, datos_casa: dict) -> dict:
 
     # --- 4. Realizar Predicción ---
     print("-> Realizando predicción...")
-    prediccion_final = None
-
-    if model_type == 'red_neuronal':
-        input_tensor = torch.tensor(input_scaled, dtype=torch.float32)
-        with torch.no_grad():
-            output_scaled = modelo(input_tensor)
-            pred_scaled = output_scaled.numpy().flatten()[0] # Asumir regresión
-
-            if scaler_y:
-                 prediccion_final = scaler_y.inverse_transform([[pred_scaled]])[0][0]
-                 print(f"   Predicción NN escalada: {pred_scaled}, Desescalada: {prediccion_final}")
-            else:
-                 prediccion_final = pred_scaled
-                 print(f"   Predicción NN (no desescalada): {prediccion_final}")
-
-    elif model_type == 'regresion':
-        prediccion_final = modelo.predict(input_scaled)[0]
-        # Asumir que 'y' no se escaló para modelos sklearn
-        print(f"   Predicción Sklearn: {prediccion_final}")
+    prediccion_final = predecir_lote(cargado, input_scaled)[0]
+    print(f"   Predicción ({cargado['model_type']}): {prediccion_final}")
 
     if prediccion_final is None:
          raise Exception("La predicción no pudo ser calculada.")
@@ -0,0 +1,37 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from app.config import Config
+
+# =============================================================================
+# 1️⃣ Pool de Procesos Compartido (trabajo de CPU fuera del GIL)
+# =============================================================================
+# El barrido de k del clustering y el análisis de sensibilidad (trabajo de CPU que no libera el GIL) se
+# reparten en un único pool por worker, acotado por Config.PROCESOS_MAX para no saturar la máquina.
+# Se usa 'spawn': hacer fork de un proceso con hilos (Flask, gunicorn, BLAS) puede heredar locks tomados.
+
+_pool = None
+_lock = threading.Lock()
+
+def pool_procesos() -> ProcessPoolExecutor:
+    """ Devuelve el pool compartido (lo crea la primera vez o si un proceso hijo murió y lo dejó roto). """
+    global _pool
+    with _lock:
+        if _pool is None or getattr(_pool, "_broken", False):
+            _pool = ProcessPoolExecutor(max_workers=max(1, Config.PROCESOS_MAX), mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def mapear_en_procesos(funcion, argumentos: list) -> list:
+    """
+    Ejecuta funcion(*args) para cada tupla de `argumentos` en el pool y devuelve los resultados en orden.
+    Si el pool está roto se recrea y se reintenta una vez.
+    """
+    for intento in range(2):
+        try:
+            futuros = [pool_procesos().submit(funcion, *args) for args in argumentos]
+            return [f.result() for f in futuros]
+        except BrokenProcessPool:
+            if intento: raise
+            print(f"⚠️ Pool de procesos roto (pid {os.getpid()}): recreándolo")
@@ -0,0 +1,175 @@
+import os
+import time
+import tempfile
+import joblib
+import numpy as np
+import pandas as pd
+from app.config import Config
+from app.services.cache_service import CacheEnMemoria
+from app.services.procesos_service import mapear_en_procesos
+from app.services.analisis_service import obtener_dataframe_crudo
+from app.services.prediccion_service import cargar_modelo_experimento, predecir_lote
+
+METODOS_SENSIBILIDAD = ("pd", "oat")
+
+# Modelos abiertos por cada proceso del pool (por ruta del volcado, que depende solo del experimento)
+_modelos_en_proceso = CacheEnMemoria("modelos_sensibilidad_proceso", Config.MODELOS_CACHE_ENTRADAS)
+
+# =============================================================================
+# 1️⃣ Datos de Fondo y Rejillas (mismo preprocesado que el entrenamiento)
+# =============================================================================
+def preparar_matriz_modelo(df: pd.DataFrame, columnas_modelo: list) -> pd.DataFrame:
+    """
+    Repite el preprocesado de iniciar_nuevo_entrenamiento (medias en numéricas, dummies con drop_first)
+    y ordena las columnas como el scaler del experimento; las dummies ausentes quedan en 0.
+    """
+    df = df.copy()
+    for col in df.select_dtypes(include=np.number).columns:
+        if df[col].isnull().sum() > 0: df[col] = df[col].fillna(df[col].mean())
+    columnas_categoricas = [col for col in df.columns if df[col].dtype == 'object' or isinstance(df[col].dtype, pd.CategoricalDtype)]
+    if columnas_categoricas: df = pd.get_dummies(df, columns=columnas_categoricas, drop_first=True)
+    return df.reindex(columns=columnas_modelo, fill_value=0).apply(pd.to_numeric, errors='coerce').fillna(0).astype(np.float64)
+
+def rejilla_variable(valores: np.ndarray, puntos: int) -> np.ndarray:
+    """ Valores donde se evalúa la curva: los distintos si son pocos (dummies, habitaciones) o cuantiles 2%-98%. """
+    valores = valores[np.isfinite(valores)]
+    if valores.size == 0: return np.zeros(1)
+    distintos = np.unique(valores)
+    if len(distintos) <= puntos: return distintos
+    return np.unique(np.quantile(valores, np.linspace(0.02, 0.98, puntos)))
+
+# =============================================================================
+# 2️⃣ Curvas con una Predicción Vectorizada por Bloque
+# =============================================================================
+def curvas_bloque(cargado: dict, X_fondo: np.ndarray, tareas: list, probabilidad: bool) -> list:
+    """
+    Para cada tarea (índice de columna, rejilla) repite las filas de fondo con la columna fijada en cada
+    valor de la rejilla; todas las variables y puntos del bloque van en una sola llamada a predict.
+    Devuelve, por tarea, la predicción media de cada punto (dependencia parcial; con una fila, OAT).
+    """
+    n, d = X_fondo.shape
+    total = sum(len(rejilla) for _, rejilla in tareas)
+    X = np.empty((total * n, d), dtype=np.float64)
+    inicio = 0
+    for j, rejilla in tareas:
+        bloque = X[inicio:inicio + len(rejilla) * n]
+        bloque.reshape(len(rejilla), n, d)[:] = X_fondo
+        bloque[:, j] = np.repeat(rejilla, n)
+        inicio += len(rejilla) * n
+    X_scaled = cargado["scaler_x"].transform(pd.DataFrame(X, columns=cargado["columnas"]))
+    predicciones = np.asarray(predecir_lote(cargado, X_scaled, probabilidad=probabilidad), dtype=np.float64)
+
+    curvas, inicio = [], 0
+    for _, rejilla in tareas:
+        fin = inicio + len(rejilla) * n
+        curvas.append(predicciones[inicio:fin].reshape(len(rejilla), n).mean(axis=1).tolist())
+        inicio = fin
+    return curvas
+
+def _evaluar_bloque(ruta_modelo: str, ruta_fondo: str, tareas: list, probabilidad: bool) -> list:
+    """ Se ejecuta en un proceso del pool: el modelo se abre una vez por proceso y el fondo con memory-map. """
+    cargado = _modelos_en_proceso.obtener(ruta_modelo)
+    if cargado is None:
+        cargado = joblib.load(ruta_modelo)
+        # Un proceso por bloque: el paralelismo ya está en el pool, no en cada modelo
+        for modelo in [cargado["modelo"]] + [m for m, _ in cargado.get("ensamble") or []]:
+            if hasattr(modelo, "n_jobs"): modelo.n_jobs = 1
+        _modelos_en_proceso.guardar(ruta_modelo, cargado)
+    return curvas_bloque(cargado, np.load(ruta_fondo, mmap_mode='r'), tareas, probabilidad)
+
+def _repartir_en_bloques(tareas: list, filas_fondo: int) -> list:
+    """ Agrupa tareas consecutivas hasta Config.SENSIBILIDAD_FILAS_POR_BLOQUE filas por predicción. """
+    bloques, actual, filas = [], [], 0
+    for tarea in tareas:
+        filas_tarea = len(tarea[1]) * filas_fondo
+        if actual and filas + filas_tarea > Config.SENSIBILIDAD_FILAS_POR_BLOQUE:
+            bloques.append(actual); actual, filas = [], 0
+        actual.append(tarea); filas += filas_tarea
+    if actual: bloques.append(actual)
+    return bloques
+
+def _volcar_modelo(experimento_id: str, cargado: dict) -> str:
+    """ Copia del modelo en disco para los procesos del pool (se escribe una vez por experimento). """
+    ruta = os.path.join(Config.DATASET_CACHE_DIR, "modelos_experimentos", f"{experimento_id}.joblib")
+    if not os.path.exists(ruta):
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        ruta_tmp = f"{ruta}.{os.getpid()}.tmp"
+        joblib.dump(cargado, ruta_tmp)
+        os.replace(ruta_tmp, ruta)
+    return ruta
+
+def calcular_curvas(experimento_id: str, cargado: dict, X_fondo: np.ndarray, tareas: list, probabilidad: bool) -> tuple:
+    """ Curvas de todas las tareas: en este proceso si caben en un bloque; si no, un bloque por proceso del pool. """
+    bloques = _repartir_en_bloques(tareas, len(X_fondo))
+    if len(bloques) == 1: return curvas_bloque(cargado, X_fondo, tareas, probabilidad), 1
+    ruta_modelo = _volcar_modelo(experimento_id, cargado)
+    fd, ruta_fondo = tempfile.mkstemp(prefix="sensibilidad_", suffix=".npy")
+    try:
+        with os.fdopen(fd, "wb") as archivo:
+            np.save(archivo, np.ascontiguousarray(X_fondo, dtype=np.float64))
+        resultados = mapear_en_procesos(_evaluar_bloque, [(ruta_modelo, ruta_fondo, bloque, probabilidad) for bloque in bloques])
+    finally:
+        os.remove(ruta_fondo)
+    return [curva for resultado in resultados for curva in resultado], len(bloques)
+
+# =============================================================================
+# 3️⃣ Sensibilidad por Modelo (dependencia parcial u OAT)
+# =============================================================================
+def generar_sensibilidad_modelo(dataset_id: str, experimento_id: str, metodo: str = "pd", puntos: int = None, muestra: int = None, referencia: dict = None) -> dict:
+    """
+    Curva de la predicción del modelo del experimento frente a cada variable de entrada:
+    - "pd": dependencia parcial, media de las predicciones sobre una muestra de filas del dataset
+      con la variable fijada en cada punto de la rejilla.
+    - "oat": una variable cada vez alrededor de una fila de referencia (la mediana del dataset, o `referencia`).
+    El "impacto" es el rango de la curva en % de la predicción base; las variables salen ordenadas por impacto.
+    """
+    inicio = time.perf_counter()
+    metodo = (metodo or "pd").lower()
+    if metodo not in METODOS_SENSIBILIDAD: raise ValueError(f"Método '{metodo}' no válido. Opciones: {list(METODOS_SENSIBILIDAD)}")
+    puntos = puntos or Config.SENSIBILIDAD_PUNTOS
+    muestra = muestra or Config.SENSIBILIDAD_MUESTRA_FONDO
+    if not 2 <= puntos <= 200: raise ValueError("'puntos' debe estar entre 2 y 200.")
+    if not 1 <= muestra <= 10000: raise ValueError("'muestra' debe estar entre 1 y 10000.")
+    print(f"-> generando_sensibilidad_modelo ({metodo}) del experimento {experimento_id} sobre dataset {dataset_id}")
+
+    cargado = cargar_modelo_experimento(experimento_id)
+    columnas = cargado["columnas"]
+    probabilidad = cargado["label_encoder"] is not None
+    if probabilidad and len(cargado["label_encoder"].classes_) != 2:
+        raise ValueError("La sensibilidad por modelo admite regresión o clasificación binaria.")
+
+    # Solo las columnas de entrada del experimento (las dummies 'zona_X' salen de 'zona')
+    df = obtener_dataframe_crudo(dataset_id, columnas=list(cargado["columnas_entrada"]) or None)
+    if df.empty or not any(c in df.columns for c in cargado["columnas_entrada"]):
+        raise ValueError("El dataset no tiene las columnas de entrada del experimento.")
+    X_completo = preparar_matriz_modelo(df, columnas)
+
+    if metodo == "pd":
+        X_fondo = X_completo.sample(n=min(muestra, len(X_completo)), random_state=42).to_numpy()
+    else:
+        fila = X_completo.median()
+        for col, valor in (referencia or {}).items():
+            if col not in fila.index: raise ValueError(f"Columna de referencia '{col}' no usada por el modelo.")
+            try: fila[col] = float(valor)
+            except (TypeError, ValueError): raise ValueError(f"Valor inválido para '{col}': '{valor}'.")
+        X_fondo = fila.to_numpy().reshape(1, -1)
+
+    tareas = [(j, rejilla_variable(X_completo[col].to_numpy(), puntos)) for j, col in enumerate(columnas)]
+    curvas, bloques = calcular_curvas(experimento_id, cargado, X_fondo, tareas, probabilidad)
+
+    # Predicción base: la media sobre el fondo (en OAT, la de la fila de referencia)
+    base = float(np.mean(predecir_lote(cargado, cargado["scaler_x"].transform(pd.DataFrame(X_fondo, columns=columnas)), probabilidad=probabilidad)))
+
+    variables = []
+    for col, (_, rejilla), curva in zip(columnas, tareas, curvas):
+        rango = float(np.max(curva) - np.min(curva))
+        impacto = rango / abs(base) * 100 if base else 0.0
+        variables.append({"variable": col, "valores": np.round(rejilla, 4).tolist(), "prediccion": np.round(curva, 4).tolist(), "rango": round(rango, 4), "impacto": round(impacto, 2) if np.isfinite(impacto) else 0})
+    variables.sort(key=lambda v: v["rango"], reverse=True)
+    return {
+        "experimento_id": experimento_id, "metodo": metodo,
+        "objetivo": "probabilidad" if probabilidad else "prediccion",
+        "prediccion_base": round(base, 4), "filas_fondo": len(X_fondo),
+        "predicciones_evaluadas": int(sum(len(r) for _, r in tareas) * len(X_fondo)), "bloques": bloques,
+        "variables": variables, "tiempo": round(time.perf_counter() - inicio, 4)
+    }
@@ -0,0 +1,119 @@
+import os
+import re
+import time
+import threading
+from contextlib import contextmanager
+from app.config import Config
+
+try:
+    import fcntl # Bloqueo entre procesos (solo POSIX)
+except ImportError:
+    fcntl = None
+
+# =============================================================================
+# 1️⃣ Single-flight: una sola carga en vuelo por clave
+# =============================================================================
+class _Vuelo:
+    def __init__(self):
+        self.terminado = threading.Event()
+        self.resultado = None
+        self.error = None
+        self.esperando = 0
+
+
+class SingleFlight:
+    """
+    Deduplica trabajo concurrente por clave: si varias peticiones piden la misma clave a la vez,
+    solo la primera (líder) ejecuta la función y las demás esperan su resultado (o su excepción).
+
+    Dentro de un proceso se coordina con un Event por clave. Entre workers de gunicorn, el líder
+    toma además un flock sobre un archivo de la clave, así un segundo worker espera a que el primero
+    termine y encuentra el resultado ya en la caché compartida en lugar de repetir la descarga.
+    """
+    def __init__(self, nombre: str, directorio_locks: str):
+        self.nombre = nombre
+        self.directorio_locks = directorio_locks
+        self._lock = threading.Lock()
+        self._vuelos = {}
+        self._contadores = {"lideres": 0, "coalescidas": 0, "esperas_entre_procesos": 0, "errores": 0, "segundos_ejecutando": 0.0, "segundos_esperando": 0.0}
+        os.makedirs(self.directorio_locks, exist_ok=True)
+
+    def _contar(self, contador: str, cantidad=1):
+        with self._lock:
+            self._contadores[contador] += cantidad
+
+    @contextmanager
+    def _lock_entre_procesos(self, clave: str):
+        if fcntl is None:
+            yield
+            return
+        nombre = re.sub(r"[^A-Za-z0-9_-]", "_", str(clave))
+        with open(os.path.join(self.directorio_locks, f"{self.nombre}__{nombre}.lock"), "w") as archivo:
+            try:
+                fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Otro worker ya está cargando esta clave: esperar a que termine
+                self._contar("esperas_entre_procesos")
+                inicio = time.time()
+                fcntl.flock(archivo, fcntl.LOCK_EX)
+                self._contar("segundos_esperando", time.time() - inicio)
+            try:
+                yield
+            finally:
+                fcntl.flock(archivo, fcntl.LOCK_UN)
+
+    def ejecutar(self, clave: str, funcion):
+        """ Ejecuta funcion() una sola vez por clave entre las llamadas concurrentes y devuelve su resultado. """
+        with self._lock:
+            vuelo = self._vuelos.get(clave)
+            es_lider = vuelo is None
+            if es_lider:
+                vuelo = self._vuelos[clave] = _Vuelo()
+                self._contadores["lideres"] += 1
+            else:
+                vuelo.esperando += 1
+                self._contadores["coalescidas"] += 1
+
+        if not es_lider:
+            inicio = time.time()
+            vuelo.terminado.wait()
+            self._contar("segundos_esperando", time.time() - inicio)
+            if vuelo.error is not None: raise vuelo.error
+            return vuelo.resultado
+
+        inicio = time.time()
+        try:
+            with self._lock_entre_procesos(clave):
+                vuelo.resultado = funcion()
+            return vuelo.resultado
+        except Exception as e:
+            vuelo.error = e
+            self._contar("errores")
+            raise
+        finally:
+            with self._lock:
+                self._vuelos.pop(clave, None) # Las llamadas posteriores empiezan un vuelo nuevo
+                self._contadores["segundos_ejecutando"] += time.time() - inicio
+            vuelo.terminado.set()
+
+    def estadisticas(self) -> dict:
+        """ Contadores del proceso actual: cargas ejecutadas (líderes) frente a peticiones que esperaron a otra. """
+        with self._lock:
+            contadores = dict(self._contadores)
+            en_vuelo = {clave: vuelo.esperando for clave, vuelo in self._vuelos.items()}
+        total = contadores["lideres"] + contadores["coalescidas"]
+        contadores["segundos_ejecutando"] = round(contadores["segundos_ejecutando"], 3)
+        contadores["segundos_esperando"] = round(contadores["segundos_esperando"], 3)
+        return {
+            **contadores,
+            "tasa_coalescencia": round(contadores["coalescidas"] / total, 4) if total else 0.0,
+            "en_vuelo": en_vuelo,
+            "pid": os.getpid()
+        }
+
+
+# Cargas de datasets (descarga + parseo + escritura en la caché), una por dataset a la vez
+cargas_datasets = SingleFlight("datasets", os.path.join(Config.DATASET_CACHE_DIR, "locks"))
+
+# Cálculos de artefactos derivados (perfil, sketches...) de datasets que no los tienen guardados, uno por artefacto a la vez
+calculos_artefactos = SingleFlight("artefactos", os.path.join(Config.DATASET_CACHE_DIR, "locks"))
@@ -0,0 +1,152 @@
+import io
+import os
+import uuid
+import multiprocessing
+import joblib
+import numpy as np
+import pandas as pd
+import torch
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from sklearn.model_selection import KFold, StratifiedKFold
+from sklearn.preprocessing import StandardScaler
+from app.config import Config
+from app.services.cache_service import CacheEnMemoria
+from app.services.entrenamiento_service import entrenar_modelo, metricas_prediccion
+from app.services.cola_entrenamientos_service import ReportadorProgreso
+
+# =============================================================================
+# 1️⃣ Reparto en Pliegues (validacion: 'kfold')
+# =============================================================================
+# Con "validacion": "kfold" el experimento se entrena además en `pliegues` particiones (StratifiedKFold en
+# clasificación, KFold en regresión) en un pool propio de procesos que comparten los arrays preprocesados con
+# memory-map. Las métricas del experimento pasan a ser la media de los pliegues, con "<métrica>_std" su desviación.
+# Con "ensamble_pliegues": true se guardan los modelos de los pliegues y la predicción los promedia. El modelo de
+# la división train/test se sigue entrenando a la vez: de él salen las gráficas, la importancia y el modelo servido.
+
+# Arrays de la validación abiertos por cada proceso (con memory-map)
+_datos_en_proceso = CacheEnMemoria("datos_validacion_proceso", 2)
+
+def asignar_pliegues(y: np.ndarray, pliegues: int, es_clasificacion: bool) -> np.ndarray:
+    """ Número de pliegue de cada fila; estratificado en clasificación salvo que ninguna clase llegue a `pliegues` filas. """
+    asignacion = np.empty(len(y), dtype=np.int32)
+    divisor = StratifiedKFold(n_splits=pliegues, shuffle=True, random_state=42) if es_clasificacion else KFold(n_splits=pliegues, shuffle=True, random_state=42)
+    try:
+        particiones = list(divisor.split(np.zeros(len(y)), y))
+    except ValueError:
+        print("⚠️ Advertencia: La estratificación de los pliegues falló. Usando KFold normal.")
+        particiones = list(KFold(n_splits=pliegues, shuffle=True, random_state=42).split(np.zeros(len(y))))
+    for pliegue, (_, indices_validacion) in enumerate(particiones): asignacion[indices_validacion] = pliegue
+    return asignacion
+
+def datos_pliegue(compartidos: dict, pliegue: int) -> dict:
+    """
+    Mismo formato que preparar_datos_entrenamiento con las filas del pliegue como validación; el StandardScaler
+    se ajusta solo con las filas de entrenamiento del pliegue.
+    """
+    validacion = np.asarray(compartidos["pliegue"]) == pliegue
+    X, y = compartidos["X"], np.asarray(compartidos["y"])
+    scaler_x = StandardScaler()
+    X_train_scaled = scaler_x.fit_transform(X[~validacion]); X_test_scaled = scaler_x.transform(X[validacion])
+    return {
+        'columnas': compartidos["columnas"], 'es_clasificacion': compartidos["es_clasificacion"], 'num_classes': compartidos["num_classes"],
+        'X_train_scaled': X_train_scaled, 'X_test_scaled': X_test_scaled,
+        'y_train': pd.Series(y[~validacion]), 'y_test': pd.Series(y[validacion]),
+        'scaler_x': scaler_x, 'scaler_y': compartidos["scaler_y"], 'label_encoder': None
+    }
+
+# =============================================================================
+# 2️⃣ Entrenamiento de un Pliegue (proceso del pool)
+# =============================================================================
+def _serializar(objeto, es_red: bool) -> bytes:
+    buffer = io.BytesIO()
+    if es_red: torch.save(objeto.state_dict(), buffer) # Solo los pesos, como el modelo principal
+    else: joblib.dump(objeto, buffer)
+    return buffer.getvalue()
+
+def _entrenar_pliegue(ruta_datos: str, pliegue: int, config: dict, experimento_id: str, hilos: int, guardar_modelo: bool) -> dict:
+    """ Entrena y puntúa un pliegue. Con `experimento_id`, cancelar el experimento detiene también el pliegue. """
+    torch.set_num_threads(hilos)
+    compartidos = _datos_en_proceso.obtener(ruta_datos)
+    if compartidos is None:
+        compartidos = joblib.load(ruta_datos, mmap_mode='r')
+        _datos_en_proceso.guardar(ruta_datos, compartidos)
+    datos = datos_pliegue(compartidos, pliegue)
+    es_red = config.get('tipo_modelo') == 'red_neuronal'
+    vigilante = ReportadorProgreso(experimento_id, guardar_epocas=False) if experimento_id else None
+    entrenado = entrenar_modelo(datos, config if es_red else {**config, 'n_jobs': hilos}, progreso=vigilante)
+
+    y_test, y_train = datos["y_test"], datos["y_train"]
+    if datos["scaler_y"] is not None:
+        y_test = datos["scaler_y"].inverse_transform(y_test.to_numpy().reshape(-1, 1)).flatten()
+        y_train = datos["scaler_y"].inverse_transform(y_train.to_numpy().reshape(-1, 1)).flatten()
+    metricas = metricas_prediccion(datos["es_clasificacion"], y_test, entrenado["predicciones"], y_train, entrenado["train_predicciones"])
+    if entrenado["epocas_entrenadas"] is not None: metricas['epocas_entrenadas'] = entrenado["epocas_entrenadas"]
+
+    resultado = {"pliegue": pliegue, "filas_validacion": len(y_test), "metricas": {k: float(v) for k, v in metricas.items() if v is not None}}
+    if guardar_modelo:
+        resultado["modelo"] = _serializar(entrenado["modelo"], es_red)
+        resultado["scaler_x"] = _serializar(datos["scaler_x"], False)
+    print(f"-> Pliegue {pliegue + 1} completado: {resultado['metricas']}")
+    return resultado
+
+def agregar_metricas(resultados: list) -> dict:
+    """ Media y desviación típica ("<métrica>_std") de cada métrica que tienen todos los pliegues. """
+    metricas = {}
+    for clave in resultados[0]["metricas"]:
+        valores = [r["metricas"].get(clave) for r in resultados]
+        if any(v is None for v in valores): continue
+        metricas[clave] = float(np.mean(valores))
+        metricas[f"{clave}_std"] = float(np.std(valores))
+    return metricas
+
+# =============================================================================
+# 3️⃣ Validación Cruzada de un Experimento
+# =============================================================================
+class ValidacionCruzada:
+    """
+    Vuelca los datos preprocesados (una vez) y lanza los pliegues en un pool propio de
+    Config.VALIDACION_PROCESOS procesos al crearse, así el proceso que la crea entrena mientras tanto el
+    modelo train/test. resultados() espera y agrega; cerrar() libera el pool y el volcado.
+    """
+    def __init__(self, config: dict, base: dict, experimento_id: str = None, vigilar: bool = False):
+        self.pliegues = int(config.get('pliegues') or Config.VALIDACION_PLIEGUES)
+        self.ensamble = bool(config.get('ensamble_pliegues'))
+        if len(base['y']) < self.pliegues:
+            raise ValueError(f"El dataset tiene {len(base['y'])} filas; no se puede dividir en {self.pliegues} pliegues.")
+
+        self.ruta_datos = os.path.join(Config.DATASET_CACHE_DIR, "validaciones", f"{experimento_id or uuid.uuid4()}.joblib")
+        os.makedirs(os.path.dirname(self.ruta_datos), exist_ok=True)
+        y = base['y'].to_numpy()
+        joblib.dump({
+            "X": base['X'].to_numpy(dtype=np.float64), "y": y, "pliegue": asignar_pliegues(y, self.pliegues, base['es_clasificacion']),
+            "columnas": base['columnas'], "es_clasificacion": base['es_clasificacion'], "num_classes": base['num_classes'], "scaler_y": base['scaler_y']
+        }, self.ruta_datos)
+
+        procesos = max(1, min(self.pliegues, Config.VALIDACION_PROCESOS))
+        hilos = max(1, (os.cpu_count() or 1) // (procesos + 1)) # +1: el proceso padre entrena a la vez el modelo train/test
+        print(f"-> Validación cruzada: {self.pliegues} pliegues en {procesos} procesos ({hilos} hilos cada uno)")
+        self._pool = ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context("spawn"))
+        self._futuros = [
+            self._pool.submit(_entrenar_pliegue, self.ruta_datos, pliegue, config, experimento_id if vigilar else None, hilos, self.ensamble)
+            for pliegue in range(self.pliegues)
+        ]
+
+    def resultados(self, progreso=None) -> dict:
+        """
+        Espera a todos los pliegues (llamando a `progreso(None)` mientras tanto, que atiende la cancelación) y devuelve
+        {"metricas" (agregadas), "por_pliegue", "modelos" [(modelo, scaler_x) serializados, si hay ensamble]}.
+        """
+        pendientes = set(self._futuros)
+        while pendientes:
+            _, pendientes = wait(pendientes, timeout=Config.ENTRENAMIENTO_INTERVALO_PROGRESO, return_when=FIRST_COMPLETED)
+            if progreso and pendientes: progreso(None)
+        resultados = sorted((f.result() for f in self._futuros), key=lambda r: r["pliegue"]) # Relanza el error de un pliegue
+        return {
+            "metricas": agregar_metricas(resultados),
+            "por_pliegue": [{"pliegue": r["pliegue"] + 1, "filas_validacion": r["filas_validacion"], "metricas": r["metricas"]} for r in resultados],
+            "modelos": [(r["modelo"], r["scaler_x"]) for r in resultados] if self.ensamble else []
+        }
+
+    def cerrar(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        if os.path.exists(self.ruta_datos): os.remove(self.ruta_datos)
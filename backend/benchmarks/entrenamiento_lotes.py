@@ -0,0 +1,96 @@
+"""
+Benchmark del entrenamiento de NeuralNet: lote completo frente a mini-lotes.
+
+Genera un dataset sintético de viviendas y entrena la misma red (misma semilla, mismo optimizador)
+con una pasada de lote completo por época y con varios tamaños de lote. Mide el tiempo y las épocas
+hasta alcanzar un R² de validación objetivo.
+
+Uso (desde backend/, con el mismo .env que la app):
+    python benchmarks/entrenamiento_lotes.py
+    python benchmarks/entrenamiento_lotes.py --filas 20000 200000 --lotes 64 256 1024 --objetivo 0.9
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import torch
+import torch.nn as nn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+from app.services.entrenamiento_service import NeuralNet, crear_cargador_lotes, entrenar_epoca, r2_tensor
+
+# =============================================================================
+# 1️⃣ Datos Sintéticos (precio no lineal en área, habitaciones, antigüedad y zona)
+# =============================================================================
+def generar_datos(filas: int, semilla: int = 42) -> tuple:
+    rng = np.random.default_rng(semilla)
+    area = rng.uniform(30, 300, filas)
+    habitaciones = rng.integers(1, 6, filas)
+    banos = np.minimum(habitaciones, rng.integers(1, 4, filas))
+    ano = rng.integers(1950, 2024, filas)
+    zona = rng.integers(0, 10, filas)
+    precio = (area * (1500 + 120 * zona) + 8000 * banos + 5000 * np.sqrt(habitaciones)
+              - 400 * (2024 - ano) + 30 * area * np.log1p(zona) + rng.normal(0, 25000, filas))
+    X = np.column_stack([area, habitaciones, banos, ano, zona]).astype(np.float64)
+    return X, precio.reshape(-1, 1)
+
+def preparar_tensores(X: np.ndarray, y: np.ndarray) -> tuple:
+    """ Mismo preprocesado que iniciar_nuevo_entrenamiento: división 80/20 y StandardScaler en X e y. """
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    scaler_x, scaler_y = StandardScaler(), StandardScaler()
+    X_train, X_test = scaler_x.fit_transform(X_train), scaler_x.transform(X_test)
+    y_train, y_test = scaler_y.fit_transform(y_train), scaler_y.transform(y_test)
+    a_tensor = lambda m: torch.tensor(m, dtype=torch.float32)
+    return a_tensor(X_train), a_tensor(y_train), a_tensor(X_test), a_tensor(y_test)
+
+# =============================================================================
+# 2️⃣ Tiempo hasta el R² Objetivo
+# =============================================================================
+def tiempo_hasta_objetivo(tensores: tuple, tamano_lote: int, objetivo: float, tasa: float, max_epocas: int, max_segundos: float) -> dict:
+    X_train_t, y_train_t, X_test_t, y_test_t = tensores
+    torch.manual_seed(42)
+    modelo = NeuralNet(X_train_t.shape[1], 1, is_regression=True)
+    optimizer = torch.optim.Adam(modelo.parameters(), lr=tasa)
+    criterion = nn.MSELoss()
+    cargador = crear_cargador_lotes(X_train_t, y_train_t, {'tamano_lote': tamano_lote})
+
+    entrenamiento, r2, epoca = 0.0, float("-inf"), 0
+    for epoca in range(1, max_epocas + 1):
+        inicio = time.perf_counter()
+        entrenar_epoca(modelo, optimizer, criterion, X_train_t, y_train_t, cargador)
+        entrenamiento += time.perf_counter() - inicio
+        # La evaluación no cuenta en el tiempo: es la misma para todos los tamaños de lote
+        modelo.eval()
+        with torch.no_grad(): r2 = r2_tensor(y_test_t, modelo(X_test_t))
+        if r2 >= objetivo or entrenamiento > max_segundos: break
+    return {"alcanzado": r2 >= objetivo, "epocas": epoca, "segundos": entrenamiento, "r2": r2}
+
+# =============================================================================
+# 3️⃣ Ejecución
+# =============================================================================
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, nargs="+", default=[20000, 200000])
+    parser.add_argument("--lotes", type=int, nargs="+", default=[64, 256, 1024, 4096], help="Tamaños de lote a comparar con el lote completo (0)")
+    parser.add_argument("--objetivo", type=float, default=0.95, help="R² de validación a alcanzar")
+    parser.add_argument("--tasa", type=float, default=0.001, help="Tasa de aprendizaje de Adam")
+    parser.add_argument("--max-epocas", type=int, default=2000)
+    parser.add_argument("--max-segundos", type=float, default=120.0, help="Tiempo de entrenamiento máximo por configuración")
+    args = parser.parse_args()
+
+    for filas in args.filas:
+        tensores = preparar_tensores(*generar_datos(filas))
+        print(f"\n{filas:,} filas ({len(tensores[0]):,} de entrenamiento), R² objetivo {args.objetivo}")
+        print(f"{'lote':>10} {'épocas':>8} {'segundos':>10} {'R² final':>10}  alcanzado")
+        referencia = None
+        for tamano_lote in [0] + args.lotes:
+            r = tiempo_hasta_objetivo(tensores, tamano_lote, args.objetivo, args.tasa, args.max_epocas, args.max_segundos)
+            if tamano_lote == 0: referencia = r
+            mejora = f" ({referencia['segundos'] / r['segundos']:.1f}x)" if referencia["alcanzado"] and r["alcanzado"] and tamano_lote else ""
+            print(f"{'completo' if tamano_lote == 0 else tamano_lote:>10} {r['epocas']:>8} {r['segundos']:>10.2f} {r['r2']:>10.4f}  {'sí' if r['alcanzado'] else 'no'}{mejora}")
+
+if __name__ == "__main__":
+    main()
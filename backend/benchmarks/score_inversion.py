@@ -0,0 +1,201 @@
+"""
+Benchmark de calcular_score_inversion: motor vectorizado frente a la versión fila a fila.
+
+Genera datasets sintéticos de 10k, 100k y 1M filas, mide ambas versiones y comprueba que
+el JSON que sirve la ruta /score-inversion sea idéntico byte a byte.
+
+Uso (desde backend/, con el mismo .env que la app):
+    python benchmarks/score_inversion.py
+    python benchmarks/score_inversion.py --filas 10000 100000 --repeticiones 3
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flask import Flask, json
+from app.services.analisis_service import calcular_score_inversion
+
+# =============================================================================
+# 1️⃣ Versión de referencia (fila a fila)
+# =============================================================================
+def score_inversion_fila_a_fila(df: pd.DataFrame, col_precio: str = 'precio', col_area: str = 'area_m2', col_ano: str = 'ano_construccion', col_zona: str = 'zona') -> dict:
+    """ Versión anterior de calcular_score_inversion (iterrows + apply por fila), como referencia. """
+    default_stats = {"propiedades": [], "estadisticas": {"score_promedio": 0.0, "total_propiedades": 0, "distribucion": {"excelente": 0, "muy_bueno": 0, "bueno": 0, "regular": 0, "bajo": 0}}}
+    try:
+        if df.empty:
+             print("   Dataset vacío, no se puede calcular score.")
+             return default_stats
+        df_scores = df.copy()
+
+        # --- Funciones de cálculo de score (robustecidas) ---
+        def score_precio_func(serie):
+            serie = serie.replace([np.inf, -np.inf], np.nan).dropna() # Limpiar serie
+            if serie.empty or serie.nunique() < 2: return pd.Series([50] * len(serie), index=serie.index) # Usar longitud original o la limpia? Usar limpia por ahora.
+            mean, std = serie.mean(), serie.std()
+            if std > 0 and pd.notna(std):
+                z = (serie - mean) / std; z_clamped = z.clip(-2, 2)
+                score = ((-z_clamped + 2) / 4) * 100
+                return score.fillna(50)
+            else: return pd.Series([50] * len(serie), index=serie.index)
+
+        def score_antiguedad_func(serie):
+            serie = serie.replace([np.inf, -np.inf], np.nan).dropna()
+            if serie.empty or serie.nunique() < 2: return pd.Series([50] * len(serie), index=serie.index)
+            min_val, max_val = serie.min(), serie.max()
+            if max_val > min_val and pd.notna(min_val) and pd.notna(max_val):
+                 score = ((serie - min_val) / (max_val - min_val)) * 100
+                 return score.fillna(50)
+            else: return pd.Series([50] * len(serie), index=serie.index)
+
+        def score_zona_func(serie): # Asume zona numérica, ID bajo = mejor
+             serie = serie.replace([np.inf, -np.inf], np.nan).dropna()
+             if serie.empty or serie.nunique() < 2: return pd.Series([50] * len(serie), index=serie.index)
+             min_val, max_val = serie.min(), serie.max()
+             if max_val > min_val and pd.notna(min_val) and pd.notna(max_val):
+                  score = (1 - (serie - min_val) / (max_val - min_val)) * 100
+                  return score.fillna(50)
+             else: return pd.Series([50] * len(serie), index=serie.index)
+
+        # --- Calcular scores individuales ---
+        score_p = pd.Series([50.0] * len(df_scores), index=df_scores.index) # Inicializar con defecto
+        if col_precio in df_scores.columns and pd.api.types.is_numeric_dtype(df_scores[col_precio]):
+             score_p_calc = score_precio_func(df_scores[col_precio])
+             score_p = score_p_calc.reindex(df_scores.index).fillna(50) # Reindexar y rellenar NaNs
+        else: print(f"⚠️ Columna '{col_precio}' no válida para score_precio.")
+
+        score_a = pd.Series([50.0] * len(df_scores), index=df_scores.index)
+        if col_ano in df_scores.columns and pd.api.types.is_numeric_dtype(df_scores[col_ano]):
+             score_a_calc = score_antiguedad_func(df_scores[col_ano])
+             score_a = score_a_calc.reindex(df_scores.index).fillna(50)
+        else: print(f"⚠️ Columna '{col_ano}' no válida para score_antiguedad.")
+
+        score_z = pd.Series([50.0] * len(df_scores), index=df_scores.index)
+        if col_zona in df_scores.columns and pd.api.types.is_numeric_dtype(df_scores[col_zona]):
+             score_z_calc = score_zona_func(df_scores[col_zona])
+             score_z = score_z_calc.reindex(df_scores.index).fillna(50)
+        else: print(f"⚠️ Columna '{col_zona}' no válida para score_zona.")
+
+        df_scores['score_precio'] = score_p
+        df_scores['score_antiguedad'] = score_a
+        df_scores['score_zona'] = score_z
+
+        # Score Combinado (Ponderado)
+        df_scores['score_inversion_float'] = (0.5 * df_scores['score_precio'] + 0.3 * df_scores['score_antiguedad'] + 0.2 * df_scores['score_zona'])
+        df_scores['score_inversion'] = df_scores['score_inversion_float'].fillna(50).round().astype(int).clip(0, 100)
+
+        # Asignar Potencial
+        def asignar_potencial(score):
+            if pd.isna(score): return 'Bajo'
+            score = int(score) # Asegurar que sea int
+            if score >= 80: return 'Excelente';
+            if score >= 65: return 'Muy Bueno';
+            if score >= 50: return 'Bueno';
+            if score >= 35: return 'Regular';
+            return 'Bajo'
+        df_scores['potencial'] = df_scores['score_inversion'].apply(asignar_potencial)
+
+        # Formatear Salida
+        propiedades = []
+        def safe_get(row_dict, key, default=None, round_digits=None, convert_int=False):
+            val = row_dict.get(key)
+            if pd.isna(val) or (isinstance(val, float) and not np.isfinite(val)): return default # Chequear NaN y Inf
+            try:
+                num_val = float(val)
+                if round_digits is not None: num_val = round(num_val, round_digits)
+                if convert_int: return int(num_val)
+                return num_val
+            except (ValueError, TypeError): return val if val is not None else default
+
+        for index, row in df.iterrows(): # Iterar sobre df ORIGINAL para tener todas las filas
+             score_row = df_scores.loc[index] if index in df_scores.index else None
+             if score_row is None or pd.isna(score_row.get('score_inversion')): continue # Saltar si no hay score o es NaN
+
+             prop = {
+                 "indice": int(index),
+                 "precio": safe_get(row, col_precio, default=0.0, round_digits=2),
+                 "score_inversion": int(score_row['score_inversion']),
+                 "potencial": score_row.get('potencial', 'Bajo')
+             }
+             prop['area_m2'] = safe_get(row, col_area, default=0.0, round_digits=2)
+             # CORRECCIÓN: Devolver zona original (puede ser str), manejar NaN
+             zona_val = row.get(col_zona)
+             prop['zona'] = zona_val if pd.notna(zona_val) else None
+             prop['ano_construccion'] = safe_get(row, col_ano, default=0, convert_int=True)
+
+             # Limpiar diccionario final de NaNs flotantes (opcional, pero buena práctica)
+             prop_clean = {}
+             for k, v in prop.items():
+                  if isinstance(v, float) and (pd.isna(v) or not np.isfinite(v)):
+                       prop_clean[k] = None # O 0 según prefieras
+                  else:
+                       prop_clean[k] = v
+             propiedades.append(prop_clean)
+
+
+        propiedades.sort(key=lambda x: x.get('score_inversion', 0), reverse=True)
+
+        # Estadísticas
+        score_promedio_calc = df_scores['score_inversion'].mean() # Ya maneja NaN internamente
+        score_promedio_final = round(score_promedio_calc, 1) if pd.notna(score_promedio_calc) else 0.0
+        distribucion_potencial = df_scores['potencial'].value_counts().to_dict()
+        estadisticas = {
+            "score_promedio": score_promedio_final, "total_propiedades": len(propiedades), # Usar len(propiedades) filtradas
+            "distribucion": {"excelente": distribucion_potencial.get('Excelente', 0), "muy_bueno": distribucion_potencial.get('Muy Bueno', 0), "bueno": distribucion_potencial.get('Bueno', 0), "regular": distribucion_potencial.get('Regular', 0), "bajo": distribucion_potencial.get('Bajo', 0)}
+        }
+
+        if not propiedades: print("⚠️ La lista final de propiedades para score de inversión está vacía.")
+
+        return {"propiedades": propiedades, "estadisticas": estadisticas}
+    except Exception as e:
+        return default_stats
+
+
+# =============================================================================
+# 2️⃣ Datos sintéticos y medición
+# =============================================================================
+def generar_dataset(n: int, zona_numerica: bool = False, semilla: int = 42) -> pd.DataFrame:
+    """ Dataset con la forma de los exports de propiedades, con nulos e infinitos sueltos. """
+    rng = np.random.default_rng(semilla)
+    df = pd.DataFrame({
+        "precio": rng.lognormal(12, 0.5, n).round(2),
+        "area_m2": rng.uniform(30, 400, n),
+        "habitaciones": rng.integers(1, 7, n),
+        "ano_construccion": rng.integers(1940, 2024, n),
+        "zona": rng.integers(1, 12, n) if zona_numerica else rng.choice(["Centro", "Norte", "Sur", "Este", "Oeste"], n),
+    })
+    df.loc[df.sample(frac=0.02, random_state=semilla).index, "precio"] = np.nan
+    df.loc[df.sample(frac=0.01, random_state=semilla + 1).index, "area_m2"] = np.inf
+    return df
+
+def medir(funcion, repeticiones: int) -> tuple:
+    """ (mejor tiempo en segundos, último resultado) """
+    mejor, resultado = float("inf"), None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor, resultado
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeticiones", type=int, default=1)
+    args = parser.parse_args()
+
+    app = Flask(__name__) # Para serializar con el mismo proveedor JSON que jsonify
+    print(f"{'filas':>10} {'zona':>9} {'fila a fila (s)':>16} {'vectorizado (s)':>16} {'speedup':>8}  JSON idéntico")
+    with app.app_context():
+        for n in args.filas:
+            for zona_numerica in (False, True):
+                df = generar_dataset(n, zona_numerica)
+                t_ref, ref = medir(lambda: score_inversion_fila_a_fila(df), args.repeticiones)
+                t_vec, vec = medir(lambda: calcular_score_inversion("benchmark", df=df), args.repeticiones)
+                identico = json.dumps(ref) == json.dumps(vec)
+                print(f"{n:>10} {'numérica' if zona_numerica else 'texto':>9} {t_ref:>16.3f} {t_vec:>16.3f} {t_ref / t_vec:>7.1f}x  {'sí' if identico else 'NO'}")
+
+if __name__ == "__main__":
+    main()
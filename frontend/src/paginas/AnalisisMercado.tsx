@@ -73,7 +73,7 @@ export default function AnalisisMercado() {
       const [segmentacion, anomalias, inversion] = await Promise.all([
         axios.get(`http://localhost:5000/api/datasets/${datasetId}/segmentacion-mercado`).catch(() => ({ data: { distribucion: [], estadisticas: {} } })),
         axios.get(`http://localhost:5000/api/datasets/${datasetId}/anomalias-precios`).catch(() => ({ data: { gangas: [], sobrevaloradas: [], resumen: {} } })),
-        axios.get(`http://localhost:5000/api/datasets/${datasetId}/score-inversion`).catch(() => ({ data: { propiedades: [], estadisticas: {} } }))
+        axios.get(`http://localhost:5000/api/datasets/${datasetId}/score-inversion?limit=20`).catch(() => ({ data: { propiedades: [], estadisticas: {} } }))
       ])
 
       setSegmentos(segmentacion.data.distribucion || [])
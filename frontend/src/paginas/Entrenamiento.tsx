@@ -16,8 +16,12 @@ export default function Entrenamiento() {
     tipo_modelo: 'regresion',
     tasa_aprendizaje: 0.001,
     epocas: 100,
-    tamano_lote: 32,
+    tamano_lote: 256,
     validacion_split: 0.2,
+    paciencia: 10,
+    validacion: 'holdout',
+    pliegues: 5,
+    ensamble_pliegues: false,
   })
 
   useEffect(() => {
@@ -291,17 +295,30 @@ export default function Entrenamiento() {
               </div>
 
               <div>
-                <label className="block text-sm font-semibold text-slate-700 mb-3">Tamaño de Lote</label>
+                <label className="block text-sm font-semibold text-slate-700 mb-3">Tamaño de Lote (0 = lote completo)</label>
                 <input
                   type="number"
                   value={config.tamano_lote}
-                  onChange={(e) => setConfig({ ...config, tamano_lote: parseInt(e.target.value) })}
+                  onChange={(e) => setConfig({ ...config, tamano_lote: parseInt(e.target.value) || 0 })}
                   className="input-field"
-                  min="1"
-                  max="256"
+                  min="0"
+                  max="4096"
                 />
               </div>
 
+              <div>
+                <label className="block text-sm font-semibold text-slate-700 mb-3">Paciencia (parada temprana)</label>
+                <input
+                  type="number"
+                  value={config.paciencia}
+                  onChange={(e) => setConfig({ ...config, paciencia: parseInt(e.target.value) })}
+                  className="input-field"
+                  min="0"
+                  max="200"
+                />
+                <p className="text-xs text-slate-500 mt-2">Épocas sin mejorar la pérdida de validación antes de parar (0 = sin parada temprana).</p>
+              </div>
+
               <div>
                 <div className="flex justify-between items-center mb-3">
                   <label className="block text-sm font-semibold text-slate-700">Split de Validación</label>
@@ -317,6 +334,44 @@ export default function Entrenamiento() {
                   className="w-full h-2 bg-slate-200 rounded-lg appearance-none cursor-pointer accent-emerald-600"
                 />
               </div>
+
+              <div>
+                <label className="block text-sm font-semibold text-slate-700 mb-3">Validación</label>
+                <select
+                  value={config.validacion}
+                  onChange={(e) => setConfig({ ...config, validacion: e.target.value as 'holdout' | 'kfold' })}
+                  className="input-field"
+                >
+                  <option value="holdout">División train/test</option>
+                  <option value="kfold">Validación cruzada (k pliegues)</option>
+                </select>
+              </div>
+
+              {config.validacion === 'kfold' && (
+                <>
+                  <div>
+                    <label className="block text-sm font-semibold text-slate-700 mb-3">Pliegues</label>
+                    <input
+                      type="number"
+                      value={config.pliegues}
+                      onChange={(e) => setConfig({ ...config, pliegues: parseInt(e.target.value) })}
+                      className="input-field"
+                      min="2"
+                      max="20"
+                    />
+                    <p className="text-xs text-slate-500 mt-2">Las métricas serán la media (± desviación) de los pliegues, entrenados en paralelo.</p>
+                  </div>
+                  <label className="flex items-center space-x-3 cursor-pointer">
+                    <input
+                      type="checkbox"
+                      checked={config.ensamble_pliegues}
+                      onChange={(e) => setConfig({ ...config, ensamble_pliegues: e.target.checked })}
+                      className="w-4 h-4 text-primary-600"
+                    />
+                    <span className="text-sm font-semibold text-slate-700">Predecir con el ensamble de los modelos de los pliegues</span>
+                  </label>
+                </>
+              )}
             </div>
           </div>
 
@@ -21,6 +21,33 @@ export default function Resultados() {
     cargarTodosExperimentos()
   }, [experimentoId])
 
+  // Mientras el entrenamiento está en cola o en curso, las épocas llegan por Server-Sent Events
+  const enCurso = experimento ? ['en_cola', 'entrenando', 'cancelando'].includes(experimento.estado) : false
+  useEffect(() => {
+    if (!experimento || !enCurso) return
+    const fuente = new EventSource(`http://localhost:5000/api/entrenamientos/${experimento.id}/eventos?desde=${metricas.length}`)
+    fuente.addEventListener('progreso', (evento) => {
+      const epoca = JSON.parse((evento as MessageEvent).data)
+      setMetricas(prev => [...prev, epoca])
+      setExperimento(prev => prev && prev.estado === 'en_cola' ? { ...prev, estado: 'entrenando' } : prev)
+    })
+    fuente.addEventListener('fin', () => {
+      fuente.close()
+      cargarExperimento(experimento.id)
+      cargarTodosExperimentos()
+    })
+    return () => fuente.close()
+  }, [experimento?.id, enCurso])
+
+  const cancelarEntrenamiento = async (id: string) => {
+    try {
+      const { data } = await axios.post(`http://localhost:5000/api/entrenamientos/${id}/cancelar`)
+      setExperimento(prev => prev ? { ...prev, estado: data.estado } : prev)
+    } catch (error) {
+      console.error('Error al cancelar entrenamiento:', error)
+    }
+  }
+
   const cargarExperimento = async (id: string) => {
     try {
       const { data } = await axios.get(`http://localhost:5000/api/experimentos/${id}`)
@@ -209,10 +236,19 @@ export default function Resultados() {
               <div className="flex items-center gap-3">
                 <span className={`badge text-base px-5 py-2 ${
                   experimento.estado === 'completado' ? 'badge-success' :
-                  experimento.estado === 'entrenando' ? 'badge-warning' : 'badge-error'
+                  enCurso ? 'badge-warning' : 'badge-error'
                 }`}>
                   {experimento.estado}
                 </span>
+                {enCurso && (
+                  <button
+                    onClick={() => cancelarEntrenamiento(experimento.id)}
+                    disabled={experimento.estado === 'cancelando'}
+                    className="px-4 py-2 bg-amber-50 hover:bg-amber-100 text-amber-700 rounded-xl font-semibold transition-all disabled:opacity-50"
+                  >
+                    Cancelar
+                  </button>
+                )}
                 <button
                   onClick={() => confirmarEliminar(experimento)}
                   className="px-4 py-2 bg-rose-50 hover:bg-rose-100 text-rose-600 rounded-xl font-semibold transition-all flex items-center space-x-2"
@@ -228,7 +264,7 @@ export default function Resultados() {
             {experimento.metricas && (
               <div className="grid grid-cols-2 md:grid-cols-4 gap-4 mb-8">
                 {Object.entries(experimento.metricas)
-                  .filter(([clave]) => !['matriz_confusion', 'curva_roc', 'importancia_features', 'distribucion_errores', 'predicciones_vs_reales', 'tiempo_por_epoca'].includes(clave))
+                  .filter(([clave]) => !['matriz_confusion', 'curva_roc', 'importancia_features', 'distribucion_errores', 'predicciones_vs_reales', 'tiempo_por_epoca'].includes(clave) && !clave.endsWith('_std'))
                   .map(([clave, valor]) => (
                   <div key={clave} className="bg-gradient-to-br from-slate-50 to-slate-100 rounded-xl p-5 border-2 border-slate-200">
                     <div className="flex items-center space-x-2 mb-2">
@@ -242,6 +278,9 @@ export default function Resultados() {
                     <p className="text-3xl font-bold text-slate-900">
                       {formatearMetrica(valor)}
                     </p>
+                    {experimento.metricas[`${clave}_std`] !== undefined && (
+                      <p className="text-sm text-slate-500 mt-1">± {formatearMetrica(experimento.metricas[`${clave}_std`])} entre pliegues</p>
+                    )}
                   </div>
                 ))}
               </div>
@@ -30,6 +30,12 @@ export interface ConfiguracionEntrenamiento {
   epocas: number
   tamano_lote: number
   validacion_split: number
+  paciencia?: number
+  fraccion_parada?: number
+  intervalo_evaluacion?: number
+  validacion?: 'holdout' | 'kfold'
+  pliegues?: number
+  ensamble_pliegues?: boolean
 }
 
 export interface Experimento {
@@ -38,7 +44,7 @@ export interface Experimento {
   dataset_id: string
   configuracion: ConfiguracionEntrenamiento
   metricas: any
-  estado: 'entrenando' | 'completado' | 'error'
+  estado: 'en_cola' | 'entrenando' | 'cancelando' | 'completado' | 'completado_sin_artefactos' | 'cancelado' | 'podado' | 'error'
   fecha_creacion: string
   metricas_por_epoca?: MetricasEpoca[]
   matriz_confusion?: number[][]
@@ -55,6 +61,7 @@ export interface MetricasEpoca {
   epoca: number
   perdida_entrenamiento: number
   perdida_validacion: number
+  perdida_parada?: number
   precision_entrenamiento?: number
   precision_validacion?: number
   tiempo?: number